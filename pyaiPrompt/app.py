@@ -3,181 +3,796 @@ This module contains a Flask app that communicates with a virtual machine via XM
 and performs an action based on the user input from a the pyaiPrompt web app.
 
 Dependencies:
-- re: for regular expressions
+- collections: for counting the outcomes of a batch
+- concurrent.futures: for running the parts of large code at once
+- json: for the newline-delimited results of a batch
 - os: for operating system commands
+- queue: for collecting the results of the files of a batch as they finish
 - subprocess: for running external commands
 - xmlrpc.client: for XML-RPC communication
 - socket: for socket operations
+- threading: for dropping the queued files of a batch whose client went away
 - flask: for web application framework
+- cache: for replaying the output of prompts that were already answered
+- chunker: for splitting large code into parts that are sent to the VMs at once
+- extractor: for pulling the code out of the AI output
+- jobs: for keeping each prompt's output separate and queueing the prompts
+- metrics: for timing the stages of each prompt and the /metrics endpoint
+- outputstream: for streaming the extracted code to the browser
+- rpcclient: for thread-safe pooled calls to the virtual machines
+- transport: for decoding the JSON, compressed and archive bodies of /api/prompt and /api/batch
 """
 
+import collections
+import json
 import time
 import os
-import re
+import queue
 import socket
 import subprocess
+import threading
 import xmlrpc.client
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from flask import Flask, request, render_template
+from flask import Flask, Response, abort, jsonify, request, render_template, stream_with_context
+
+from cache import ResponseCache, cache_key
+from chunker import MAX_CHUNK_CHARS, Stitcher, chunk_context, split
+from extractor import CodeFenceExtractor, extract_code
+from jobs import Job, JobQueue, JobRegistry, QueueFull, RegistryFull
+from metrics import Gauge, Trace, registry
+from outputstream import format_cursor, parse_cursor, sse_events
+from rpcclient import BackendPool
+from transport import MAX_BODY_BYTES, PayloadError, decode_batch, decode_prompt
 
 
 # Set default timeout for socket operations in seconds
 SOCKET_TIMEOUT = 120
 
+# Longest time a prompt may take in seconds
+PROMPT_TIMEOUT = 600
+
+# Seconds each wait_output call may block on the VM before returning
+WAIT_TIMEOUT = 10
+
+# Socket timeout for the quick calls made while polling the VM in seconds
+POLL_TIMEOUT = 10
+
+# Seconds between keep-alive comments on an idle event stream
+STREAM_KEEPALIVE = 15
+
+# Number of files of a batch sent to the AI at once, unless the request asks for another number
+BATCH_PARALLELISM = 4
+
+# Largest number of files of a batch that may be sent to the AI at once
+MAX_BATCH_PARALLELISM = 16
+
+# Number of parts of large code sent to each VM at once
+CHUNKS_PER_BACKEND = 2
+
 # Name of the virtual machine
 VM_NAME = 'pyaiPrompt'
 
+# URLs of the XML-RPC servers in the virtual machines, separated by commas in PYAI_BACKENDS
+VM_URLS = os.environ.get('PYAI_BACKENDS', 'http://127.0.0.1:8000/').split(',')
+
+# Directory that keeps cached outputs across restarts, or unset to keep them in memory only
+CACHE_DIR = os.environ.get('PYAI_CACHE_DIR')
+
 # Create the app object
 app = Flask(__name__)
 
-# Global variable to store the current value of line
-output_string = ""
+# Registry of the running and recently finished prompts
+jobs = JobRegistry()
+
+# Queue and worker pool that run the prompts
+job_queue = JobQueue()
+
+# Outputs of finished prompts by the hash of their inputs
+responses = ResponseCache(directory=CACHE_DIR)
+
+# Number of prompts waiting for a worker, read when /metrics is scraped
+registry.register(Gauge("pyai_queue_depth", "Prompts waiting for a worker.",
+                        lambda: job_queue.stats()['queued']))
+
+
+def find_job(job_id):
+    """Look up a job by its ID.
+
+    There is no fallback to another job for clients that do not send an ID, since
+    that would show one user's output to another.
+
+    Args:
+        job_id (str): The job ID, or None
+
+    Returns:
+        Job: The job
+
+    Raises:
+        BadRequest: If no job ID was given
+        NotFound: If there is no such job
+    """
+    if not job_id:
+        abort(400, description="job_id is required")
+    job = jobs.get(job_id)
+    if job is None:
+        abort(404)
+    return job
+
 
 @app.route("/get_line")
 def get_line():
-    global output_string
-    print(output_string)
-    return output_string
+    """Return the code extracted since a cursor, for clients that poll.
+
+    With an offset, only the new text is returned as JSON, along with the cursor
+    to send next time, whether the client has to replace its text instead of
+    appending to it, and whether the prompt has finished. Without an offset, the
+    whole text is returned, or "END" once the prompt has finished, as older
+    clients expect. New clients should use /stream/<job_id>.
+
+    Args:
+        job_id (str): The job to read
+        offset (str): The cursor from the last reply, or "0" for the start
+
+    Returns:
+        Response: {"text", "offset", "replace", "done"} as JSON, or the legacy plain text
+    """
+    job = find_job(request.args.get('job_id'))
+    cursor = request.args.get('offset')
+    if cursor is None:
+        if job.stream.done:
+            return "END"
+        return job.stream.text
+    generation, offset = parse_cursor(cursor)
+    # Check the stream's done flag first, so a finished reply always holds the last text
+    done = job.stream.done
+    generation, offset, text, replaced, _ = job.stream.wait(generation, offset, 0)
+    return jsonify(text=text, offset=format_cursor(generation, offset), replace=replaced, done=done)
+
+
+@app.route("/stream/<job_id>")
+def stream(job_id):
+    """Stream the code extracted for a job to the browser as Server-Sent Events.
+
+    A browser that reconnects sends the id of the last event it got as
+    Last-Event-ID, and only the text after it is sent again.
+
+    Args:
+        job_id (str): The job to follow
+        offset (str): The cursor to resume from if there is no Last-Event-ID header
+
+    Returns:
+        Response: A text/event-stream response with "replace", "append" and "done" events.
+    """
+    job = find_job(job_id)
+    cursor = request.headers.get('Last-Event-ID') or request.args.get('offset')
+    return Response(stream_with_context(sse_events(job.stream, STREAM_KEEPALIVE, cursor)),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
     
 # Define the routes and functions for the app
 @app.route('/save_files', methods=['POST'])
 def save_files():
-    """Get text data from two textboxes from a webapp and perform an action in a 
-    virtual machine, then return the output back into the third textbox on the webapp.
+    """Get text data from two textboxes from a webapp and start an action in a 
+    virtual machine. The output is streamed back into the third textbox on the
+    webapp through /stream/<job_id>.
+
+    This is the legacy form of /api/prompt, kept for clients that still post a
+    form with + and & escaped as @PLUS@#@SIGN@ and @AMPER@#@SIGN@.
 
     Args:
         code (str): The code from the first textbox
         context (str): The context from the second textbox
         pyaiType (str): The type of pyai operation (code or debug)
+        nocache (str): Set to skip the cache and ask the AI again
 
     Returns:
-        str: The output of the pyai operation or an error message
+        tuple: The new job ID, its queue position and estimated wait in seconds
+        with the 202 Accepted status code, or an error and 503 Service
+        Unavailable if the queue is full
     """
     
-    global output_string
-    output_string = ""
-    
-    # Get the code from the first textbox
-    code = request.form['code']
-    # Replace @PLUS@#@SIGN@ with + in the code
-    code = code.replace("@PLUS@#@SIGN@", "+")
-    code = code.replace("@AMPER@#@SIGN@", "&")
-    
-    # Get the context from the second textbox
-    context = request.form['context']
+    # Time the prompt from here to its last output
+    trace = Trace()
+    try:
+        with trace.span("parse"):
+            # Get the code from the first textbox
+            code = request.form['code']
+            # Replace @PLUS@#@SIGN@ with + in the code
+            code = code.replace("@PLUS@#@SIGN@", "+")
+            code = code.replace("@AMPER@#@SIGN@", "&")
+            
+            # Get the context from the second textbox
+            context = request.form['context']
+
+            # Get the pyaiType from the form
+            pyaiType = request.form['pyaiType']
+        return submit_prompt(trace, code, context, pyaiType, bool(request.form.get('nocache')))
+    except Exception:
+        # A form with a missing field is refused with 400 Bad Request and never reaches the queue
+        trace.finish("rejected")
+        raise
+
 
-    # Get the pyaiType from the form
-    pyaiType = request.form['pyaiType']
+@app.route('/api/prompt', methods=['POST'])
+def api_prompt():
+    """Start an action in a virtual machine from a JSON body, which may be
+    compressed with gzip or deflate as given by the Content-Encoding header.
+    The output is streamed back through /stream/<job_id>.
 
-    # Try to call the prompt_ai method on the proxy with code and context as arguments
+    Args:
+        code (str): The code from the first textbox
+        context (str): The context from the second textbox
+        pyaiType (str): The type of pyai operation (code or debug)
+        nocache (bool): True to skip the cache and ask the AI again
+
+    Returns:
+        tuple: The same replies as /save_files, or an error with 400 Bad Request,
+        413 Payload Too Large or 415 Unsupported Media Type if the body is not a
+        valid prompt
+    """
+    trace = Trace()
     try:
-        # Check if the input type is code
-        if pyaiType == "code":
-            # Remove any leading or trailing whitespace from the code and context
-            code = code.strip()
-            context = context.strip()
-            # Send the code and context to the proxy AI
-            proxy.prompt_ai(code, context)
-            # Wait for 9 seconds for the AI to process the input
-            time.sleep(9)
-            # Initialize variables to track the output length and changes
-            prev_length = 0
-            count = 0
-            # Loop until there is no change in the output for 16 iterations
-            while True:
-                # Get the current output from the proxy AI
-                new_output = proxy.getOutput()
-                # Check if the output length is the same as before and not empty
-                if len(new_output) == prev_length and len(new_output) > 1:
-                    # Increment the count of unchanged iterations
-                    count += 1
-                    # If the count reaches 16, print "no change" and break the loop
-                    if count == 16:
-                        print("no change")
-                        time.sleep(0.20)
+        with trace.span("parse"):
+            # Refuse oversized bodies before reading them
+            if request.content_length is not None and request.content_length > MAX_BODY_BYTES:
+                raise PayloadError(f"the body is larger than {MAX_BODY_BYTES} bytes", 413)
+            prompt = decode_prompt(request.get_data(cache=False),
+                                   request.headers.get('Content-Encoding', ''))
+        return submit_prompt(trace, prompt['code'], prompt['context'], prompt['pyaiType'], prompt['nocache'])
+    except PayloadError as e:
+        trace.finish("rejected")
+        return jsonify(error=str(e)), e.status
+    except Exception:
+        # Stop counting a prompt that failed before it reached the queue, such as a body cut short
+        trace.finish("rejected")
+        raise
+
+
+@app.route('/api/batch', methods=['POST'])
+def api_batch():
+    """Run the same prompt on every file of a project and stream the result of each
+    file back as a line of JSON as soon as it is done.
+
+    The files are sent as a JSON object, or as a zip or tar archive with the other
+    arguments in the query string, and the body may be compressed as for
+    /api/prompt. The files run on the job queue with every other prompt, up to
+    parallelism of them queued at once.
+
+    Args:
+        files (dict): The source of each file by its path
+        context (str): The context shared by every file
+        pyaiType (str): The type of pyai operation (code or debug)
+        nocache (bool): True to skip the cache and ask the AI again
+        parallelism (int): The number of files to send at once
+
+    Returns:
+        Response: An application/x-ndjson response with a {"path", "status",
+        "output" or "error", "seconds"} line for each file in the order they
+        finish, then a {"done", "files"} line with the count of each status, an
+        error as for /api/prompt if the body is not a valid batch, or an error and
+        503 Service Unavailable if the queue is full
+    """
+    try:
+        # Refuse oversized bodies before reading them
+        if request.content_length is not None and request.content_length > MAX_BODY_BYTES:
+            raise PayloadError(f"the body is larger than {MAX_BODY_BYTES} bytes", 413)
+        batch = decode_batch(request.get_data(cache=False), request.headers.get('Content-Encoding', ''),
+                             request.mimetype, request.args)
+    except PayloadError as e:
+        return jsonify(error=str(e)), e.status
+    parallelism = min(max(1, batch['parallelism'] or BATCH_PARALLELISM), MAX_BATCH_PARALLELISM)
+    try:
+        results = run_batch(batch['files'], batch['context'], batch['pyaiType'], parallelism, batch['nocache'])
+    except QueueFull as e:
+        return busy(str(e))
+    return Response(stream_with_context(results), mimetype='application/x-ndjson',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+def run_batch(files, context, pyaiType, parallelism, nocache=False):
+    """Queue the prompt of every file of a batch on the job queue, at most parallelism
+    at once, and return their results as they finish.
+
+    The files share the workers and the limit of the job queue with every other prompt.
+    The first file is queued before anything is returned, so a batch that arrives while
+    the queue is full is turned away at once. A later file that finds the queue full
+    waits for one of the batch's own files to finish, or fails if none is left to wait
+    for. The files that have not started are dropped if the client goes away.
+
+    Args:
+        files (dict): The source of each file by its path
+        context (str): The context shared by every file
+        pyaiType (str): The type of pyai operation (code or debug)
+        parallelism (int): The number of files to queue at once
+        nocache (bool): True to skip the cache and ask the AI again
+
+    Returns:
+        generator: A line of JSON with the result of each file as it finishes, then a
+        line with the number of files of each status
+
+    Raises:
+        QueueFull: If the job queue cannot take the first file
+    """
+    results = queue.Queue()
+    stop = threading.Event()
+    pending = collections.deque(files.items())
+
+    def submit(path, code):
+        job_queue.submit(Job(), run_file, path, code, context, pyaiType, nocache, results, stop)
+
+    submit(*pending[0])
+    pending.popleft()
+    return batch_results(pending, len(files), parallelism, submit, results, stop)
+
+
+def batch_results(pending, total, parallelism, submit, results, stop):
+    """Yield the results of a batch as its files finish, queueing the pending files
+    as the earlier ones make room.
+
+    Args:
+        pending (deque): The (path, source) of the files that are not queued yet
+        total (int): The number of files of the batch
+        parallelism (int): The number of files to queue at once
+        submit (callable): Queues a file given its path and source
+        results (queue.Queue): Where run_file puts the result of each file
+        stop (threading.Event): Set to drop the queued files that have not started
+
+    Yields:
+        str: A line of JSON with the result of each file, then the summary line
+    """
+    # The first file was queued by run_batch
+    running = 1
+    counts = collections.Counter()
+    try:
+        while running or pending:
+            while pending and running < parallelism:
+                try:
+                    submit(*pending[0])
+                except QueueFull as e:
+                    if running:
+                        # Wait for a file of this batch to make room
                         break
-                else:
-                    # Reset the count to zero if there is a change in the output length
-                    count = 0
-                # Update the previous output length to the current one
-                prev_length = len(new_output)
-                # Initialize an empty string to store the pre-processed output
-                pre_output_string = ""
-                # Initialize a flag to indicate whether to skip a line or not
-                flag = False
-                # Split the output into lines and remove any lines that match a URL pattern
-                lines = [line + "\n" for line in new_output.splitlines() if not re.match(r'\[\d+\]: https://', line)]
-                # Loop through each line in the output
-                for line in lines:
-                    # If the line contains 'xxx' and the flag is False, set the flag to True and skip the line
-                    if '```' in line and not flag:
-                        flag = True
-                        continue
-                    # If the flag is True, append the line to the pre-processed output string
-                    elif flag:
-                        pre_output_string += line
-                    # Otherwise, do nothing
-                    else:
-                        pass
-                # Check if '```' is still in the pre-processed output string
-                if '```' in pre_output_string:
-                    # Remove everything after 'xxx' from the pre-processed output string
-                    output_string = re.sub(r'```.*$', '', pre_output_string)
-                    # Wait for 1.5 seconds before returning the final output string
-                    time.sleep(1.5)
-                    output_string  = "END"
-                    return output_string 
-                else:
-                    # Set the output string to be the same as the pre-processed output string
-                    output_string = pre_output_string
-                    # Wait for 0.20 seconds before printing the output string
-                    time.sleep(0.20)
-                    print(output_string)
-            
-            output_string  = "END"
-      
+                    path, _ = pending.popleft()
+                    result = {'path': path, 'status': "error", 'seconds': 0.0, 'error': str(e)}
+                    counts[result['status']] += 1
+                    yield json.dumps(result) + "\n"
+                    continue
+                pending.popleft()
+                running += 1
+            if not running:
+                continue
+            result = results.get()
+            running -= 1
+            counts[result['status']] += 1
+            yield json.dumps(result) + "\n"
+        yield json.dumps(dict(counts, done=True, files=total)) + "\n"
+    finally:
+        stop.set()
+
+
+def run_file(job, path, code, context, pyaiType, nocache, results, stop):
+    """Run the prompt of one file of a batch, or replay its cached output, and put the
+    result on the batch's results queue. Called by a worker of the job queue.
+
+    Args:
+        job (Job): The job to write the output to
+        path (str): The path of the file
+        code (str): The source of the file
+        context (str): The context shared by every file
+        pyaiType (str): The type of pyai operation (code or debug)
+        nocache (bool): True to skip the cache and ask the AI again
+        results (queue.Queue): Where to put the path, the status ("ok", "cached",
+            "error" or "timeout"), the output or error and the seconds the file took
+        stop (threading.Event): Set if the client went away and the file should not run
+    """
+    if stop.is_set():
+        return
+    try:
+        key = cache_key(code, context, pyaiType)
+        cached = None if nocache else responses.get(key)
+        # Start the trace only once nothing but run_prompt, which always finishes it, can fail
+        trace = Trace(pyaiType, job.id)
+        if cached is not None:
+            trace.finish("cached")
+            status, text = "cached", cached
         else:
-            # Call debug_code on the proxy
-            vmoutput = proxy.debug_code(code, context)
-        
-        # Split the output by codeblock indicators
-        parts = vmoutput.split('```')
-        
-        # If there are at least two parts, get the output between the codeblock
-        if len(parts) >= 2:
-        
-            vmoutput = parts[1].strip()
-        
-        # The new regex pattern that matches AI followed by zero or more characters followed by (as suggested|as per) and everything after that
-        #pattern = r"AI.*?(as suggested|as per).*$"
-        
-        # The re.sub function replaces the matched pattern with an empty string, effectively deleting it
-        #vmoutput = re.sub(pattern, "", vmoutput, flags=re.MULTILINE | re.DOTALL)
-        
-        # Remove AI_1 comment indicators
-        #vmoutput = vmoutput.replace('AI_1: ', '')
-        
-        # Define regex to remove extra text that sometimes comes after the codeblock syntax
-        regex = re.compile(r'^\s*(?:python|py)\s*\n?', re.IGNORECASE)
-        
-        # Use the regular expression to remove the first line if it matches
-        vmoutput = regex.sub('', vmoutput)
+            status = run_prompt(job, code, context, pyaiType, key, trace)
+            text = job.stream.text
+    except Exception as e:
+        # The batch waits for a result from every file it queued
+        status, text = "error", f"Sorry, something went wrong! :( Error: {e}"
+    result = {'path': path, 'status': status, 'seconds': round(time.monotonic() - job.created, 3)}
+    result['output' if status in ("ok", "cached") else 'error'] = text
+    results.put(result)
+
+
+def submit_prompt(trace, code, context, pyaiType, nocache=False):
+    """Create a job for a prompt and either replay its cached output or queue it.
+
+    Args:
+        trace (Trace): The timings of the prompt, started when the request arrived
+        code (str): The code from the first textbox
+        context (str): The context from the second textbox
+        pyaiType (str): The type of pyai operation (code or debug)
+        nocache (bool): True to skip the cache and ask the AI again
+
+    Returns:
+        tuple: The new job ID, its queue position and estimated wait in seconds
+        with the 202 Accepted status code, or an error and 503 Service
+        Unavailable if the queue is full
+    """
+    trace.pyaiType = pyaiType
+
+    # Give this prompt its own job so concurrent users do not share output
+    try:
+        job = jobs.create()
+    except RegistryFull as e:
+        trace.finish("rejected")
+        return busy(str(e))
+    trace.job_id = job.id
+    # Replay the output of an identical earlier prompt through the job's stream
+    key = cache_key(code, context, pyaiType)
+    cached = None if nocache else responses.get(key)
+    if cached is not None:
+        job.started = time.monotonic()
+        job.stream.append(cached)
+        job.finish()
+        trace.mark("first_code")
+        trace.finish("cached")
+        return jsonify(job_id=job.id, position=0, eta=0, cached=True), 202
+    # Queue the prompt for the worker pool so the output can be streamed as it arrives
+    try:
+        position = job_queue.submit(job, run_prompt, code, context, pyaiType, key, trace)
+    except QueueFull as e:
+        jobs.remove(job.id)
+        trace.finish("rejected")
+        return busy(str(e))
+    eta = job_queue.eta(position) if position else 0
+    return jsonify(job_id=job.id, position=position, eta=eta, cached=False), 202
+
+
+def busy(error):
+    """Build the response that turns a prompt away while the server is overloaded.
+
+    Args:
+        error (str): Why the prompt was turned away
+
+    Returns:
+        tuple: The error, 503 Service Unavailable and a Retry-After header
+    """
+    retry_after = job_queue.eta(job_queue.max_queued) or STREAM_KEEPALIVE
+    return jsonify(error=error), 503, {'Retry-After': str(max(1, round(retry_after)))}
+
+
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    """Return the status of a job and, while it waits, its queue position and estimated wait.
+
+    Args:
+        job_id (str): The job
+
+    Returns:
+        Response: The status as JSON
+    """
+    job = find_job(job_id)
+    position = job_queue.position(job)
+    eta = job_queue.eta(position) if position else 0
+    return jsonify(job_id=job.id, status=job.status, position=position, eta=eta)
+
+
+@app.route("/queue")
+def queue_stats():
+    """Return the queue depth, worker usage and recent wait and run times as JSON.
+
+    These show whether the worker pool needs to be bigger.
+    """
+    return jsonify(job_queue.stats())
+
+
+@app.route("/backends")
+def backend_stats():
+    """Return the URL, health and outstanding jobs of every AI backend as JSON."""
+    return jsonify(backends.stats())
+
+
+@app.route("/metrics")
+def metrics():
+    """Return the latency histograms, in-flight prompts and outcome counters in the
+    Prometheus text format."""
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route("/cache")
+def cache_stats():
+    """Return the hits, misses and size of the response cache as JSON."""
+    return jsonify(responses.stats())
+
+
+class IncompleteOutput(Exception):
+    """Raised when the AI stops after the code fence opened but before it closed, so the
+    code in the job's stream is cut short."""
+
+
+def run_prompt(job, code, context, pyaiType, key=None, trace=None):
+    """Perform an action in a virtual machine and write the extracted code to
+    the job's output stream, finishing the job when the action is complete.
+
+    Args:
+        job (Job): The job to write the output to
+        code (str): The code from the first textbox
+        context (str): The context from the second textbox
+        pyaiType (str): The type of pyai operation (code or debug)
+        key (str): The cache key to store a successful output under, or None
+        trace (Trace): The timings of the prompt, or None to start them here
+
+    Returns:
+        str: How the prompt ended: "ok", "partial", "error" or "timeout"
+    """
+    if trace is None:
+        trace = Trace(pyaiType, job.id)
+    if job.started is not None:
+        trace.record("queue", job.started - job.created, job.created)
+    vmoutput = None
+    outcome = "error"
+    try:
+        # Split large code along its functions and classes so the parts run on the VMs at once
+        chunks = split(code) if pyaiType == "code" and len(code) > MAX_CHUNK_CHARS else None
+        if chunks and len(chunks) > 1:
+            vmoutput = run_chunks(job, chunks, context, trace)
+        else:
+            # Send the job to the least busy VM and keep using it until the job is done
+            with backends.lease() as proxy:
+                vmoutput = call_vm(job, proxy, code, context, pyaiType, trace)
+        if vmoutput is None:
+            outcome = "ok"
+        # Only remember outputs that are not error messages
+        if vmoutput is None and key is not None and job.stream.text:
+            responses.put(key, job.stream.text)
     
+    # Keep the code that arrived, but neither cache it nor report it as complete
+    except IncompleteOutput as e:
+        partial = job.stream.text.rstrip("\n")
+        vmoutput = f"# Sorry, the AI stopped before it finished the code! :( Error: {e}"
+        if partial:
+            vmoutput = f"{partial}\n\n{vmoutput}"
+        outcome = "partial"
+
     # If there is a timeout exception, set vmoutput to a timeout message
     except socket.timeout:
         vmoutput = "Message timed out, try using a shorter prompt or code snippet!"
+        outcome = "timeout"
     
     # If there is any other exception, set vmoutput to a generic error message
-    #except Exception as e:
-    #    vmoutput = f"Sorry, something went wrong! :( Error: {e}"
+    except Exception as e:
+        vmoutput = f"Sorry, something went wrong! :( Error: {e}"
     
-    # If vmoutput is None or arbitrarily too short, set it to a sorry message
+    finally:
+        # Send the error message, then tell the clients we are done
+        if vmoutput is not None:
+            job.stream.publish(vmoutput)
+        job.finish()
+        trace.finish(outcome)
+    return outcome
+
+
+def run_chunks(job, chunks, context, trace):
+    """Send the parts of large code to the VMs at once and write the code that comes
+    back to the job's output stream in the original order as it arrives.
+
+    Args:
+        job (Job): The job to write the output to
+        chunks (list): The parts of the code from the first textbox
+        context (str): The context from the second textbox
+        trace (Trace): The timings of the prompt
+
+    Returns:
+        str: An error message if a part failed or came back without code, or None if the
+        output was written to the job's stream
+
+    Raises:
+        socket.timeout: If a part takes longer than PROMPT_TIMEOUT
+    """
+    stitcher = Stitcher(len(chunks))
+    parallelism = min(len(chunks), CHUNKS_PER_BACKEND * len(VM_URLS))
+    executor = ThreadPoolExecutor(max_workers=parallelism, thread_name_prefix='chunk')
+    try:
+        futures = {executor.submit(run_chunk, chunk.source, chunk_context(context, chunk, chunks), trace): chunk
+                   for chunk in chunks}
+        for future in as_completed(futures):
+            chunk = futures[future]
+            output, error = future.result()
+            if error is None and not output.strip():
+                # An answer without code would leave the part out of the file
+                error = "Sorry, the AI answered without any code!"
+            if error is not None:
+                return f"{error} (part {chunk.index + 1} of {len(chunks)})"
+            append_code(job, trace, stitcher.add(chunk.index, output))
+        return None
+    finally:
+        # Drop the parts that have not started once one has failed
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def run_chunk(code, context, trace):
+    """Send one part of large code to the least busy VM.
+
+    Args:
+        code (str): The part of the code
+        context (str): The context of the part
+        trace (Trace): The timings of the prompt
+
+    Returns:
+        tuple: The extracted code, and an error message or None
+    """
+    part = Job()
+    with backends.lease() as proxy:
+        error = call_vm(part, proxy, code, context, "code", trace)
+    return part.stream.text, error
+
+
+def call_vm(job, proxy, code, context, pyaiType, trace):
+    """Perform an action in a virtual machine, writing the code of a prompt to the
+    job's output stream as it arrives.
+
+    Args:
+        job (Job): The job to write the output to
+        proxy (RPCClient): The client of the VM
+        code (str): The code from the first textbox
+        context (str): The context from the second textbox
+        pyaiType (str): The type of pyai operation (code or debug)
+        trace (Trace): The timings of the prompt
+
+    Returns:
+        str: An error message, or None if the output was written to the job's stream
+
+    Raises:
+        IncompleteOutput: If the AI stopped before the code it started was complete
+    """
+    # Check if the input type is code
+    if pyaiType == "code":
+        # Remove any leading or trailing whitespace from the code and context
+        code = code.strip()
+        context = context.strip()
+        # Send the code and context to the proxy AI
+        with trace.span("rpc"):
+            vm_job_id = proxy.prompt_ai(code, context)
+        # Parse the output incrementally so each poll only looks at the new text
+        extractor = CodeFenceExtractor()
+        try:
+            # Follow the output as the VM reports it
+            vmoutput = stream_output(job, proxy, vm_job_id, extractor, trace)
+        except xmlrpc.client.Fault:
+            # The VM does not support waiting for output, so fall back to polling it
+            vmoutput = None
+            poll_output(job, proxy, extractor, trace)
+        # Flush a last line that never got its newline
+        with trace.span("postprocess"):
+            append_code(job, trace, extractor.finish())
+        return vmoutput
+
+    # Call debug_code on the proxy
+    with trace.span("rpc"):
+        vmoutput = proxy.debug_code(code, context)
+
+    # Get the code between the codeblock indicators without the language tag
+    with trace.span("postprocess"):
+        vmoutput = extract_code(vmoutput)
+
+    # If vmoutput is None or arbitrarily too short, return a sorry message
     if not vmoutput or len(vmoutput) < 7:
-        vmoutput = "Sorry, something went wrong! :("
-    
-    # Return the output
-    return vmoutput
+        return "Sorry, something went wrong! :("
+    job.stream.publish(vmoutput)
+    trace.mark("first_code")
+    return None
+
+
+def append_code(job, trace, text):
+    """Append extracted code to the job's output stream, noting when the first code arrived.
+
+    Args:
+        job (Job): The job to write the code to
+        trace (Trace): The timings of the prompt
+        text (str): The code
+    """
+    job.stream.append(text)
+    if text:
+        trace.mark("first_code")
+
+
+def stream_output(job, proxy, vm_job_id, extractor, trace):
+    """Follow the output of a VM job, extracting the code as soon as it arrives.
+
+    Each wait_output call blocks on the VM until there is new output or the job has
+    finished, so there is no fixed delay between the AI writing text and the user
+    seeing it.
+
+    Args:
+        job (Job): The job to write the extracted code to
+        proxy (RPCClient): The client of the VM running the job
+        vm_job_id (str): The ID the VM gave the job
+        extractor (CodeFenceExtractor): The parser for the output
+        trace (Trace): The timings of the prompt
+
+    Returns:
+        str: An error message if the VM job failed before any code arrived, otherwise None
+
+    Raises:
+        IncompleteOutput: If the VM job failed after the code started
+        socket.timeout: If the job takes longer than PROMPT_TIMEOUT
+        xmlrpc.client.Fault: If the VM does not support wait_output
+    """
+    deadline = time.monotonic() + PROMPT_TIMEOUT
+    offset = 0
+    while time.monotonic() < deadline:
+        with trace.span("poll"):
+            reply = proxy.wait_output(vm_job_id, offset, WAIT_TIMEOUT, timeout=WAIT_TIMEOUT + POLL_TIMEOUT)
+        offset = reply['offset']
+        append_code(job, trace, extractor.feed(reply['output']))
+        # Stop once the closing code fence has been seen or the VM job has ended
+        if extractor.closed or reply['status'] == 'done':
+            return None
+        if reply['status'] == 'failed':
+            if extractor.opened:
+                # Show the last line that arrived along with the rest
+                append_code(job, trace, extractor.finish())
+                raise IncompleteOutput(reply['error'])
+            return f"Sorry, something went wrong! :( Error: {reply['error']}"
+    raise socket.timeout("the AI did not finish in time")
+
+
+def poll_output(job, proxy, extractor, trace):
+    """Poll the output of the VM until it stops changing, extracting the code as it arrives.
+
+    This is the fallback for VMs that do not support wait_output. It waits 9 seconds
+    for the AI to start and decides the output is complete once its length has not
+    changed for 16 polls.
+
+    Args:
+        job (Job): The job to write the extracted code to
+        proxy (RPCClient): The client of the VM running the job
+        extractor (CodeFenceExtractor): The parser for the output
+        trace (Trace): The timings of the prompt
+
+    Raises:
+        IncompleteOutput: If the output stopped changing after the code fence opened but
+            before it closed
+    """
+    # Wait for 9 seconds for the AI to process the input
+    time.sleep(9)
+    # Initialize variables to track the output length and changes
+    prev_length = 0
+    count = 0
+    # Loop until there is no change in the output for 16 iterations
+    while True:
+        # Get the current output from the proxy AI
+        with trace.span("poll"):
+            new_output = proxy.getOutput(timeout=POLL_TIMEOUT)
+        # Check if the output length is the same as before and not empty
+        if len(new_output) == prev_length and len(new_output) > 1:
+            # Increment the count of unchanged iterations
+            count += 1
+            # If the count reaches 16, print "no change" and break the loop
+            if count == 16:
+                print("no change")
+                # The VM cannot say whether the AI finished, so code without its closing fence is cut short
+                if extractor.opened:
+                    append_code(job, trace, extractor.finish())
+                    raise IncompleteOutput("the output stopped before the code was complete")
+                break
+        else:
+            # Reset the count to zero if there is a change in the output length
+            count = 0
+        # Update the previous output length to the current one
+        prev_length = len(new_output)
+        # Extract the code that arrived since the last poll and push it to the listening clients
+        append_code(job, trace, extractor.update(new_output))
+        # Stop once the closing code fence has been seen
+        if extractor.closed:
+            break
+        # Wait for 0.20 seconds before polling again
+        time.sleep(0.20)
 
 
 @app.route('/')
@@ -203,7 +818,8 @@ def main():
     app.run()
 
 
-proxy = xmlrpc.client.ServerProxy('http://127.0.0.1:8000/', allow_none=True)
+# Thread-safe pools of connections to the XML-RPC servers in the VMs
+backends = BackendPool(VM_URLS, timeout=SOCKET_TIMEOUT)
   
 if __name__ == '__main__':
     # Run the app
@@ -0,0 +1,264 @@
+"""
+This script runs the same prompt on every Python file of a project through the /api/batch
+endpoint of a running pyaiPrompt app, and writes the code that comes back for each file into
+an output directory, keeping the layout of the project, as the results arrive.
+
+The project is a directory or a zip or tar archive. A manifest in the output directory records
+each file that was done along with the hash of its source, context and type, so running the
+same command again after it was stopped, or after some files failed, only sends the files
+that are not done yet or whose source has changed.
+
+Usage:
+    python batch.py SOURCE --context TEXT [--type code|debug] [--out DIR] [--parallelism N]
+                    [--url URL] [--nocache] [--force]
+
+Dependencies:
+- argparse: for the command line
+- gzip: for compressing large requests
+- http.client: for streaming the results from the app
+- json: for the request and the manifest format
+- os: for walking the source directory and writing the outputs
+- sys: for the exit status
+- time: for waiting while the app is busy
+- urllib.parse: for the app URL
+- cache: for the hash of each file's prompt
+- transport: for reading archives and the request limits
+"""
+
+import argparse
+import gzip
+import http.client
+import json
+import os
+import sys
+import time
+import urllib.parse
+
+from cache import cache_key
+from transport import BATCH_SUFFIXES, MAX_BATCH_FILES, MAX_BODY_BYTES, PayloadError, read_archive
+
+
+# Name of the manifest in the output directory
+MANIFEST_NAME = '.pyai-batch.jsonl'
+
+# Statuses of a file that is done and is skipped by the next run
+DONE_STATUSES = ('ok', 'cached')
+
+# Requests larger than this many bytes are compressed with gzip
+COMPRESS_THRESHOLD = 32 * 1024
+
+# Seconds to wait for the next result before giving up
+READ_TIMEOUT = 900
+
+# Times to send a batch again after the app says it is busy, waiting as long as it asks
+BUSY_RETRIES = 5
+
+# Directories that are never searched for source files
+SKIP_DIRS = {'__pycache__', '.git', '.hg', '.svn', '.tox', '.venv', 'venv', 'node_modules'}
+
+
+def read_sources(source):
+    """Read the Python files of a directory or archive.
+
+    Args:
+        source (str): The directory or archive
+
+    Returns:
+        dict: The source of each file by its path relative to the directory or archive
+    """
+    if not os.path.isdir(source):
+        with open(source, 'rb') as f:
+            return read_archive(f.read())
+    files = {}
+    for root, dirs, names in os.walk(source):
+        dirs[:] = sorted(name for name in dirs if name not in SKIP_DIRS and not name.startswith('.'))
+        for name in sorted(names):
+            if name.endswith(BATCH_SUFFIXES):
+                path = os.path.join(root, name)
+                with open(path, encoding='utf-8') as f:
+                    files[os.path.relpath(path, source).replace(os.sep, '/')] = f.read()
+    return files
+
+
+def load_manifest(path):
+    """Read the last entry of each file from a manifest.
+
+    Args:
+        path (str): The manifest
+
+    Returns:
+        dict: The last entry of each file by its path, or nothing if there is no manifest
+    """
+    entries = {}
+    try:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A line cut short when an earlier run was stopped
+                    continue
+                entries[entry['path']] = entry
+    except FileNotFoundError:
+        pass
+    return entries
+
+
+def pending_files(files, manifest, context, pyaiType):
+    """Return the files that are not done with the same source, context and type.
+
+    Args:
+        files (dict): The source of each file by its path
+        manifest (dict): The last manifest entry of each file by its path
+        context (str): The context shared by every file
+        pyaiType (str): The type of pyai operation (code or debug)
+
+    Returns:
+        dict: The source of each file that has to be sent
+    """
+    pending = {}
+    for path, code in files.items():
+        entry = manifest.get(path)
+        if entry and entry['status'] in DONE_STATUSES and entry['key'] == cache_key(code, context, pyaiType):
+            continue
+        pending[path] = code
+    return pending
+
+
+def write_output(directory, path, text):
+    """Write the output of a file under the output directory, replacing the old one at once."""
+    target = os.path.join(directory, *path.split('/'))
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    temporary = target + '.tmp'
+    with open(temporary, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(temporary, target)
+
+
+def post_batch(url, files, context, pyaiType, parallelism=None, nocache=False):
+    """Send a batch to the app and yield each line of the results as it arrives.
+
+    Args:
+        url (str): The URL of the app
+        files (dict): The source of each file by its path
+        context (str): The context shared by every file
+        pyaiType (str): The type of pyai operation (code or debug)
+        parallelism (int): The number of files to send to the AI at once, or None for the app's default
+        nocache (bool): True to skip the app's cache
+
+    Yields:
+        dict: The result of each file, then the summary
+
+    Raises:
+        RuntimeError: If the app refuses the batch, or is still busy after BUSY_RETRIES tries
+    """
+    body = json.dumps({'files': files, 'context': context, 'pyaiType': pyaiType,
+                       'parallelism': parallelism, 'nocache': nocache}).encode('utf-8')
+    headers = {'Content-Type': 'application/json'}
+    if len(body) > COMPRESS_THRESHOLD:
+        body = gzip.compress(body)
+        headers['Content-Encoding'] = 'gzip'
+    parts = urllib.parse.urlsplit(url)
+    connection = http.client.HTTPConnection(parts.hostname, parts.port, timeout=READ_TIMEOUT)
+    try:
+        for attempt in range(BUSY_RETRIES + 1):
+            connection.request('POST', parts.path.rstrip('/') + '/api/batch', body, headers)
+            response = connection.getresponse()
+            if response.status != 503 or attempt == BUSY_RETRIES:
+                break
+            # The app's queue is full, so wait as long as it asks before sending the batch again
+            response.read()
+            retry_after = int(response.getheader('Retry-After') or 1)
+            print(f"the app is busy, retrying in {retry_after}s")
+            time.sleep(retry_after)
+        if response.status != 200:
+            raise RuntimeError(f"the app refused the batch ({response.status}): {response.read().decode()}")
+        for line in response:
+            if line.strip():
+                yield json.loads(line)
+    finally:
+        connection.close()
+
+
+def batches(files, limit=MAX_BODY_BYTES):
+    """Split the files into batches the app accepts.
+
+    Args:
+        files (dict): The source of each file by its path
+        limit (int): The largest size of a batch's sources in bytes
+
+    Yields:
+        dict: The source of each file of a batch by its path
+    """
+    batch = {}
+    size = 0
+    for path, code in files.items():
+        length = len(code.encode('utf-8')) + len(path) + 64
+        # Leave room for the quotes and backslashes JSON adds to the sources
+        if batch and (len(batch) >= MAX_BATCH_FILES or size + length > limit // 2):
+            yield batch
+            batch, size = {}, 0
+        batch[path] = code
+        size += length
+    if batch:
+        yield batch
+
+
+def run(args):
+    """Run the batch and return the number of files that failed."""
+    files = read_sources(args.source)
+    os.makedirs(args.out, exist_ok=True)
+    manifest_path = os.path.join(args.out, MANIFEST_NAME)
+    manifest = {} if args.force else load_manifest(manifest_path)
+    pending = pending_files(files, manifest, args.context, args.type)
+    print(f"{len(files)} files, {len(files) - len(pending)} already done, {len(pending)} to send")
+    failed = 0
+    with open(manifest_path, 'a', encoding='utf-8') as log:
+        for batch in batches(pending):
+            for result in post_batch(args.url, batch, args.context, args.type, args.parallelism, args.nocache):
+                if result.get('done'):
+                    continue
+                path = result['path']
+                # Only write files that were sent, whatever path the app answers with
+                if path not in batch:
+                    continue
+                if result['status'] in DONE_STATUSES:
+                    write_output(args.out, path, result['output'])
+                else:
+                    failed += 1
+                entry = {'path': path, 'status': result['status'], 'seconds': result['seconds'],
+                         'key': cache_key(batch[path], args.context, args.type)}
+                log.write(json.dumps(entry) + '\n')
+                log.flush()
+                detail = result['status'] if result['status'] in DONE_STATUSES else result.get('error', '').strip()
+                print(f"{path}: {detail} ({result['seconds']:.1f}s)")
+    return failed
+
+
+def main():
+    """Parse the command line, run the batch and exit with 1 if any file failed or 2 if the
+    batch could not be run."""
+    parser = argparse.ArgumentParser(description="Run a prompt on every Python file of a project.")
+    parser.add_argument("source", type=str, help="The directory, or zip or tar archive, of the project")
+    parser.add_argument("--context", type=str, default="", help="The context shared by every file")
+    parser.add_argument("--type", type=str, default="code", choices=("code", "debug"), help="The type of pyai operation")
+    parser.add_argument("--out", type=str, default="pyai-batch", help="The directory to write the outputs to")
+    parser.add_argument("--parallelism", type=int, help="Files to send to the AI at once")
+    parser.add_argument("--url", type=str, default="http://127.0.0.1:5000/", help="The URL of the app")
+    parser.add_argument("--nocache", action="store_true", help="Ask the AI again instead of using the app's cache")
+    parser.add_argument("--force", action="store_true", help="Send every file, even those done before")
+    args = parser.parse_args()
+
+    try:
+        failed = run(args)
+    except (OSError, RuntimeError, PayloadError, UnicodeDecodeError) as e:
+        # PayloadError is raised for a source that is neither a directory nor an archive
+        print(f"batch failed: {e}")
+        sys.exit(2)
+    if failed:
+        print(f"{failed} files failed, run the same command again to retry them")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
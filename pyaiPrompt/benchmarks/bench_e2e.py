@@ -0,0 +1,270 @@
+"""
+This script measures the Flask app from end to end, from the browser's POST to /api/prompt to
+the last piece of code on its event stream, against stand-in AI backends from fakebackend.py.
+It starts the backends and the app as separate processes, then runs a number of simulated
+browsers at once. Each browser submits a prompt, follows /stream/<job_id> (or polls /get_line
+with --poll, like the client does without EventSource) and records when the first piece of code arrived and when
+the stream ended.
+
+It reports the time to the first token and the total latency at the 50th, 90th and 99th
+percentile, the number of requests per second, how many were turned away or failed, and the
+CPU and peak memory use of the app's process, sampled with psutil.
+
+The results can be saved as JSON and compared with an earlier run; the script exits with
+status 1 if the median or 90th percentile latency, or the time to the first token, got worse
+by more than the tolerance, so it can gate a performance change.
+
+Usage:
+    python benchmarks/bench_e2e.py [--clients N] [--requests N] [--backends N] [--poll]
+                                   [--save FILE] [--compare FILE] [--tolerance FRACTION]
+                                   [fakebackend options]
+"""
+
+import argparse
+import http.client
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import psutil
+
+from fakebackend import add_arguments
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The code each simulated browser submits
+CODE = "def add(a, b):\n    return a + b\n\nprint(add(1, 2))\n"
+
+# Seconds a simulated browser waits for its prompt to finish
+CLIENT_TIMEOUT = 120
+
+# Seconds between samples of the app's CPU and memory use
+SAMPLE_INTERVAL = 0.1
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_backend(args):
+    """Start a stand-in backend process and return it with its URL."""
+    options = ["--port", "0", "--delay", str(args.delay), "--rate", str(args.rate),
+               "--token-size", str(args.token_size), "--jitter", str(args.jitter), "--size", str(args.size),
+               "--footnotes", str(args.footnotes), "--debug-delay", str(args.debug_delay), "--seed", str(args.seed)]
+    if args.no_fence:
+        options.append("--no-fence")
+    process = subprocess.Popen([sys.executable, os.path.join(APP_DIR, "benchmarks", "fakebackend.py")] + options,
+                               stdout=subprocess.PIPE, text=True)
+    line = process.stdout.readline().split()
+    if not line or line[0] != "ready":
+        process.kill()
+        raise RuntimeError("the stand-in backend failed to start")
+    return process, line[1]
+
+
+def start_app(urls, port):
+    """Start the Flask app in its own process, without starting the VM, and wait until it answers."""
+    env = dict(os.environ, PYAI_BACKENDS=",".join(urls))
+    env.pop("PYAI_CACHE_DIR", None)
+    process = subprocess.Popen(
+        [sys.executable, "-c", f"import app; app.app.run(port={port}, threaded=True)"],
+        cwd=APP_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return process
+        except OSError:
+            if process.poll() is not None:
+                break
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("the app failed to start")
+
+
+def submit(port, i):
+    """POST a prompt as the browser does and return the status and JSON reply."""
+    body = json.dumps({"code": CODE, "context": f"client {i}", "pyaiType": "code", "nocache": True})
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=CLIENT_TIMEOUT)
+    try:
+        conn.request("POST", "/api/prompt", body, {"Content-Type": "application/json"})
+        response = conn.getresponse()
+        return response.status, json.loads(response.read() or b"{}")
+    finally:
+        conn.close()
+
+
+def follow_stream(port, job_id, start):
+    """Read the job's event stream and return the times of the first code and of the end."""
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=CLIENT_TIMEOUT)
+    first = None
+    try:
+        conn.request("GET", f"/stream/{job_id}")
+        response = conn.getresponse()
+        event = None
+        for line in response:
+            line = line.decode().rstrip("\n")
+            if line.startswith("event:"):
+                event = line[6:].strip()
+            elif line.startswith("data:") and event in ("append", "replace"):
+                if first is None and json.loads(line[5:]):
+                    first = time.perf_counter() - start
+            elif line.startswith("data:") and event == "done":
+                return first, time.perf_counter() - start
+    finally:
+        conn.close()
+    raise RuntimeError("the stream ended without a done event")
+
+
+def follow_polls(port, job_id, start):
+    """Poll /get_line every 0.1 seconds with the cursor of the last reply and return the same times."""
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=CLIENT_TIMEOUT)
+    first = None
+    cursor = "0"
+    try:
+        while time.perf_counter() - start < CLIENT_TIMEOUT:
+            conn.request("GET", f"/get_line?job_id={job_id}&offset={cursor}")
+            reply = json.loads(conn.getresponse().read())
+            cursor = reply["offset"]
+            if reply["text"] and first is None:
+                first = time.perf_counter() - start
+            if reply["done"]:
+                return first, time.perf_counter() - start
+            time.sleep(0.1)
+    finally:
+        conn.close()
+    raise RuntimeError("the prompt did not finish in time")
+
+
+def client(port, i, poll):
+    """Run one simulated browser and return what happened to its prompt."""
+    start = time.perf_counter()
+    try:
+        status, reply = submit(port, i)
+        if status == 503:
+            return {"outcome": "rejected"}
+        if status != 202:
+            return {"outcome": "failed"}
+        follow = follow_polls if poll else follow_stream
+        first, total = follow(port, reply["job_id"], start)
+        return {"outcome": "ok", "ttft": first, "latency": total}
+    except (OSError, RuntimeError, ValueError):
+        return {"outcome": "failed"}
+
+
+def sample(process, samples, stop):
+    """Record the CPU and memory use of the app's process until stop is set."""
+    process.cpu_percent()
+    while not stop.wait(SAMPLE_INTERVAL):
+        try:
+            samples.append((process.cpu_percent(), process.memory_info().rss / 1024 / 1024))
+        except psutil.Error:
+            return
+
+
+def percentiles(values):
+    if not values:
+        return {"p50": None, "p90": None, "p99": None}
+    if len(values) == 1:
+        return {"p50": values[0], "p90": values[0], "p99": values[0]}
+    cuts = statistics.quantiles(values, n=100, method="inclusive")
+    return {"p50": cuts[49], "p90": cuts[89], "p99": cuts[98]}
+
+
+def run(args):
+    backends = [start_backend(args) for i in range(args.backends)]
+    port = free_port()
+    app = None
+    try:
+        app = start_app([url for process, url in backends], port)
+        samples = []
+        stop = threading.Event()
+        sampler = threading.Thread(target=sample, args=(psutil.Process(app.pid), samples, stop))
+        sampler.start()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.clients) as pool:
+            outcomes = list(pool.map(lambda i: client(port, i, args.poll), range(args.requests)))
+        elapsed = time.perf_counter() - start
+        stop.set()
+        sampler.join()
+    finally:
+        for process in [app] + [process for process, url in backends]:
+            if process is not None:
+                process.kill()
+                process.wait()
+    ok = [outcome for outcome in outcomes if outcome["outcome"] == "ok"]
+    return {
+        "requests": args.requests,
+        "clients": args.clients,
+        "ok": len(ok),
+        "rejected": sum(outcome["outcome"] == "rejected" for outcome in outcomes),
+        "failed": sum(outcome["outcome"] == "failed" for outcome in outcomes),
+        "rps": len(ok) / elapsed,
+        "ttft": percentiles([outcome["ttft"] for outcome in ok if outcome["ttft"] is not None]),
+        "latency": percentiles([outcome["latency"] for outcome in ok]),
+        "cpu_percent": statistics.fmean(cpu for cpu, rss in samples) if samples else None,
+        "peak_rss_mb": max((rss for cpu, rss in samples), default=None),
+    }
+
+
+def report(results):
+    def ms(value):
+        return "       -" if value is None else f"{value * 1000:8.1f}"
+    print(f"requests:  {results['ok']} ok, {results['rejected']} rejected, {results['failed']} failed"
+          f" with {results['clients']} clients")
+    print(f"rps:       {results['rps']:8.1f}")
+    for name in ("ttft", "latency"):
+        values = results[name]
+        print(f"{name + ':':<10} p50 {ms(values['p50'])} ms   p90 {ms(values['p90'])} ms   p99 {ms(values['p99'])} ms")
+    if results["cpu_percent"] is not None:
+        print(f"app:       {results['cpu_percent']:8.1f} % CPU   {results['peak_rss_mb']:8.1f} MB peak RSS")
+
+
+def regressions(results, baseline, tolerance):
+    """Return a line for each measure that got worse than the baseline by more than the tolerance."""
+    lines = []
+    for name, cut in (("ttft", "p50"), ("latency", "p50"), ("latency", "p90")):
+        old, new = baseline[name][cut], results[name][cut]
+        if old is not None and new is not None and new > old * (1 + tolerance):
+            lines.append(f"{name} {cut} went from {old * 1000:.1f} ms to {new * 1000:.1f} ms")
+    if results["failed"] > baseline["failed"]:
+        lines.append(f"{results['failed']} prompts failed, {baseline['failed']} before")
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the app from end to end against stand-in backends.")
+    parser.add_argument("--clients", type=int, default=16, help="Simulated browsers at the same time")
+    parser.add_argument("--requests", type=int, default=64, help="Prompts to submit in all")
+    parser.add_argument("--backends", type=int, default=1, help="Stand-in backends to start")
+    parser.add_argument("--poll", action="store_true", help="Poll /get_line instead of following the event stream")
+    parser.add_argument("--save", type=str, help="Write the results as JSON to this file")
+    parser.add_argument("--compare", type=str, help="Compare with the results saved in this file")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Fraction a measure may get worse by")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    results = run(args)
+    report(results)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            lines = regressions(results, json.load(f), args.tolerance)
+        for line in lines:
+            print(f"regression: {line}")
+        if lines:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+This script compares the incremental CodeFenceExtractor with the full re-scan that
+save_files used to run on every poll. It builds a long fenced AI answer, feeds it in
+growing prefixes the way the polling loop sees it, and prints the time each approach
+spends over the whole answer.
+
+Usage:
+    python benchmarks/bench_extractor.py [--size KB] [--step BYTES]
+"""
+
+import argparse
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from extractor import CodeFenceExtractor
+
+
+def make_output(size):
+    """Build a fenced AI answer of roughly size characters with footnotes after it."""
+    lines = ["Here is the updated code:", "", "```python"]
+    total = 0
+    i = 0
+    while total < size:
+        line = f"    value_{i} = compute(value_{i - 1}, {i})  # step {i}"
+        lines.append(line)
+        total += len(line) + 1
+        i += 1
+    lines += ["```", "", "[1]: https://www.example.com/", "[2]: https://www.example.org/"]
+    return "\n".join(lines) + "\n"
+
+
+def legacy_extract(new_output):
+    """The extraction save_files ran over the whole output on every poll."""
+    pre_output_string = ""
+    flag = False
+    lines = [line + "\n" for line in new_output.splitlines() if not re.match(r'\[\d+\]: https://', line)]
+    for line in lines:
+        if '```' in line and not flag:
+            flag = True
+            continue
+        elif flag:
+            pre_output_string += line
+    if '```' in pre_output_string:
+        return re.sub(r'```.*$', '', pre_output_string), True
+    return pre_output_string, False
+
+
+def run_legacy(output, step):
+    start = time.perf_counter()
+    for end in range(step, len(output) + step, step):
+        code, done = legacy_extract(output[:end])
+        if done:
+            break
+    return time.perf_counter() - start, code
+
+
+def run_incremental(output, step):
+    start = time.perf_counter()
+    extractor = CodeFenceExtractor()
+    code = []
+    for end in range(step, len(output) + step, step):
+        code.append(extractor.update(output[:end]))
+        if extractor.closed:
+            break
+    code.append(extractor.finish())
+    return time.perf_counter() - start, "".join(code)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the incremental code fence extractor.")
+    parser.add_argument("--size", type=int, default=500, help="Size of the AI answer in KB")
+    parser.add_argument("--step", type=int, default=2048, help="Characters that arrive between polls")
+    args = parser.parse_args()
+
+    output = make_output(args.size * 1024)
+    polls = len(output) // args.step + 1
+    legacy_time, legacy_code = run_legacy(output, args.step)
+    incremental_time, incremental_code = run_incremental(output, args.step)
+
+    print(f"output: {len(output) / 1024:.0f} KB in {polls} polls of {args.step} characters")
+    print(f"legacy re-scan: {legacy_time * 1000:10.1f} ms")
+    print(f"incremental:    {incremental_time * 1000:10.1f} ms")
+    print(f"speedup:        {legacy_time / incremental_time:10.1f}x")
+    # The legacy regex misses a closing fence that is not on the last line, so compare up to it
+    print(f"same code:      {legacy_code.split('```')[0].rstrip() == incremental_code.rstrip()}")
+
+
+if __name__ == "__main__":
+    main()
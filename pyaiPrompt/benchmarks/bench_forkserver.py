@@ -0,0 +1,71 @@
+"""
+This script compares the startup latency of running a script with sandbox.run, which starts
+a new interpreter every time as pydebug does by default, with forking it from a ForkServer
+that has already imported the script's modules. The script only imports a set of modules and
+exits, so the times measured are the overhead of a run.
+
+Usage:
+    python benchmarks/bench_forkserver.py [--runs N] [--modules MODULE ...]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts"))
+
+import sandbox
+from forkserver import ForkServer, preloadable
+
+# Modules a typical debugged script might import
+MODULES = ["asyncio", "decimal", "email.mime.text", "http.client", "json", "ssl", "xml.etree.ElementTree",
+           "unittest", "argparse", "psutil", "radon.complexity"]
+
+
+def time_runs(run, script, runs):
+    times = []
+    for i in range(runs):
+        start = time.perf_counter()
+        result = run([sys.executable, script], timeout=30)
+        times.append(time.perf_counter() - start)
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr)
+    return times
+
+
+def report(name, times):
+    times = sorted(times)
+    print(f"{name:12} median {statistics.median(times) * 1000:8.1f} ms"
+          f"   p90 {times[int(len(times) * 0.9)] * 1000:8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the startup latency of the fork server.")
+    parser.add_argument("--runs", type=int, default=30, help="Number of runs of each approach")
+    parser.add_argument("--modules", nargs="*", default=MODULES, help="Modules the script imports")
+    args = parser.parse_args()
+
+    modules = preloadable(args.modules, "/nonexistent")
+    with tempfile.TemporaryDirectory() as workdir:
+        script = os.path.join(workdir, "script.py")
+        with open(script, "w") as f:
+            f.write("".join(f"import {name}\n" for name in modules))
+
+        popen_times = time_runs(sandbox.run, script, args.runs)
+        start = time.perf_counter()
+        with ForkServer(modules) as server:
+            server_start = time.perf_counter() - start
+            fork_times = time_runs(server.run, script, args.runs)
+
+    print(f"script imports: {', '.join(modules)}")
+    report("popen", popen_times)
+    report("fork server", fork_times)
+    print(f"server start {server_start * 1000:8.1f} ms, paid once")
+    print(f"speedup      {statistics.median(popen_times) / statistics.median(fork_times):8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+"""
+This script compares the single-pass rewrite pipeline in scripts/rewrite.py with the chain of
+check_imports, replace_file_paths, replace_input and update_more_files that codedebugger used
+to run. It generates a script with input() calls, required arguments and file paths spread over
+the given number of lines and prints the time each approach takes to rewrite it.
+
+Most of the pipeline's time goes to parsing the script, so it is slower than the legacy chain
+on scripts of a few hundred lines, about even at a thousand and faster from there on, as the
+legacy chain's repeated passes over the whole file grow with its size.
+
+The legacy functions below are copied from codedebugger with the sandbox directory made a
+parameter, so that the benchmark does not write to /home/user/sig.
+
+Usage:
+    python benchmarks/bench_rewrite.py [--lines N] [--repeat N]
+"""
+
+import argparse
+import os
+import pkgutil
+import random
+import re
+import shutil
+import sys
+import tempfile
+import time
+import warnings
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts"))
+
+from rewrite import generate_random_value, prepare_files, rewrite
+
+
+def make_script(lines):
+    """Build a script of roughly the given number of lines with inputs and required arguments throughout."""
+    out = ["import os", "import argparse", "import json", "", "parser = argparse.ArgumentParser()"]
+    i = 0
+    while len(out) < lines:
+        out += [
+            f"def step_{i}(value):",
+            f"    count_{i} = int(input('count {i}: '))",
+            f"    parser.add_argument('--opt-{i}', type=int, required=True, help='option {i}')",
+            f"    total = sum(range(count_{i}))",
+            f"    return total + value",
+            "",
+        ]
+        # Files are rarer than inputs, and creating them costs both approaches the same
+        if i % 20 == 0:
+            out += [
+                f"def save_{i}(value):",
+                f"    path_{i} = '/data/input_{i}.txt'",
+                f"    with open('result_{i}.txt', 'w') as f:",
+                f"        f.write(str(value))",
+                "",
+            ]
+        i += 1
+    return "\n".join(out) + "\n"
+
+
+def legacy_check_imports(file_path, output_dir):
+    with open(file_path, 'r') as file:
+        lines = file.readlines()
+        imports = []
+        for line in lines:
+            if line.startswith('import') or line.startswith('from'):
+                package = line.split()[1]
+                if '.' in package:
+                    package = package.split('.')[0]
+                if not pkgutil.find_loader(package) and package not in sys.builtin_module_names:
+                    imports.append(line.strip())
+    with open(os.path.join(output_dir, 'imports.txt'), 'w') as file:
+        file.write(', '.join(imports))
+
+
+def legacy_replace_file_paths(file_path, sandbox_dir):
+    with open(file_path, 'r') as f:
+        code = f.read()
+    file_lines = re.findall(r'^(.*?(?:\w+\s+)?open\(["\'])(/[\w./-]+)(["\'].*\))$', code, flags=re.MULTILINE)
+    file_lines += re.findall(r'^(.*?=\s*["\'])(/[\w./-]+)(["\'].*)$', code, flags=re.MULTILINE)
+    for line in file_lines:
+        old_line = "".join(line)
+        if old_line.startswith('#') or sandbox_dir in old_line or '[SENSIBLE VALUE]' in old_line:
+            continue
+        commented_line = f'#%@ {old_line}'
+        code = code.replace(old_line, commented_line)
+        file_path = line[1]
+        new_file_path = sandbox_dir + os.path.basename(file_path)
+        if os.path.exists(file_path):
+            shutil.move(file_path, new_file_path)
+        else:
+            if "." in new_file_path:
+                with open(new_file_path, 'w') as f:
+                    f.write("[SENSIBLE VALUE]")
+            else:
+                os.mkdir(new_file_path)
+        new_line = f'\n{line[0]+new_file_path+line[2]}'
+        index = code.index(commented_line) + len(commented_line)
+        code = code[:index] + new_line + code[index:]
+    return code
+
+
+def legacy_replace_input(file_path):
+    with open(file_path, 'r') as f:
+        code = f.read()
+    input_lines = re.findall(r'^(.*input\(.+\).*)$', code, flags=re.MULTILINE)
+    for line in input_lines:
+        code = code.replace(line, f'#%@ {line}')
+        var_name = line.split('=')[0].strip()
+        var_type_match = re.match(r'.*?(\w+)\s*\(\s*input', line)
+        if var_type_match:
+            var_type = var_type_match.group(1)
+        else:
+            continue
+        value = f'{generate_random_value(var_type)} #[SENSIBLE VALUE]'
+        new_line = f'{var_name} = {value}'
+        code = code.replace(f'#%@ {line}', f'#%@ {line}\n{new_line}')
+    parser_lines = re.findall(r'^(.*parser\.add_argument\(.+required\s*=\s*True.+\).*)$', code, flags=re.MULTILINE)
+    for line in parser_lines:
+        code = code.replace(line, f'#%@ {line}')
+        new_line = line.replace('required=True', 'required=False')
+        if 'default=' not in line:
+            new_line = new_line.replace(')', ', default="[SENSIBLE VALUE]")')
+        code = code.replace(f'#%@ {line}', f'#%@ {line}\n{new_line}')
+    return code
+
+
+def legacy_update_more_files(filepath, sandbox_dir):
+    with open(filepath, 'r') as f:
+        lines = f.readlines()
+    with open(filepath, 'w') as f:
+        for line in lines:
+            if line.strip().startswith('#') or sandbox_dir in line or '[SENSIBLE VALUE]' in line:
+                f.write(line)
+            elif 'open(' in line and ',' in line:
+                f.write(f'#%@ {line}')
+                start = line.find('open(') + 5
+                end = line.find(',', start)
+                filename = line[start:end].strip("'\"")
+                if filename.startswith('/'):
+                    filename = os.path.basename(filename)
+                new_line = line[:start] + f"'{sandbox_dir}{filename}'" + line[end:]
+                f.write(new_line)
+                with open(os.path.join(sandbox_dir, filename), 'w') as mock_file:
+                    mock_file.write('[SENSIBLE VALUE]')
+            else:
+                f.write(line)
+
+
+def run_legacy(source, workdir, sandbox_dir):
+    start = time.perf_counter()
+    input_path = os.path.join(workdir, "script.py")
+    with open(input_path, "w") as f:
+        f.write(source)
+    legacy_check_imports(input_path, workdir)
+    code = legacy_replace_file_paths(input_path, sandbox_dir)
+    new_script_path = os.path.join(workdir, 'new_script.py')
+    with open(new_script_path, 'w') as f:
+        f.write(code)
+    code = legacy_replace_input(new_script_path)
+    with open(new_script_path, 'w') as f:
+        f.write(code)
+    legacy_update_more_files(new_script_path, sandbox_dir)
+    return time.perf_counter() - start
+
+
+def run_pipeline(source, workdir, sandbox_dir):
+    start = time.perf_counter()
+    input_path = os.path.join(workdir, "script.py")
+    with open(input_path, "w") as f:
+        f.write(source)
+    with open(input_path) as f:
+        rewriter = rewrite(f.read(), sandbox_dir)
+    with open(os.path.join(workdir, 'imports.txt'), 'w') as f:
+        f.write(', '.join(rewriter.imports))
+    prepare_files(rewriter)
+    with open(os.path.join(workdir, 'new_script.py'), 'w') as f:
+        f.write(rewriter.render())
+    return time.perf_counter() - start
+
+
+def best_of(runs, source, repeat):
+    """Time each run the given number of times, alternating between them so that neither gains from running first."""
+    times = [[] for run in runs]
+    for i in range(repeat):
+        for run, run_times in zip(runs, times):
+            with tempfile.TemporaryDirectory() as workdir:
+                sandbox_dir = os.path.join(workdir, "sig") + "/"
+                os.mkdir(sandbox_dir)
+                run_times.append(run(source, workdir, sandbox_dir))
+    return [min(run_times) for run_times in times]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the single-pass rewrite pipeline.")
+    parser.add_argument("--lines", type=int, default=3000, help="Number of lines in the generated script")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of runs to take the best time of")
+    args = parser.parse_args()
+
+    # pkgutil.find_loader is deprecated, but it is what the legacy chain used
+    warnings.simplefilter("ignore", DeprecationWarning)
+    random.seed(0)
+    source = make_script(args.lines)
+    legacy_time, pipeline_time = best_of([run_legacy, run_pipeline], source, args.repeat)
+
+    print(f"script:   {len(source.splitlines())} lines, {len(source) / 1024:.0f} KB")
+    print(f"legacy:   {legacy_time * 1000:10.1f} ms")
+    print(f"pipeline: {pipeline_time * 1000:10.1f} ms")
+    print(f"speedup:  {legacy_time / pipeline_time:10.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+This script compares the request formats the browser can send a prompt in: the legacy form
+body of /save_files, with + and & swapped for sentinels and the whole body passed through
+encodeURI, and the JSON body of /api/prompt, plain and compressed with gzip. It builds a Python
+source of the given size, encodes it in each format as the browser does, and prints the size
+of each body, the time the browser spends encoding it, the time the server spends turning it
+back into the code, and whether the code arrives unchanged. The legacy body of a selection,
+which the browser did not escape, is shown too.
+
+Usage:
+    python benchmarks/bench_transport.py [--size KB] [--repeat N]
+"""
+
+import argparse
+import gzip
+import json
+import os
+import sys
+import time
+import urllib.parse
+
+from werkzeug.test import EnvironBuilder
+from werkzeug.wrappers import Request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from transport import MAX_BODY_BYTES, decode_prompt
+
+# The characters encodeURI leaves as they are besides letters and digits
+ENCODE_URI_SAFE = ";,/?:@&=+$-_.!~*'()#"
+
+
+def make_source(size):
+    """Build a Python source of roughly size characters that uses +, &, %, # and non-ASCII text."""
+    lines = []
+    total = 0
+    i = 0
+    while total < size:
+        block = [
+            f"def step_{i}(values, mask=0x{i % 256:02x}):",
+            f'    """Combine the values of step {i} – for café & co."""',
+            f"    total = sum(v + {i} for v in values if v & mask)  # 100% of them",
+            f"    return f\"{{total:+d}} = {{'&'.join(map(str, values))}}\"",
+            "",
+        ]
+        lines += block
+        total += sum(len(line) + 1 for line in block)
+        i += 1
+    return "\n".join(lines)
+
+
+def legacy_encode(code, context, escape=True):
+    """The body pyaiprompt.js used to post to /save_files, which did not escape a selection."""
+    if escape:
+        code = code.replace("+", "@PLUS@#@SIGN@").replace("&", "@AMPER@#@SIGN@")
+    body = "code=" + code + "&context=" + context + "&pyaiType=code"
+    return urllib.parse.quote(body, safe=ENCODE_URI_SAFE).encode()
+
+
+def legacy_decode(body):
+    """What save_files does with the legacy body."""
+    environ = EnvironBuilder(method="POST", data=body, content_type="application/x-www-form-urlencoded").get_environ()
+    form = Request(environ).form
+    return form["code"].replace("@PLUS@#@SIGN@", "+").replace("@AMPER@#@SIGN@", "&")
+
+
+def json_encode(code, context):
+    return json.dumps({"code": code, "context": context, "pyaiType": "code"}).encode()
+
+
+def gzip_encode(code, context):
+    # CompressionStream uses the default compression level
+    return gzip.compress(json_encode(code, context), 6)
+
+
+def best_time(function, argument, repeat):
+    """Return the result of the function and the fastest of repeat timed calls."""
+    best = float("inf")
+    for i in range(repeat):
+        start = time.perf_counter()
+        result = function(argument)
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the request formats of a prompt.")
+    parser.add_argument("--size", type=int, default=1024, help="Size of the source in KB")
+    parser.add_argument("--repeat", type=int, default=5, help="Times to repeat each measurement")
+    args = parser.parse_args()
+
+    code = make_source(args.size * 1024)
+    context = "Make it faster & shorter"
+    print(f"source: {len(code.encode()) / 1024:.0f} KB")
+    formats = [
+        ("legacy form", legacy_encode, legacy_decode),
+        ("legacy sel.", lambda c, ctx: legacy_encode(c, ctx, escape=False), legacy_decode),
+        ("json", json_encode, lambda body: decode_prompt(body, "", MAX_BODY_BYTES)["code"]),
+        ("json + gzip", gzip_encode, lambda body: decode_prompt(body, "gzip", MAX_BODY_BYTES)["code"]),
+    ]
+    print(f"{'format':<12} {'body':>10} {'ratio':>6} {'encode':>10} {'parse':>10}  round trip")
+    for name, encode, decode in formats:
+        body, encode_time = best_time(lambda c: encode(c, context), code, args.repeat)
+        decoded, parse_time = best_time(decode, body, args.repeat)
+        ratio = len(body) / len(code.encode())
+        exact = "exact" if decoded == code else "LOSSY"
+        print(f"{name:<12} {len(body) / 1024:8.0f} KB {ratio:5.2f}x {encode_time * 1000:7.1f} ms {parse_time * 1000:7.1f} ms  {exact}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+This script compares the per-job overhead of starting the pyaiprompt script for every job,
+as start-xml-rpc.py does by default, with handing the job to a warm worker from warmworker.py.
+It uses a stand-in engine that imports a set of modules, optionally sleeps to stand for client
+setup, and echoes the code back inside a code fence, so the times measured are pure overhead.
+
+Usage:
+    python benchmarks/bench_worker.py [--jobs N] [--setup SECONDS]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts"))
+
+from warmworker import WarmWorker
+
+
+ENGINE = '''
+import asyncio, decimal, email.mime.text, http.client, json, os, ssl, time, xml.etree.ElementTree
+time.sleep(float(os.environ.get("BENCH_SETUP", "0")))
+
+def main():
+    code = open(os.environ["PYAI_CODE_FILE"]).read()
+    with open(os.environ["PYAI_OUTPUT_FILE"], "w") as f:
+        f.write("```python\\n" + code + "\\n```\\n")
+{generate}
+if __name__ == "__main__":
+    main()
+'''
+
+GENERATE = '''
+def generate(code, context):
+    yield "```python\\n"
+    yield code + "\\n```\\n"
+'''
+
+
+def make_workdir(root, code):
+    """Create a job directory holding the input files, as run_job does."""
+    workdir = tempfile.mkdtemp(dir=root)
+    with open(os.path.join(workdir, "code.txt"), "w") as f:
+        f.write(code)
+    with open(os.path.join(workdir, "context.txt"), "w") as f:
+        f.write("context")
+    open(os.path.join(workdir, "output.txt"), "w").close()
+    return workdir
+
+
+def run_spawn(engine, root, code):
+    workdir = make_workdir(root, code)
+    env = dict(os.environ, PYAI_CODE_FILE=os.path.join(workdir, "code.txt"),
+               PYAI_CONTEXT_FILE=os.path.join(workdir, "context.txt"),
+               PYAI_OUTPUT_FILE=os.path.join(workdir, "output.txt"))
+    subprocess.run([sys.executable, engine], cwd=workdir, env=env, check=True)
+    with open(os.path.join(workdir, "output.txt")) as f:
+        return f.read()
+
+
+def run_warm(worker, root, code):
+    workdir = make_workdir(root, code)
+    output = []
+    worker.run(code, "context", workdir, output.append)
+    return "".join(output)
+
+
+def measure(name, run, jobs):
+    times = []
+    for i in range(jobs):
+        start = time.perf_counter()
+        output = run(f"print({i})")
+        times.append(time.perf_counter() - start)
+        assert f"print({i})" in output, output
+    times.sort()
+    print(f"{name:<22} mean {statistics.fmean(times) * 1000:8.1f} ms   "
+          f"p50 {times[len(times) // 2] * 1000:8.1f} ms   max {times[-1] * 1000:8.1f} ms")
+    return statistics.fmean(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark spawn-per-job against warm workers.")
+    parser.add_argument("--jobs", type=int, default=30, help="Jobs to run with each approach")
+    parser.add_argument("--setup", type=float, default=0.0, help="Seconds the engine spends on setup when loaded")
+    args = parser.parse_args()
+    os.environ["BENCH_SETUP"] = str(args.setup)
+
+    with tempfile.TemporaryDirectory() as root:
+        file_engine = os.path.join(root, "file_engine.py")
+        with open(file_engine, "w") as f:
+            f.write(ENGINE.format(generate=""))
+        generate_engine = os.path.join(root, "generate_engine.py")
+        with open(generate_engine, "w") as f:
+            f.write(ENGINE.format(generate=GENERATE))
+
+        spawn = measure("spawn per job", lambda code: run_spawn(file_engine, root, code), args.jobs)
+        for name, engine in (("warm, output file", file_engine), ("warm, generate()", generate_engine)):
+            worker = WarmWorker(engine, max_jobs=args.jobs + 1)
+            worker.start()
+            try:
+                warm = measure(name, lambda code: run_warm(worker, root, code), args.jobs)
+            finally:
+                worker.stop()
+            print(f"{'':<22} {spawn / warm:.1f}x faster than spawn per job")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+"""
+This script is a stand-in for the XML-RPC server in the virtual machine, so that the Flask app
+can be measured without a VM or the AI behind it. It implements prompt_ai, wait_output,
+status, getOutput and debug_code the way start-xml-rpc.py does, but instead of running the
+pyaiprompt script each job replays a made-up answer as a stream of tokens: a line of prose, the
+code in a fenced block and a few footnote links after it, as the AI writes them.
+
+The speed and shape of the stream are set on the command line: the delay before the first
+token, the number of tokens per second, the size of a token and the random jitter in the time
+between tokens, the size of the answer, and whether it has a code fence and footnotes. The
+answers are made from a seed, so runs with the same settings replay the same streams.
+
+FakeBackend runs the server in a thread of the calling process. bench_e2e.py starts this script
+as a separate process instead, so that the server's CPU use is not counted as the app's.
+
+Usage:
+    python benchmarks/fakebackend.py [--port N] [--rate TOKENS_PER_SECOND] [--size CHARS] ...
+"""
+
+import argparse
+import random
+import socketserver
+import threading
+import time
+import uuid
+from xmlrpc.server import SimpleXMLRPCRequestHandler, SimpleXMLRPCServer
+
+# Longest time a wait_output call may block in seconds
+MAX_WAIT = 30
+
+# Number of finished jobs to remember
+MAX_FINISHED_JOBS = 256
+
+
+class StreamSettings:
+    """How the answers of the stand-in AI are shaped and how fast they arrive."""
+
+    def __init__(self, delay=0.5, rate=200.0, token_size=4, jitter=0.2, size=2000,
+                 fenced=True, footnotes=3, debug_delay=1.0, seed=0):
+        self.delay = delay
+        self.rate = rate
+        self.token_size = token_size
+        self.jitter = jitter
+        self.size = size
+        self.fenced = fenced
+        self.footnotes = footnotes
+        self.debug_delay = debug_delay
+        self.seed = seed
+
+
+def make_answer(code, settings, rng):
+    """Build an answer of roughly settings.size characters that reworks the given code."""
+    lines = [line for line in code.splitlines() if line.strip()] or ["pass"]
+    body = []
+    total = 0
+    i = 0
+    while total < settings.size:
+        line = f"{lines[i % len(lines)]}  # revised {rng.randrange(1000)}"
+        body.append(line)
+        total += len(line) + 1
+        i += 1
+    answer = "Here is the updated code:\n\n"
+    if settings.fenced:
+        answer += "```python\n" + "\n".join(body) + "\n```\n"
+    else:
+        answer += "\n".join(body) + "\n"
+    for n in range(1, settings.footnotes + 1):
+        answer += f"\n[{n}]: https://www.example.com/{rng.randrange(10**6)}"
+    return answer + "\n"
+
+
+class FakeJob:
+    """One prompt and the part of its answer that has been streamed so far."""
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.status = "running"
+        self.output = ""
+        self.cond = threading.Condition()
+
+    def finished(self):
+        return self.status in ("done", "failed")
+
+
+class FakeAI:
+    """The XML-RPC methods of the stand-in server."""
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.count = 0
+
+    def _rng(self):
+        with self.lock:
+            self.count += 1
+            return random.Random(f"{self.settings.seed}\0{self.count}")
+
+    def _stream(self, job, answer, rng):
+        settings = self.settings
+        time.sleep(settings.delay)
+        interval = 1 / settings.rate if settings.rate > 0 else 0
+        next_time = time.monotonic()
+        for start in range(0, len(answer), settings.token_size):
+            next_time += interval * (1 + rng.uniform(-settings.jitter, settings.jitter))
+            pause = next_time - time.monotonic()
+            if pause > 0:
+                time.sleep(pause)
+            with job.cond:
+                job.output += answer[start:start + settings.token_size]
+                job.cond.notify_all()
+        with job.cond:
+            job.status = "done"
+            job.cond.notify_all()
+
+    def prompt_ai(self, code, context):
+        job = FakeJob()
+        with self.lock:
+            self.jobs[job.id] = job
+            finished = [job_id for job_id, old in self.jobs.items() if old.finished()]
+            for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+                del self.jobs[job_id]
+        rng = self._rng()
+        threading.Thread(target=self._stream, args=(job, make_answer(code, self.settings, rng), rng),
+                         daemon=True).start()
+        return job.id
+
+    def _job(self, job_id):
+        with self.lock:
+            if job_id not in self.jobs:
+                raise KeyError(f"unknown job {job_id}")
+            return self.jobs[job_id]
+
+    def status(self, job_id):
+        job = self._job(job_id)
+        with job.cond:
+            return {'status': job.status, 'length': len(job.output), 'error': ""}
+
+    def wait_output(self, job_id, offset, timeout):
+        job = self._job(job_id)
+        with job.cond:
+            job.cond.wait_for(lambda: len(job.output) > offset or job.finished(), min(timeout, MAX_WAIT))
+            return {'status': job.status, 'output': job.output[offset:], 'offset': len(job.output), 'error': ""}
+
+    def getOutput(self):
+        with self.lock:
+            if not self.jobs:
+                return ""
+            job = self.jobs[next(reversed(self.jobs))]
+        with job.cond:
+            return job.output
+
+    def debug_code(self, code, context):
+        time.sleep(self.settings.debug_delay)
+        return make_answer(code, self.settings, self._rng())
+
+
+class KeepAliveRequestHandler(SimpleXMLRPCRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ThreadedXMLRPCServer(socketserver.ThreadingMixIn, SimpleXMLRPCServer):
+    daemon_threads = True
+
+
+def make_server(host, port, settings):
+    """Create the stand-in server without starting it."""
+    server = ThreadedXMLRPCServer((host, port), requestHandler=KeepAliveRequestHandler,
+                                  allow_none=True, logRequests=False)
+    server.register_introspection_functions()
+    ai = FakeAI(settings)
+    for name in ("prompt_ai", "status", "wait_output", "getOutput", "debug_code"):
+        server.register_function(getattr(ai, name), name)
+    return server
+
+
+class FakeBackend:
+    """The stand-in server running in a thread of this process."""
+
+    def __init__(self, settings=None, host="127.0.0.1", port=0):
+        self.server = make_server(host, port, settings or StreamSettings())
+        self.url = f"http://{host}:{self.server.server_address[1]}/"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def add_arguments(parser):
+    """Add the options of StreamSettings to an argument parser."""
+    defaults = StreamSettings()
+    parser.add_argument("--delay", type=float, default=defaults.delay, help="Seconds before the first token")
+    parser.add_argument("--rate", type=float, default=defaults.rate, help="Tokens per second, 0 for no pause")
+    parser.add_argument("--token-size", type=int, default=defaults.token_size, help="Characters per token")
+    parser.add_argument("--jitter", type=float, default=defaults.jitter, help="Random change of each pause, as a fraction")
+    parser.add_argument("--size", type=int, default=defaults.size, help="Characters of code in each answer")
+    parser.add_argument("--no-fence", action="store_true", help="Answer without a code fence")
+    parser.add_argument("--footnotes", type=int, default=defaults.footnotes, help="Footnote links after each answer")
+    parser.add_argument("--debug-delay", type=float, default=defaults.debug_delay, help="Seconds debug_code takes")
+    parser.add_argument("--seed", type=int, default=defaults.seed, help="Seed of the answers")
+
+
+def settings_from(args):
+    """Build StreamSettings from the options added by add_arguments."""
+    return StreamSettings(args.delay, args.rate, args.token_size, args.jitter, args.size,
+                          not args.no_fence, args.footnotes, args.debug_delay, args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a stand-in AI backend over XML-RPC.")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=8000, help="Port to listen on")
+    add_arguments(parser)
+    args = parser.parse_args()
+    server = make_server(args.host, args.port, settings_from(args))
+    print(f"ready http://{args.host}:{server.server_address[1]}/", flush=True)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
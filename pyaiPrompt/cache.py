@@ -0,0 +1,224 @@
+"""
+This module contains the ResponseCache class, which remembers the output of finished prompts
+so that resubmitting the same code and context does not cost another round-trip to the AI.
+
+Entries are keyed on a hash of the normalised (code, context, pyaiType) and kept in an LRU
+in memory, optionally backed by a directory on disk that survives restarts. Both tiers are
+bounded in size and entries expire after a TTL.
+
+Dependencies:
+- collections: for the LRU order of the memory tier
+- hashlib: for the content hash
+- json: for the disk tier file format
+- os: for the disk tier
+- threading: for the cache lock
+- time: for expiry
+"""
+
+import collections
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+# Largest number of entries in memory
+CACHE_ENTRIES = 512
+
+# Largest total size of the entries in memory in characters
+CACHE_BYTES = 64 * 1024 * 1024
+
+# Largest total size of the disk tier in bytes
+CACHE_DISK_BYTES = 512 * 1024 * 1024
+
+# Seconds an entry is kept
+CACHE_TTL = 3600
+
+# Number of writes to the disk tier between size checks
+PRUNE_EVERY = 50
+
+
+def normalize(text):
+    """Normalise line endings and trailing whitespace so trivially different inputs share a key.
+
+    Args:
+        text (str): The text
+
+    Returns:
+        str: The normalised text
+    """
+    lines = text.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+    return "\n".join(line.rstrip() for line in lines).strip()
+
+
+def cache_key(code, context, pyaiType):
+    """Return the content hash that identifies a prompt.
+
+    Args:
+        code (str): The code
+        context (str): The context
+        pyaiType (str): The type of pyai operation (code or debug)
+
+    Returns:
+        str: The hex SHA-256 of the normalised inputs
+    """
+    payload = json.dumps([normalize(code), normalize(context), pyaiType])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """A two-tier cache of prompt outputs keyed by cache_key.
+
+    Args:
+        max_entries (int): The largest number of entries in memory
+        max_bytes (int): The largest total size of the entries in memory
+        ttl (float): Seconds an entry is kept
+        directory (str): The directory of the disk tier, or None for memory only
+        max_disk_bytes (int): The largest total size of the disk tier
+    """
+
+    def __init__(self, max_entries=CACHE_ENTRIES, max_bytes=CACHE_BYTES, ttl=CACHE_TTL,
+                 directory=None, max_disk_bytes=CACHE_DISK_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._size = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def get(self, key):
+        """Return the cached output for a key, or None on a miss.
+
+        Args:
+            key (str): The cache key
+
+        Returns:
+            str: The output, or None
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, text = entry
+                if expires > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return text
+                self._remove(key)
+        text = self._read_disk(key, now)
+        with self._lock:
+            if text is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._store(key, now + self.ttl, text)
+            return text
+
+    def put(self, key, text):
+        """Cache the output for a key.
+
+        Args:
+            key (str): The cache key
+            text (str): The output
+        """
+        expires = time.time() + self.ttl
+        with self._lock:
+            self._store(key, expires, text)
+        self._write_disk(key, expires, text)
+
+    def stats(self):
+        """Return the hit and miss counters and the size of the memory tier.
+
+        Returns:
+            dict: The statistics
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries),
+                    'size': self._size, 'disk': bool(self.directory)}
+
+    def _remove(self, key):
+        expires, text = self._entries.pop(key)
+        self._size -= len(text)
+
+    def _store(self, key, expires, text):
+        # Add an entry to the memory tier and evict the least recently used ones past the limits
+        if len(text) > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (expires, text)
+        self._size += len(text)
+        while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".json")
+
+    def _read_disk(self, key, now):
+        if not self.directory:
+            return None
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry['expires'] <= now:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        return entry['text']
+
+    def _write_disk(self, key, expires, text):
+        if not self.directory:
+            return
+        path = self._path(key)
+        # Write to a temporary file first so a reader never sees half an entry
+        temp = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(temp, "w") as f:
+                json.dump({'expires': expires, 'text': text}, f)
+            os.replace(temp, path)
+        except OSError as e:
+            # The memory tier still has the entry, so a full or read-only disk is not fatal
+            print(f"could not cache {key} on disk: {e}")
+            return
+        with self._lock:
+            self._writes += 1
+            prune = self._writes % PRUNE_EVERY == 0
+        if prune:
+            self._prune_disk()
+
+    def _prune_disk(self):
+        # Delete expired entries, then the oldest ones until the disk tier fits its limit
+        now = time.time()
+        files = []
+        for root, dirs, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        files.sort()
+        total = sum(size for mtime, size, path in files)
+        for mtime, size, path in files:
+            if total <= self.max_disk_bytes and mtime + self.ttl > now:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
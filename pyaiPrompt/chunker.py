@@ -0,0 +1,239 @@
+"""
+This module splits a large Python source into chunks along the boundaries of its top-level
+statements, so that each chunk can be sent to the AI as a prompt of its own, and puts the
+answers back together in the original order.
+
+The source is parsed with ast, and every line is given to the top-level statement it belongs
+to, along with the comments, blank lines and decorators above it. The chunks hold the whole
+source between them and no function or class is ever cut in two. Statements are packed into
+chunks of up to a set size in order, and a single function or class larger than that becomes a
+chunk of its own.
+
+The AI only sees its own chunk, so the context of each chunk also lists the imports of the
+whole file and the signatures of the functions, classes and globals in the other chunks,
+without their bodies.
+
+Dependencies:
+- ast: for the top-level statements, imports and signatures of the source
+- copy: for signatures without their bodies
+- io: for splitting the source into lines the way the parser counts them
+- re: for the import lines of the answers
+"""
+
+import ast
+import copy
+import io
+import re
+
+
+# Sources longer than this many characters are split into chunks of up to this size
+MAX_CHUNK_CHARS = 16 * 1024
+
+# Longest list of imports and signatures given to a chunk as context, in characters
+MAX_OUTLINE_CHARS = 8 * 1024
+
+# A top-level import statement on one line of an answer
+IMPORT_LINE = re.compile(r"^(?:import\s+[\w.]+(?:\s+as\s+\w+)?(?:\s*,\s*[\w.]+(?:\s+as\s+\w+)?)*"
+                         r"|from\s+\.*[\w.]*\s+import\s+[^()\\#]+?)\s*(?:#.*)?$")
+
+
+class Chunk:
+    """A run of top-level statements of a source.
+
+    Attributes:
+        index (int): The position of the chunk in the source, from 0
+        start (int): The first line of the chunk, from 1
+        end (int): The last line of the chunk
+        source (str): The lines of the chunk
+        imports (list): The top-level import statements of the chunk
+        signatures (list): The signatures of the functions, classes and globals of the chunk
+    """
+
+    def __init__(self, index, start, end, source, imports, signatures):
+        self.index = index
+        self.start = start
+        self.end = end
+        self.source = source
+        self.imports = imports
+        self.signatures = signatures
+
+
+def _lines(source):
+    # The lines of a source with their line endings, split on the same newlines as the parser
+    return io.StringIO(source, newline="").readlines()
+
+
+def _units(tree, count):
+    # The first and last line and the statements of each top-level statement, with the comments,
+    # blank lines and decorators above it, so that together they cover all count lines
+    units = []
+    for node in tree.body:
+        if units and node.lineno <= units[-1][1]:
+            # Statements that share a line, such as "a = 1; b = 2", stay together
+            units[-1][1] = max(units[-1][1], node.end_lineno)
+            units[-1][2].append(node)
+        else:
+            units.append([units[-1][1] + 1 if units else 1, node.end_lineno, [node]])
+    if units:
+        units[-1][1] = count
+    return units
+
+
+def _stub(node):
+    # A function or class without its body, keeping the signatures of a class's methods
+    stub = copy.copy(node)
+    if isinstance(node, ast.ClassDef):
+        stub.body = [_stub(child) for child in node.body
+                     if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef))]
+    else:
+        stub.body = []
+    stub.body = stub.body or [ast.Expr(ast.Constant(...))]
+    return stub
+
+
+def _segment(lines, node):
+    # The source of a statement, like ast.get_source_segment but without splitting the whole
+    # source into lines again for each statement; the column offsets count UTF-8 bytes
+    text = "".join(lines[node.lineno - 1:node.end_lineno]).encode("utf-8")
+    end = len(text) - len(lines[node.end_lineno - 1].encode("utf-8")) + node.end_col_offset
+    return text[node.col_offset:end].decode("utf-8")
+
+
+def _outline(nodes, lines):
+    # The import statements and signatures of some top-level statements
+    imports = []
+    signatures = []
+    for node in nodes:
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            imports.append(_segment(lines, node))
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            signatures.append(ast.unparse(_stub(node)))
+        elif isinstance(node, (ast.Assign, ast.AnnAssign)):
+            targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+            names = [target.id for target in targets if isinstance(target, ast.Name)]
+            signatures += [f"{name} = ..." for name in names]
+    return imports, signatures
+
+
+def split(source, max_chars=MAX_CHUNK_CHARS):
+    """Split a source into chunks of whole top-level statements.
+
+    Args:
+        source (str): The Python source
+        max_chars (int): The largest size of a chunk, unless a single statement is larger
+
+    Returns:
+        list: The chunks in order, which joined give back the source, or None if the
+        source does not parse
+    """
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError):
+        return None
+    lines = _lines(source)
+    units = _units(tree, len(lines))
+    if not units:
+        return [Chunk(0, 1, len(lines), source, [], [])]
+    chunks = []
+    group = []
+    size = 0
+    for start, end, nodes in units:
+        length = sum(len(line) for line in lines[start - 1:end])
+        if group and size + length > max_chars:
+            chunks.append(_make_chunk(len(chunks), group, lines))
+            group = []
+            size = 0
+        group.append((start, end, nodes))
+        size += length
+    chunks.append(_make_chunk(len(chunks), group, lines))
+    return chunks
+
+
+def _make_chunk(index, group, lines):
+    start, end = group[0][0], group[-1][1]
+    imports, signatures = _outline([node for _, _, nodes in group for node in nodes], lines)
+    return Chunk(index, start, end, "".join(lines[start - 1:end]), imports, signatures)
+
+
+def chunk_context(context, chunk, chunks):
+    """Return the context to send with a chunk: the user's context, where the chunk sits
+    in the file, and the imports and signatures of the rest of the file.
+
+    Args:
+        context (str): The context of the whole source
+        chunk (Chunk): The chunk
+        chunks (list): Every chunk of the source
+
+    Returns:
+        str: The context of the chunk
+    """
+    imports = [statement for other in chunks for statement in other.imports]
+    signatures = [signature for other in chunks if other is not chunk for signature in other.signatures]
+    outline = "\n".join(list(dict.fromkeys(imports)) + signatures)
+    if len(outline) > MAX_OUTLINE_CHARS:
+        outline = outline[:MAX_OUTLINE_CHARS].rsplit("\n", 1)[0] + "\n# ..."
+    note = (f"This code is part {chunk.index + 1} of {len(chunks)} of a larger Python file, lines "
+            f"{chunk.start} to {chunk.end}. Only answer with this part. The rest of the file has "
+            f"these imports and definitions:\n\n{outline}")
+    return f"{context.strip()}\n\n{note}" if context.strip() else note
+
+
+class Stitcher:
+    """Puts the answers for the chunks of a source back together in the original order,
+    whatever order they arrive in.
+
+    Import lines at the top of an answer that an earlier answer already has are left out,
+    since every chunk is told about the imports of the whole file.
+
+    Args:
+        count (int): The number of chunks
+    """
+
+    def __init__(self, count):
+        self.count = count
+        # The answers that arrived before those of the chunks in front of them
+        self._waiting = {}
+        self._next = 0
+        self._imports = set()
+        self._started = False
+
+    @property
+    def done(self):
+        """bool: Whether the answers for every chunk have been added."""
+        return self._next == self.count
+
+    def add(self, index, answer):
+        """Add the answer for a chunk.
+
+        Args:
+            index (int): The position of the chunk
+            answer (str): The code the AI gave back for it
+
+        Returns:
+            str: The text that follows what was returned before, which is empty until
+            the answers for every earlier chunk have arrived
+        """
+        self._waiting[index] = answer
+        text = ""
+        while self._next in self._waiting:
+            answer = self._waiting.pop(self._next)
+            if self._next > 0:
+                answer = self._drop_repeated_imports(answer)
+            answer = answer.strip("\n")
+            if answer:
+                self._imports.update(line.rstrip() for line in answer.split("\n") if IMPORT_LINE.match(line))
+                # Two blank lines between parts, as between top-level definitions
+                text += ("\n\n" if self._started else "") + answer + "\n"
+                self._started = True
+            self._next += 1
+        return text
+
+    def _drop_repeated_imports(self, answer):
+        # Leave out the import lines at the top of an answer that were already added
+        lines = answer.split("\n")
+        for i, line in enumerate(lines):
+            if line.strip() and not IMPORT_LINE.match(line):
+                break
+            if line.rstrip() in self._imports:
+                lines[i] = None
+        return "\n".join(line for line in lines if line is not None)
@@ -0,0 +1,141 @@
+"""
+This module contains the CodeFenceExtractor class, which pulls the first fenced code
+block out of the AI output while the output is still being generated. Each call only
+looks at the text that arrived since the previous call, so following a long answer
+costs time proportional to its length instead of its length squared.
+
+Dependencies:
+- re: for regular expressions
+"""
+
+import re
+
+
+# Matches the URL footnotes that Bing adds below its answers
+FOOTNOTE = re.compile(r'\[\d+\]: https://')
+
+# Matches a language tag left on its own line after the opening fence
+LANGUAGE_TAG = re.compile(r'\s*(?:python|py)\s*', re.IGNORECASE)
+
+# The code fence
+FENCE = '```'
+
+
+class CodeFenceExtractor:
+    """Incrementally extract the code between the first pair of ``` fences.
+
+    Text before the opening fence, the fence lines themselves, URL footnotes and a
+    bare python/py language tag line are dropped. Complete code lines are returned
+    as soon as they arrive, and the start of an unfinished line is returned early
+    when it can no longer turn out to be a fence or a footnote.
+
+    Attributes:
+        consumed (int): How many characters of output have been fed so far
+        closed (bool): Whether the closing fence has been seen
+    """
+
+    def __init__(self):
+        self.consumed = 0
+        self.closed = False
+        self._in_code = False
+        self._expect_tag = False
+        self._pending = ""
+        self._sent = 0
+
+    @property
+    def opened(self):
+        """bool: Whether the opening fence has been seen."""
+        return self._in_code
+
+    def feed(self, chunk):
+        """Consume the next piece of output.
+
+        Args:
+            chunk (str): The text that followed the previously fed text
+
+        Returns:
+            str: The new code found in the chunk
+        """
+        self.consumed += len(chunk)
+        if self.closed or not chunk:
+            return ""
+        lines = (self._pending + chunk).split("\n")
+        self._pending = lines.pop()
+        code = []
+        for line in lines:
+            code.append(self._line(line))
+            self._sent = 0
+            if self.closed:
+                self._pending = ""
+                break
+        code.append(self._partial())
+        return "".join(code)
+
+    def update(self, output):
+        """Consume the full output so far, of which only the new suffix is read.
+
+        Args:
+            output (str): The whole output, which must only ever grow
+
+        Returns:
+            str: The new code found since the last call
+        """
+        return self.feed(output[self.consumed:])
+
+    def finish(self):
+        """Treat any unfinished last line as complete.
+
+        Returns:
+            str: The code found on that line
+        """
+        if self.closed or not self._pending:
+            return ""
+        line, self._pending = self._pending, ""
+        code = self._line(line)
+        self._sent = 0
+        return code.rstrip("\n")
+
+    def _line(self, line):
+        # Handle one complete line, of which the first _sent characters were already returned
+        line = line.rstrip("\r")
+        if self._sent == 0 and FOOTNOTE.match(line):
+            return ""
+        if FENCE in line:
+            if not self._in_code:
+                self._in_code = True
+                self._expect_tag = True
+                return ""
+            self.closed = True
+            return line[self._sent:line.index(FENCE)]
+        if not self._in_code:
+            return ""
+        if self._expect_tag:
+            self._expect_tag = False
+            if LANGUAGE_TAG.fullmatch(line):
+                return ""
+        return line[self._sent:] + "\n"
+
+    def _partial(self):
+        # Return the part of the unfinished line that is already known to be code
+        if not self._in_code or self._expect_tag or self._pending.startswith("["):
+            return ""
+        safe = re.match(r'[^`\r]*', self._pending).group()
+        code = safe[self._sent:]
+        self._sent = max(self._sent, len(safe))
+        return code
+
+
+def extract_code(output):
+    """Extract the first fenced code block from a complete AI output.
+
+    Args:
+        output (str): The whole output
+
+    Returns:
+        str: The code, or the stripped output if it has no code fence
+    """
+    extractor = CodeFenceExtractor()
+    code = extractor.feed(output) + extractor.finish()
+    if not extractor.opened:
+        return output.strip()
+    return code.strip()
@@ -0,0 +1,273 @@
+"""
+This module contains the Job class, which holds the state and output of one prompt,
+the JobRegistry class, a bounded thread-safe store of jobs that lets each request
+follow its own output, and the JobQueue class, a bounded queue in front of a fixed
+pool of worker threads that run the jobs.
+
+Dependencies:
+- collections: for the insertion-ordered job table and the queue
+- math: for rounding up queue positions
+- statistics: for average wait and run times
+- threading: for the registry lock and the worker threads
+- time: for job timestamps and expiry
+- uuid: for job IDs
+- outputstream: for the per-job output buffer
+"""
+
+import collections
+import math
+import statistics
+import threading
+import time
+import uuid
+
+from outputstream import OutputStream
+
+
+# Seconds a finished job is kept so late clients can still read its output
+JOB_TTL = 300
+
+# Largest number of jobs kept at once
+MAX_JOBS = 256
+
+# Number of worker threads that run jobs
+WORKERS = 4
+
+# Largest number of jobs waiting for a worker before new ones are turned away
+MAX_QUEUED = 32
+
+# Number of recent jobs the wait and run time statistics are taken from
+STATS_WINDOW = 200
+
+
+class RegistryFull(Exception):
+    """Raised when a job cannot be created because every slot holds a running job."""
+
+
+class QueueFull(Exception):
+    """Raised when a job cannot be queued because the queue is full."""
+
+
+class Job:
+    """One prompt and the output streamed from it.
+
+    Attributes:
+        id (str): The job ID handed to the client
+        stream (OutputStream): The extracted code
+        created (float): When the job was created
+        started (float): When a worker picked the job up, or None while it is queued
+        finished (float): When the job finished, or None while it is running
+    """
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.stream = OutputStream()
+        self.created = time.monotonic()
+        self.started = None
+        self.finished = None
+
+    @property
+    def status(self):
+        """str: "queued", "running" or "done"."""
+        if self.finished is not None:
+            return "done"
+        return "queued" if self.started is None else "running"
+
+    def finish(self):
+        """Finish the output stream and record when the job ended."""
+        self.stream.finish()
+        self.finished = time.monotonic()
+
+
+class JobRegistry:
+    """A bounded, thread-safe table of jobs.
+
+    Finished jobs are evicted once they are older than ttl. When the table is
+    full the oldest finished job is evicted early; if every job is still
+    running, RegistryFull is raised so the caller can turn the request away.
+    """
+
+    def __init__(self, max_jobs=MAX_JOBS, ttl=JOB_TTL):
+        self.max_jobs = max_jobs
+        self.ttl = ttl
+        self._jobs = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._jobs)
+
+    def _evict(self, now):
+        # Drop every finished job whose TTL has expired
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished is not None and now - job.finished > self.ttl]
+        for job_id in expired:
+            del self._jobs[job_id]
+        # Still full, so drop the oldest finished job
+        if len(self._jobs) >= self.max_jobs:
+            for job_id, job in self._jobs.items():
+                if job.finished is not None:
+                    del self._jobs[job_id]
+                    break
+
+    def create(self):
+        """Create and register a new job.
+
+        Returns:
+            Job: The new job
+
+        Raises:
+            RegistryFull: If the registry is full of running jobs
+        """
+        with self._lock:
+            self._evict(time.monotonic())
+            if len(self._jobs) >= self.max_jobs:
+                raise RegistryFull(f"{len(self._jobs)} jobs are already running")
+            job = Job()
+            self._jobs[job.id] = job
+            return job
+
+    def get(self, job_id):
+        """Look up a job by ID.
+
+        Args:
+            job_id (str): The job ID
+
+        Returns:
+            Job: The job, or None if it does not exist or has expired
+        """
+        with self._lock:
+            self._evict(time.monotonic())
+            return self._jobs.get(job_id)
+
+    def remove(self, job_id):
+        """Forget a job, for example one that could not be queued.
+
+        Args:
+            job_id (str): The job ID
+        """
+        with self._lock:
+            self._jobs.pop(job_id, None)
+
+
+class JobQueue:
+    """A bounded FIFO queue of jobs in front of a fixed pool of worker threads.
+
+    The number of workers caps how many jobs talk to the VM at once, and
+    max_queued caps how many wait for a worker, so a burst of requests is
+    turned away with QueueFull instead of piling up threads. Recent wait and
+    run times are kept to estimate when a queued job will start and to size
+    the pool.
+    """
+
+    def __init__(self, workers=WORKERS, max_queued=MAX_QUEUED):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.rejected = 0
+        self.completed = 0
+        self._queue = collections.deque()
+        self._cond = threading.Condition()
+        self._running = 0
+        self._waits = collections.deque(maxlen=STATS_WINDOW)
+        self._runs = collections.deque(maxlen=STATS_WINDOW)
+        for i in range(workers):
+            threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True).start()
+
+    def submit(self, job, target, *args):
+        """Queue a job to be run as target(job, *args) by the next free worker.
+
+        Args:
+            job (Job): The job
+            target (callable): The function that runs the job
+            *args: More arguments for target
+
+        Returns:
+            int: How many jobs will start before it, plus one, or 0 if a worker is free
+
+        Raises:
+            QueueFull: If max_queued jobs are already waiting
+        """
+        with self._cond:
+            if len(self._queue) >= self.max_queued:
+                self.rejected += 1
+                raise QueueFull(f"{len(self._queue)} jobs are already waiting")
+            self._queue.append((job, target, args))
+            self._cond.notify()
+            return max(0, len(self._queue) - self._idle())
+
+    def _idle(self):
+        # Workers that are free to take a job from the queue
+        return max(0, self.workers - self._running)
+
+    def position(self, job):
+        """Return the position of a job in the queue.
+
+        Args:
+            job (Job): The job
+
+        Returns:
+            int: How many jobs will start before it, plus one, or 0 if it is
+            running or about to start
+        """
+        with self._cond:
+            for position, (queued, target, args) in enumerate(self._queue, 1):
+                if queued is job:
+                    return max(0, position - self._idle())
+            return 0
+
+    def eta(self, position):
+        """Estimate how many seconds a job at a queue position will wait before it starts.
+
+        Args:
+            position (int): The position in the queue, starting at 1
+
+        Returns:
+            float: The estimated wait, or None before any job has finished
+        """
+        with self._cond:
+            if not self._runs:
+                return None
+            return statistics.fmean(self._runs) * math.ceil(position / self.workers)
+
+    def stats(self):
+        """Return the queue depth, worker usage and recent wait and run times.
+
+        Returns:
+            dict: The statistics, with times in seconds
+        """
+        with self._cond:
+            waits = sorted(self._waits)
+            runs = list(self._runs)
+            stats = {
+                'workers': self.workers,
+                'running': self._running,
+                'queued': len(self._queue),
+                'max_queued': self.max_queued,
+                'completed': self.completed,
+                'rejected': self.rejected,
+            }
+        stats['wait_avg'] = statistics.fmean(waits) if waits else None
+        stats['wait_p50'] = waits[len(waits) // 2] if waits else None
+        stats['wait_p95'] = waits[min(len(waits) - 1, int(len(waits) * 0.95))] if waits else None
+        stats['wait_max'] = waits[-1] if waits else None
+        stats['run_avg'] = statistics.fmean(runs) if runs else None
+        return stats
+
+    def _work(self):
+        # Run queued jobs one after another for as long as the app is up
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._queue)
+                job, target, args = self._queue.popleft()
+                job.started = time.monotonic()
+                self._waits.append(job.started - job.created)
+                self._running += 1
+            try:
+                target(job, *args)
+            except Exception as e:
+                print(f"job {job.id} failed: {e}")
+            finally:
+                with self._cond:
+                    self._running -= 1
+                    self.completed += 1
+                    self._runs.append(time.monotonic() - job.started)
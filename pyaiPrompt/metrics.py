@@ -0,0 +1,341 @@
+"""
+This module contains the instrumentation of the Flask app: counters, gauges and latency
+histograms that are exported in the Prometheus text format by the /metrics endpoint, and the
+Trace class, which times the stages of one prompt and records them in the histograms.
+
+A trace can also be written as one JSON line per prompt to a log file named by the
+PYAI_TRACE_LOG environment variable, showing where each slow prompt spent its time.
+
+Recording a value takes a lock and a few additions, so the instrumentation is cheap enough to
+leave on all the time.
+
+Dependencies:
+- bisect: for finding the bucket of a histogram value
+- json: for the trace log format
+- math: for the +Inf bucket bound
+- os: for the trace log setting
+- threading: for the metric locks
+- time: for span timings and trace timestamps
+"""
+
+import bisect
+import json
+import math
+import os
+import threading
+import time
+
+
+# Upper bounds of the latency buckets in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+# File to write a JSON line per prompt to, or unset for no trace log
+TRACE_LOG = os.environ.get('PYAI_TRACE_LOG')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in pairs) + "}"
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """The name, help text and label names shared by every kind of metric.
+
+    Args:
+        name (str): The metric name
+        documentation (str): The help text
+        labelnames (tuple): The names of the labels the values are split by
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes the labels {self.labelnames}, not {tuple(labels)}")
+        return tuple(labels[name] for name in self.labelnames)
+
+    def samples(self):
+        """Return the (suffix, label values, extra labels, value) of every sample."""
+        return []
+
+    def render(self):
+        """Return the metric in the Prometheus text format.
+
+        Returns:
+            str: The HELP and TYPE lines followed by a line per sample
+        """
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, values, extra, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(self.labelnames, values, extra)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+class Counter(Metric):
+    """A value that only goes up, such as the number of failed prompts."""
+
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {} if labelnames else {(): 0}
+
+    def inc(self, amount=1, **labels):
+        """Add to the counter.
+
+        Args:
+            amount (float): The amount to add
+            **labels: The value of every label
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [("_total", key, (), value) for key, value in sorted(self._values.items())]
+
+
+class Gauge(Metric):
+    """A value that goes up and down, such as the number of prompts in flight.
+
+    Args:
+        function (callable): Called for the value when the metric is read, instead of keeping one
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, function=None):
+        super().__init__(name, documentation)
+        self.function = function
+        self._value = 0
+
+    def inc(self, amount=1):
+        """Add to the gauge."""
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount=1):
+        """Subtract from the gauge."""
+        with self._lock:
+            self._value -= amount
+
+    def samples(self):
+        value = self.function() if self.function else self._value
+        return [("", (), (), value)]
+
+
+class Histogram(Metric):
+    """The distribution of a value, such as a latency, in cumulative buckets.
+
+    Args:
+        buckets (tuple): The upper bounds of the buckets in increasing order
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets) + (math.inf,)
+        # The count per bucket, the sum and the count of every set of label values
+        self._values = {}
+
+    def observe(self, value, **labels):
+        """Record a value.
+
+        Args:
+            value (float): The value
+            **labels: The value of every label
+        """
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total, count = self._values.get(key) or ([0] * len(self.buckets), 0.0, 0)
+            counts[index] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            values = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items())
+        for key, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket in zip(self.buckets, counts):
+                cumulative += bucket
+                samples.append(("_bucket", key, (("le", _format_value(bound)),), cumulative))
+            samples.append(("_sum", key, (), total))
+            samples.append(("_count", key, (), count))
+        return samples
+
+
+class Registry:
+    """The metrics exported by the /metrics endpoint."""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        """Add a metric to the registry and return it."""
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Return every metric in the Prometheus text format.
+
+        Returns:
+            str: The exposition text
+        """
+        return "".join(metric.render() for metric in self._metrics)
+
+
+# The metrics of the app
+registry = Registry()
+
+STAGE_SECONDS = registry.register(Histogram(
+    "pyai_stage_seconds", "Time spent in each stage of a prompt.", ("stage",)))
+
+PROMPT_SECONDS = registry.register(Histogram(
+    "pyai_prompt_seconds", "Time from submitting a prompt to its last output.", ("type", "outcome")))
+
+FIRST_CODE_SECONDS = registry.register(Histogram(
+    "pyai_first_code_seconds", "Time from submitting a prompt to its first extracted code.", ("type",)))
+
+PROMPTS = registry.register(Counter(
+    "pyai_prompts", "Prompts by type and outcome.", ("type", "outcome")))
+
+IN_FLIGHT = registry.register(Gauge(
+    "pyai_prompts_in_flight", "Prompts that are queued or running."))
+
+
+class Span:
+    """A timed stage of a trace, used as a context manager."""
+
+    def __init__(self, trace, stage):
+        self.trace = trace
+        self.stage = stage
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, *exc):
+        self.trace.record(self.stage, time.monotonic() - self.start, self.start)
+
+
+class Trace:
+    """The timings of one prompt, from the request to its last output.
+
+    Each stage is recorded in the pyai_stage_seconds histogram as it ends, and the whole trace
+    is written to the trace log when the prompt finishes.
+
+    Args:
+        pyaiType (str): The type of pyai operation (code or debug)
+        job_id (str): The job of the prompt, for the trace log
+
+    Attributes:
+        start (float): When the request arrived
+        spans (list): The (stage, offset from start, duration) of every span so far
+        marks (dict): The offset from start of every mark
+    """
+
+    def __init__(self, pyaiType="", job_id=None):
+        self.pyaiType = pyaiType
+        self.job_id = job_id
+        self.start = time.monotonic()
+        self.spans = []
+        self.marks = {}
+        self.finished = False
+        IN_FLIGHT.inc()
+
+    def span(self, stage):
+        """Return a context manager that times a stage.
+
+        Args:
+            stage (str): The name of the stage
+
+        Returns:
+            Span: The span
+        """
+        return Span(self, stage)
+
+    def record(self, stage, duration, start=None):
+        """Record a stage that has already been timed.
+
+        Args:
+            stage (str): The name of the stage
+            duration (float): How long the stage took in seconds
+            start (float): When the stage started, defaults to its end minus its duration
+        """
+        if start is None:
+            start = time.monotonic() - duration
+        STAGE_SECONDS.observe(duration, stage=stage)
+        if TRACE_LOG:
+            self.spans.append((stage, round(start - self.start, 6), round(duration, 6)))
+
+    def mark(self, name):
+        """Record the first time something happened, such as the first extracted code.
+
+        Args:
+            name (str): The name of the mark
+        """
+        if name in self.marks:
+            return
+        self.marks[name] = time.monotonic() - self.start
+        if name == "first_code":
+            FIRST_CODE_SECONDS.observe(self.marks[name], type=self.pyaiType)
+
+    def finish(self, outcome):
+        """Record the total time and outcome of the prompt. Later calls do nothing.
+
+        Args:
+            outcome (str): How the prompt ended, such as "ok", "error", "timeout" or "cached"
+        """
+        if self.finished:
+            return
+        self.finished = True
+        total = time.monotonic() - self.start
+        IN_FLIGHT.dec()
+        PROMPTS.inc(type=self.pyaiType, outcome=outcome)
+        PROMPT_SECONDS.observe(total, type=self.pyaiType, outcome=outcome)
+        if TRACE_LOG:
+            write_trace({
+                'time': time.time(), 'job_id': self.job_id, 'type': self.pyaiType, 'outcome': outcome,
+                'total': round(total, 6), 'marks': {name: round(value, 6) for name, value in self.marks.items()},
+                'spans': self.spans,
+            })
+
+
+# Serialises the lines written to the trace log
+_trace_lock = threading.Lock()
+
+
+def write_trace(entry):
+    """Append one trace as a JSON line to the trace log.
+
+    Args:
+        entry (dict): The trace
+    """
+    line = json.dumps(entry) + "\n"
+    try:
+        with _trace_lock, open(TRACE_LOG, 'a') as f:
+            f.write(line)
+    except OSError as e:
+        print(f"could not write the trace log: {e}")
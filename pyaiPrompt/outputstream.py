@@ -0,0 +1,198 @@
+"""
+This module contains the OutputStream class, a thread-safe buffer that the Flask app
+writes the extracted AI code into while a prompt is running, and the helpers used to
+push that buffer to the browser as Server-Sent Events.
+
+Readers keep their place with a cursor, "<generation>:<offset>", so each read returns
+only the text the reader does not have yet, and a reader that lost its connection
+resumes where it stopped.
+
+Dependencies:
+- bisect: for locating chunks by character offset
+- json: for encoding event payloads
+- threading: for the condition variable that wakes waiting readers
+"""
+
+import bisect
+import json
+import threading
+
+
+class OutputStream:
+    """A growing piece of text that one writer appends to and many readers follow.
+
+    The text is kept as a list of chunks so that appending and reading the new
+    suffix are proportional to the size of the change rather than the whole text.
+    A reset starts a new generation, which tells readers to drop what they have.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._chunks = []
+        self._ends = []
+        self._generation = 0
+        self._done = False
+
+    @property
+    def text(self):
+        """str: The full text written so far."""
+        with self._cond:
+            return self._join(0)
+
+    @property
+    def done(self):
+        """bool: Whether the writer has finished."""
+        with self._cond:
+            return self._done
+
+    def _length(self):
+        return self._ends[-1] if self._ends else 0
+
+    def _join(self, offset):
+        # Find the first chunk that ends after offset and only join from there
+        index = bisect.bisect_right(self._ends, offset)
+        if index >= len(self._chunks):
+            return ""
+        start = self._ends[index] - len(self._chunks[index])
+        return self._chunks[index][offset - start:] + "".join(self._chunks[index + 1:])
+
+    def append(self, text):
+        """Append text to the stream and wake any waiting readers.
+
+        Args:
+            text (str): The new text
+        """
+        if not text:
+            return
+        with self._cond:
+            self._chunks.append(text)
+            self._ends.append(self._length() + len(text))
+            self._cond.notify_all()
+
+    def publish(self, text):
+        """Replace the stream contents with text.
+
+        If text only extends what was already written, just the new suffix is
+        appended. Otherwise the stream is reset so readers replace their copy.
+
+        Args:
+            text (str): The full current text
+        """
+        with self._cond:
+            length = self._length()
+            if len(text) >= length and text.startswith(self._join(0)):
+                self.append(text[length:])
+            else:
+                self._chunks = [text] if text else []
+                self._ends = [len(text)] if text else []
+                self._generation += 1
+                self._cond.notify_all()
+
+    def finish(self):
+        """Mark the stream as finished and wake any waiting readers."""
+        with self._cond:
+            self._done = True
+            self._cond.notify_all()
+
+    def wait(self, generation, offset, timeout=None):
+        """Wait until there is text past offset, the stream was reset, or it finished.
+
+        Args:
+            generation (int): The generation the reader last saw, or None
+            offset (int): How many characters of that generation the reader has
+            timeout (float): The longest time to wait in seconds
+
+        Returns:
+            tuple: (generation, offset, text, replaced, done) where text is the new
+            text since offset, or the whole text if replaced is True.
+        """
+        with self._cond:
+            self._cond.wait_for(
+                lambda: self._generation != generation or self._length() > offset or self._done,
+                timeout)
+            if self._generation != generation:
+                return self._generation, self._length(), self._join(0), True, self._done
+            return self._generation, self._length(), self._join(offset), False, self._done
+
+
+def format_cursor(generation, offset):
+    """Format the position of a reader in a stream as the cursor handed to clients.
+
+    Args:
+        generation (int): The generation of the stream
+        offset (int): The number of characters of that generation the reader has
+
+    Returns:
+        str: The cursor, "<generation>:<offset>"
+    """
+    return f"{generation}:{offset}"
+
+
+def parse_cursor(cursor):
+    """Parse a cursor from format_cursor, or a bare character offset.
+
+    Args:
+        cursor (str): The cursor sent by a client, or None
+
+    Returns:
+        tuple: (generation, offset), where generation is None if the cursor is
+        missing or invalid, so the reader starts over with the whole text
+    """
+    if not cursor:
+        return None, 0
+    generation, sep, offset = cursor.partition(":")
+    try:
+        if not sep:
+            # A bare offset belongs to the first generation
+            return 0, max(0, int(generation))
+        return int(generation), max(0, int(offset))
+    except ValueError:
+        return None, 0
+
+
+def sse_event(event, data, cursor=None):
+    """Format one Server-Sent Event.
+
+    Args:
+        event (str): The event name
+        data: A JSON serialisable payload
+        cursor (str): The position in the stream after this event, sent as its id, or None
+
+    Returns:
+        str: The event in text/event-stream format
+    """
+    if cursor is None:
+        return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+    return f"id: {cursor}\nevent: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def sse_events(stream, keepalive=15, cursor=None):
+    """Yield Server-Sent Events that follow an OutputStream until it finishes.
+
+    Emits "replace" with the full text when the stream is (re)started, "append"
+    with each new piece of text, and a final "done" event. Every event carries
+    the cursor after it as its id, so a browser that reconnects sends it back as
+    Last-Event-ID and the stream resumes from there. A comment line is sent
+    every keepalive seconds so proxies do not close an idle connection.
+
+    Args:
+        stream (OutputStream): The stream to follow
+        keepalive (float): Seconds between keep-alive comments
+        cursor (str): Where to resume, from the Last-Event-ID header, or None
+
+    Yields:
+        str: Formatted events
+    """
+    generation, offset = parse_cursor(cursor)
+    while True:
+        new_generation, new_offset, text, replaced, done = stream.wait(generation, offset, keepalive)
+        generation, offset = new_generation, new_offset
+        if replaced:
+            yield sse_event("replace", text, format_cursor(generation, offset))
+        elif text:
+            yield sse_event("append", text, format_cursor(generation, offset))
+        elif not done:
+            yield ": keepalive\n\n"
+        if done:
+            yield sse_event("done", {"status": "done"}, format_cursor(generation, offset))
+            return
@@ -0,0 +1,302 @@
+"""
+This module contains the RPCClient class, a thread-safe XML-RPC client for the virtual
+machine. xmlrpc.client.ServerProxy is not safe to share between threads, so the client
+keeps a pool of proxies, each holding one persistent keep-alive HTTP connection, and
+hands a proxy to one thread at a time.
+
+It also contains the BackendPool class, which spreads jobs over several virtual machines,
+sending each job to the healthy one with the fewest jobs in flight.
+
+Dependencies:
+- contextlib: for the connection context manager
+- queue: for the pool of idle proxies
+- socket: for socket timeouts
+- threading: for bounding the number of concurrent calls and for health checks
+- time: for the health check interval
+- xmlrpc.client: for XML-RPC communication
+"""
+
+import contextlib
+import queue
+import socket
+import threading
+import time
+import xmlrpc.client
+
+
+# Largest number of calls in flight to one server at once
+POOL_SIZE = 8
+
+# Default timeout for a call in seconds
+CALL_TIMEOUT = 120
+
+# Seconds between health checks of the backends
+HEALTH_INTERVAL = 10
+
+# Timeout for a health check call in seconds
+HEALTH_TIMEOUT = 5
+
+# Number of failed calls in a row after which a backend is taken out of rotation
+MAX_FAILURES = 2
+
+
+class PoolTimeout(socket.timeout):
+    """Raised when no connection became free in time."""
+
+
+class NoBackendAvailable(ConnectionError):
+    """Raised when every backend is unhealthy."""
+
+
+class TimeoutTransport(xmlrpc.client.Transport):
+    """An XML-RPC transport that applies a socket timeout to its connection.
+
+    The stock transport already reuses its HTTP/1.1 connection between calls;
+    this one also sets the timeout on it before every request so each call can
+    have its own.
+    """
+
+    def __init__(self, timeout=CALL_TIMEOUT):
+        super().__init__()
+        self.timeout = timeout
+
+    def make_connection(self, host):
+        connection = super().make_connection(host)
+        connection.timeout = self.timeout
+        if connection.sock is not None:
+            connection.sock.settimeout(self.timeout)
+        return connection
+
+
+class RPCClient:
+    """A pool of XML-RPC proxies to one server that can be shared by any number of threads.
+
+    Methods of the server can be called as attributes, as with ServerProxy:
+
+        client = RPCClient('http://127.0.0.1:8000/')
+        client.prompt_ai(code, context)
+        client.wait_output(job_id, offset, 10, timeout=20)
+
+    Args:
+        url (str): The URL of the XML-RPC server
+        size (int): The largest number of calls in flight at once
+        timeout (float): The default timeout for a call in seconds
+    """
+
+    def __init__(self, url, size=POOL_SIZE, timeout=CALL_TIMEOUT):
+        self.url = url
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _new_proxy(self):
+        transport = TimeoutTransport(self.timeout)
+        return xmlrpc.client.ServerProxy(self.url, transport=transport, allow_none=True)
+
+    @contextlib.contextmanager
+    def connection(self, timeout=None):
+        """Borrow a proxy from the pool for the length of a with block.
+
+        A proxy is closed instead of going back to the pool if anything other than
+        a fault from the server interrupted its call, since its connection may be
+        left half way through a request.
+
+        Args:
+            timeout (float): The socket timeout for calls made with the proxy,
+                which is also how long to wait for a free proxy
+
+        Yields:
+            xmlrpc.client.ServerProxy: The proxy
+
+        Raises:
+            PoolTimeout: If every proxy stayed in use for longer than timeout
+        """
+        timeout = self.timeout if timeout is None else timeout
+        if not self._slots.acquire(timeout=timeout):
+            raise PoolTimeout(f"no free connection to {self.url}")
+        try:
+            try:
+                proxy = self._idle.get_nowait()
+            except queue.Empty:
+                proxy = self._new_proxy()
+            proxy("transport").timeout = timeout
+            try:
+                yield proxy
+            except xmlrpc.client.Fault:
+                # The server answered, so the connection is still good
+                self._idle.put(proxy)
+                raise
+            except BaseException:
+                proxy("close")()
+                raise
+            self._idle.put(proxy)
+        finally:
+            self._slots.release()
+
+    def call(self, method, *args, timeout=None):
+        """Call a method on the server.
+
+        Args:
+            method (str): The name of the method
+            *args: The arguments of the method
+            timeout (float): The socket timeout in seconds, defaults to the client's timeout
+
+        Returns:
+            The return value of the method
+        """
+        with self.connection(timeout) as proxy:
+            return getattr(proxy, method)(*args)
+
+    def close(self):
+        """Close every idle connection."""
+        while True:
+            try:
+                self._idle.get_nowait()("close")()
+            except queue.Empty:
+                return
+
+    def __getattr__(self, method):
+        if method.startswith('_'):
+            raise AttributeError(method)
+
+        def call(*args, timeout=None):
+            return self.call(method, *args, timeout=timeout)
+        return call
+
+
+class Backend:
+    """One XML-RPC server in a BackendPool.
+
+    Attributes:
+        url (str): The URL of the server
+        client (RPCClient): The connection pool to the server
+        outstanding (int): The number of jobs currently sent to the server
+        leases (int): The number of jobs ever sent to the server
+        healthy (bool): Whether the server is in rotation
+        failures (int): The number of failed calls in a row
+        error (str): The last connection error
+    """
+
+    def __init__(self, url, size=POOL_SIZE, timeout=CALL_TIMEOUT):
+        self.url = url
+        self.client = RPCClient(url, size, timeout)
+        self.outstanding = 0
+        self.leases = 0
+        self.healthy = True
+        self.failures = 0
+        self.error = ""
+
+
+class BackendPool:
+    """Several XML-RPC servers that jobs are spread across.
+
+    Each job leases one backend for its whole length, since the job only exists
+    on the server that started it. The lease goes to the healthy backend with
+    the fewest outstanding jobs, and ties go to the one that has had the fewest
+    jobs so an idle pool is used evenly. A backend is taken out of rotation after
+    max_failures connection errors in a row, and a background thread probes
+    every backend each check_interval seconds to take it out or bring it back.
+
+        pool = BackendPool(['http://127.0.0.1:8000/', 'http://127.0.0.1:8001/'])
+        with pool.lease() as proxy:
+            job_id = proxy.prompt_ai(code, context)
+
+    Args:
+        urls (list): The URLs of the servers
+        size (int): The largest number of calls in flight to each server
+        timeout (float): The default timeout for a call in seconds
+        check_interval (float): Seconds between health checks, or None for no checks
+        max_failures (int): Failed calls in a row before a backend is taken out
+    """
+
+    def __init__(self, urls, size=POOL_SIZE, timeout=CALL_TIMEOUT,
+                 check_interval=HEALTH_INTERVAL, max_failures=MAX_FAILURES):
+        self.backends = [Backend(url, size, timeout) for url in urls]
+        self.max_failures = max_failures
+        self._lock = threading.Lock()
+        if check_interval:
+            threading.Thread(target=self._check_forever, args=(check_interval,), daemon=True).start()
+
+    @contextlib.contextmanager
+    def lease(self):
+        """Pick a backend for the length of a with block.
+
+        Yields:
+            RPCClient: The client of the healthy backend with the fewest outstanding jobs
+
+        Raises:
+            NoBackendAvailable: If every backend is unhealthy
+        """
+        with self._lock:
+            healthy = [backend for backend in self.backends if backend.healthy]
+            if not healthy:
+                raise NoBackendAvailable("no healthy AI backend is available")
+            backend = min(healthy, key=lambda backend: (backend.outstanding, backend.leases))
+            backend.outstanding += 1
+            backend.leases += 1
+        try:
+            yield backend.client
+        except socket.timeout:
+            # A slow job says nothing about whether the server is up
+            raise
+        except (OSError, xmlrpc.client.ProtocolError) as e:
+            self._record(backend, e)
+            raise
+        else:
+            self._record(backend, None)
+        finally:
+            with self._lock:
+                backend.outstanding -= 1
+
+    def _record(self, backend, error):
+        # Count failures in a row and take the backend out once there are too many
+        with self._lock:
+            if error is None:
+                backend.failures = 0
+                return
+            backend.failures += 1
+            backend.error = str(error)
+            if backend.failures >= self.max_failures:
+                backend.healthy = False
+
+    def check(self):
+        """Probe every backend once, taking out the ones that do not answer and
+        bringing back the ones that do.
+
+        Any answer, including a fault for an unknown method, counts as healthy. A
+        backend whose connections are all in use is busy rather than down, so it is
+        left as it is.
+        """
+        for backend in self.backends:
+            try:
+                backend.client.call('system.listMethods', timeout=HEALTH_TIMEOUT)
+            except xmlrpc.client.Fault:
+                pass
+            except PoolTimeout:
+                # Every connection is leased to a running job, so there is no way to probe it
+                continue
+            except (OSError, xmlrpc.client.ProtocolError) as e:
+                with self._lock:
+                    backend.healthy = False
+                    backend.error = str(e)
+                continue
+            with self._lock:
+                backend.healthy = True
+                backend.failures = 0
+
+    def _check_forever(self, interval):
+        while True:
+            time.sleep(interval)
+            self.check()
+
+    def stats(self):
+        """Return the URL, health and outstanding jobs of every backend.
+
+        Returns:
+            list: One dict per backend
+        """
+        with self._lock:
+            return [{'url': backend.url, 'healthy': backend.healthy, 'outstanding': backend.outstanding,
+                     'leases': backend.leases, 'failures': backend.failures, 'error': backend.error}
+                    for backend in self.backends]
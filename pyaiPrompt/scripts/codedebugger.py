@@ -7,27 +7,42 @@ generated values and updating file paths to work within a virtual machine withou
 It takes in a file path as a command line argument and modifies the code within a new file. The
 program then runs the modified script with debugging tools and checks if it ran successfully. The
 result of running the script is written to a file, which can be an error message or the string "PASS".
-The program also includes functions to monitor memory usage, restore the original version of the script,
+The program also includes functions to limit resource usage, restore the original version of the script,
 and check for imports. Data collected from running the script as a subprocess is formatted and sent to
 an AI, which creates a new version of the code using error logs and other data. This process is repeated
 until the script passes or a maximum number of debug iterations have passed. The user is then notified
 of the new code.
 """
 
-import re
-import random
-import subprocess
 import argparse
+import collections
+import hashlib
 import os
-import threading
-import psutil
-import shutil
-import time
-import pkgutil
+import re
 import sys
-import tracemalloc
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from radon.complexity import cc_visit
 
+import precheck
+import sandbox
+from debugloop import CACHE_DIRNAME, DebugLoop
+from forkserver import ForkServer, preloadable
+from rewrite import STRATEGIES, find_imports, make_sandbox_dir, prepare_files, remove_sandbox_dir, rewrite, value_generator
+
+# Largest number of trials run at the same time
+MAX_PARALLEL_TRIALS = os.cpu_count() or 1
+
+# Largest number of memory limits remembered by the hash of their script
+MAX_MEMORY_THRESHOLDS = 256
+
+# The memory limits of scripts by the hash of their code, oldest first
+memory_thresholds = collections.OrderedDict()
+memory_thresholds_lock = threading.Lock()
+
+# The fork server that runs scripts with their modules preloaded, or None to start a new interpreter for every run
+fork_server = None
+
 
 def codePassed(file_path):
     """
@@ -53,332 +68,207 @@ def codePassed(file_path):
             f.write(line)
 
 
-def monitor_memory(process: subprocess.Popen, memory_threshold: float):
+def memory_threshold(script_contents: str, script_size: int) -> float:
     """
-    This function monitors the memory usage of a subprocess and terminates it if it exceeds a
-    specified memory threshold. The function takes in a subprocess.Popen object and a memory
-    threshold as arguments. It uses psutil to monitor the memory usage of the subprocess and
-    terminates it if the memory usage exceeds the threshold.
-
-    :param process: The subprocess to be monitored.
-    :type process: subprocess.Popen
-    :param memory_threshold: The memory threshold in MB.
-    :type memory_threshold: float
+    This function works out the memory limit of a script from its size and average cyclomatic
+    complexity, with a floor of 1 GB. Computing the complexity means parsing the script, and the
+    debug loop runs the same script again and again, so the limit is remembered by the hash of
+    the script.
+
+    :param script_contents: The code of the script.
+    :type script_contents: str
+    :param script_size: The size of the script in bytes.
+    :type script_size: int
+    :return: The memory limit in MB.
+    :rtype: float
     """
-    # Get the process ID of the subprocess
-    try:
-        pid = process.pid
-	    
-        # Check if the process ID exists
-        if psutil.pid_exists(pid):
-            # Create a psutil process object for the subprocess
-            p = psutil.Process(pid)
-		
-            # Continuously monitor the memory usage of the subprocess
-            while True:
-                # Check if the subprocess is still running
-                if not process.poll():
-                    # Get the current memory usage of the subprocess
-                    memory_info = p.memory_info()
-                    memory_usage = memory_info.rss / 1024 / 1024
-		        
-                    # Check if the memory usage exceeds the threshold
-                    if memory_usage > memory_threshold:
-                        # Terminate the subprocess
-                        process.terminate()
-                        break
-		    
-                # Sleep for a short time before checking again
-                time.sleep(0.1)
-    except:
+    digest = hashlib.sha256(script_contents.encode()).hexdigest()
+    with memory_thresholds_lock:
+        if digest in memory_thresholds:
+            memory_thresholds.move_to_end(digest)
+            return memory_thresholds[digest]
     
-        print("no process ID found")
+    # Calculate average cyclomatic complexity if possible
+    cc = cc_visit(script_contents)
+    if cc:
+        avg_cc = sum(x.complexity for x in cc) / len(cc)
+        threshold = max(script_size / 1024 / 1024 * 10.0, avg_cc * 10.0)
+    else:
+        threshold = script_size / 1024 / 1024 * 100
+    
+    # Set new memory threshold to the maximum of the calculated threshold and 1.0 GB
+    threshold = max(threshold, 1024.0)
+    with memory_thresholds_lock:
+        memory_thresholds[digest] = threshold
+        if len(memory_thresholds) > MAX_MEMORY_THRESHOLDS:
+            memory_thresholds.popitem(last=False)
+    return threshold
+
 
-     
-def pydebug(script_name: str) -> str:
+def pydebug(script_name: str, progress=None) -> str:
     """
     This function takes in a script name as an argument and runs it with debugging tools. It handles
     issues such as syntax errors, infinite loops, memory leaks, and output messages. The function
-    returns the result of running the script as a string. It uses tracemalloc to monitor memory usage
-    and subprocess to run the script. If any issues are encountered, they are added to the result.
+    returns the result of running the script as a string. It runs the script in a sandbox that lets
+    the kernel enforce limits on its memory, CPU time, file sizes and processes, and that reports the
+    script's real peak memory use and CPU time. Errors that show without running the script, such as
+    syntax errors, are returned without starting a process. If any issues are encountered, they are
+    added to the result.
 
     :param script_name: The name of the script to be debugged.
     :type script_name: str
+    :param progress: Called with "stdout" or "stderr" and each piece of output while the script runs, or None.
+    :type progress: callable
     :return: The result of running the script with debugging tools.
     :rtype: str
     """
     
     result = ""
     try:
-        # Start tracing memory allocations
-        tracemalloc.start()
-        
-        # Get script size in bytes
-        script_size = os.path.getsize(script_name)
-        
         # Read script contents
         with open(script_name, 'r') as f:
             script_contents = f.read()
         
-        # Calculate average cyclomatic complexity if possible
-        cc = cc_visit(script_contents)
-        if cc:
-            avg_cc = sum(x.complexity for x in cc) / len(cc)
-            memory_threshold = max(script_size / 1024 / 1024 * 10.0, avg_cc * 10.0)
-        else:
-            memory_threshold = script_size / 1024 / 1024 * 100
+        # Report errors that show without running the script, such as syntax errors, without starting a process
+        error = precheck.check(script_contents, script_name)
+        if error:
+            return error
         
-        # Set new memory threshold to the maximum of the calculated threshold and 1.0 GB
-        new_memory_threshold = max(memory_threshold, 1024.0)
+        new_memory_threshold = memory_threshold(script_contents, os.path.getsize(script_name))
         
-        # Run the script with tracemalloc enabled
-        process = subprocess.Popen(["python", "-X", "tracemalloc", script_name], 
-            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-
-        # Set memory threshold if process still exists
-        if process.poll():
-            monitor_thread = threading.Thread(target=monitor_memory, args=(process, memory_threshold))
-            monitor_thread.daemon = True
-            monitor_thread.start()
+        # Run the script with its memory limited to the threshold
+        runner = fork_server.run if fork_server is not None else sandbox.run
+        run = runner([sys.executable, script_name], timeout=10, memory_mb=new_memory_threshold, on_output=progress)
         
-        try:
-            # Wait for the script to finish executing
-            stdout, stderr = process.communicate(timeout=10)
-            
-            # Check if the script executed successfully
-            if process.returncode == 0:
-                result = "PASS"
-            else:
-                result += f"{stderr}"
-            
-            # Check memory usage
-            current, peak = tracemalloc.get_traced_memory()
-            if peak / 1024 / 1024 > memory_threshold * 0.9:
-                result += f"\n\nCurrent memory usage: {current / 1024 / 1024}MB; Peak: {peak / 1024 / 1024}MB"
-                snapshot = tracemalloc.take_snapshot()
-                top_stats = snapshot.statistics('lineno')
-                result += "\n\nTop 10 memory usage:"
-                for stat in top_stats[:10]:
-                    result += f"\n{stat}"
+        # Handle script timeout
+        if run.timed_out:
+            return "TIMEOUT"
         
-        except subprocess.TimeoutExpired:
-            # Handle script timeout
-            result = "TIMEOUT"
-            process.terminate()
+        # Check if the script executed successfully
+        if run.returncode == 0:
+            result = "PASS"
+        else:
+            result += f"{run.stderr}"
+            if run.limit:
+                result += f"\n\nThe script was stopped for exceeding its {run.limit} limit."
+        
+        # Check memory usage
+        if run.peak_rss_mb > new_memory_threshold * 0.9 or run.limit:
+            result += (f"\n\nPeak memory usage: {run.peak_rss_mb:.1f}MB of {new_memory_threshold:.0f}MB;"
+                       f" CPU time: {run.cpu_time:.2f}s")
     
     except Exception as e:
         # Handle debugging errors
         result += f"DEBUGGING ERROR:\n{e}"
     
-    finally:
-        # Stop tracing memory allocations
-        tracemalloc.stop()
-    
     return result
 
 
-def generate_random_value(var_type):
-    """Generate a random value based on the variable type."""
-    if var_type == 'int':
-        return random.randint(0, 100)
-    elif var_type == 'float':
-        return round(random.uniform(0, 100), 2)
-    elif var_type == 'str':
-        return f'"{"".join(random.choices("abcdefghijklmnopqrstuvwxyz1234567890", k=5))}"'
-    elif var_type == 'bool':
-        return str(random.choice([True, False]))
-
-
-def replace_input(file_path):
+def fuzz(code: str, script_path: str, trials: int, workers: int = MAX_PARALLEL_TRIALS) -> str:
     """
-    This function takes in a file path and modifies the code within the file by
-    replacing user input calls with randomly generated values. The function reads
-    the code from the file and uses regular expressions to find lines containing
-    user input calls. These lines are then replaced with new lines that assign a
-    randomly generated value to the variable that was previously assigned the user
-    input value. The function also modifies lines containing required arguments in
-    an ArgumentParser object by setting the 'required' parameter to False and adding
-    a default value if one is not already present. The modified code is then returned.
-    
-    :param file_path: The path to the file containing the code to be modified.
-    :type file_path: str
-    :return: The modified code with user input calls replaced with randomly generated values.
+    This function runs several variations of a script at the same time, each with its user input
+    calls replaced by a different kind of value: random values, values at the edges of their type
+    and empty input, in turn. Each trial is its own sandboxed process with its own sandbox directory,
+    so the trials use all the cores, take about as long as a single run and cannot change each other's
+    files. The results are summarised by summarize_trials.
+
+    :param code: The code of the script to be debugged.
+    :type code: str
+    :param script_path: The path the rewritten script is written to, which the trials are written next to.
+    :type script_path: str
+    :param trials: The number of trials.
+    :type trials: int
+    :param workers: The largest number of trials run at the same time.
+    :type workers: int
+    :return: "PASS" if every trial passed, otherwise the summary of the failures.
     :rtype: str
     """
-    
-    modified = False
-    # Read the code from the file
-    with open(file_path, 'r') as f:
-        code = f.read()
-    # Find all lines containing input() calls
-    input_lines = re.findall(r'^(.*input\(.+\).*)$', code, flags=re.MULTILINE)
-    for line in input_lines:
-        # Skip the function definition line
-        if "def replace_input" in line:
-            continue
-        modified = True    	
-        # Comment out the original line
-        code = code.replace(line, f'#%@ {line}')
-        # Extract the variable name and type
-        var_name = line.split('=')[0].strip()
-        var_type_match = re.match(r'.*?(\w+)\s*\(\s*input', line)
-        if var_type_match:
-            var_type = var_type_match.group(1)
-        else:
-            continue
-            #var_type = 'null'
-        # Generate a random value for this variable based on its type
-        value = f'{generate_random_value(var_type)} #[SENSIBLE VALUE]'
-        # Add a new line assigning the value to the variable
-        new_line = f'{var_name} = {value}'
-        code = code.replace(f'#%@ {line}', f'#%@ {line}\n{new_line}')
-    
-    # Find all lines containing parser.add_argument() calls with required=True
-    parser_lines = re.findall(r'^(.*parser\.add_argument\(.+required\s*=\s*True.+\).*)$', code, flags=re.MULTILINE)
-    for line in parser_lines:
-        modified = True    	
-        # Comment out the original line
-        code = code.replace(line, f'#%@ {line}')
-        # Replace required=True with required=False
-        new_line = line.replace('required=True', 'required=False')
-        # Check if the argument has a default value
-        if 'default=' not in line:
-            # Add the default value to the argument
-            new_line = new_line.replace(')', ', default="[SENSIBLE VALUE]")')
-        # Add the new line to the code
-        code = code.replace(f'#%@ {line}', f'#%@ {line}\n{new_line}')
-    
-    return code
+    base, ext = os.path.splitext(script_path)
+    paths = []
+    sandbox_dirs = []
+    mocked = []
+    try:
+        for trial in range(trials):
+            # Seed each trial with its number so that a failure can be repeated
+            strategy = STRATEGIES[trial % len(STRATEGIES)]
+            sandbox_dirs.append(make_sandbox_dir())
+            rewriter = rewrite(code, sandbox_dirs[-1], values=value_generator(strategy, seed=trial))
+            prepare_files(rewriter)
+            path = f"{base}_trial{trial}{ext}"
+            with open(path, 'w') as f:
+                f.write(rewriter.render())
+            paths.append(path)
+            mocked.append((strategy, sorted(rewriter.mocked)))
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            results = list(pool.map(pydebug, paths))
+    finally:
+        for path in paths:
+            os.remove(path)
+        for sandbox_dir in sandbox_dirs:
+            remove_sandbox_dir(sandbox_dir)
+    # Refer to every trial by the same script name and sandbox directory so their tracebacks can be compared
+    results = [result.replace(path, script_path).replace(sandbox_dir, sandbox_dirs[0])
+               for result, path, sandbox_dir in zip(results, paths, sandbox_dirs)]
+    return summarize_trials(results, mocked)
 
 
-def update_more_files(filepath):
+def summarize_trials(results: list, mocked: list) -> str:
     """
-    This function takes in a file path and modifies the code within the file by
-    updating file paths. The function reads the code from the file line by line
-    and checks for lines containing file paths. These lines are then commented out
-    and new lines are added that contain the updated file paths. If a file does not
-    exist, it is created with a placeholder value. The modified code is then saved
-    to the original file.
-
-    :param filepath: The path to the file containing the code to be modified.
-    :type filepath: str
+    This function folds the results of several trials into one compact report for the AI. Trials
+    that failed in the same way are reported once, together with the inputs of the first of them.
+
+    :param results: The result of pydebug for each trial.
+    :type results: list
+    :param mocked: The strategy and the mocked input values of each trial.
+    :type mocked: list
+    :return: "PASS" if every trial passed, otherwise the summary of the failures.
+    :rtype: str
     """
-    
-    # Open the file in read mode
-    with open(filepath, 'r') as f:
-        lines = f.readlines()
-    
-    # Open the file in write mode
-    with open(filepath, 'w') as f:
-        # Iterate over each line in the file
-        for line in lines:
-            # Check if line is a comment or contains specific strings
-            if line.strip().startswith('#') or '/home/user/sig/' in line or '[SENSIBLE VALUE]' in line:
-                f.write(line)
-            # Check if line contains an open function with a comma
-            elif 'open(' in line and ',' in line:
-                # Comment out the original line
-                f.write(f'#%@ {line}')
-                start = line.find('open(') + 5
-                end = line.find(',', start)
-                filename = line[start:end].strip("'\"")
-                # Check if filename starts with a forward slash
-                if filename.startswith('/'):
-                    filename = os.path.basename(filename)
-                new_line = line[:start] + f"'/home/user/sig/{filename}'" + line[end:]
-                f.write(new_line)
-                mock_file_path = os.path.join('/home/user/sig/', filename)
-                # Create a mock file with a placeholder value
-                with open(mock_file_path, 'w') as mock_file:
-                    mock_file.write('[SENSIBLE VALUE]')
-            else:
-                f.write(line)
-
-
-def replace_file_paths(file_path):
+    failures = collections.OrderedDict()
+    for trial, result in enumerate(results):
+        if result != "PASS":
+            # Addresses and the amount of output left out differ between otherwise equal failures
+            key = re.sub(r" at 0x[0-9a-fA-F]+", "", result)
+            key = re.sub(r"\[\.\.\. \d+ bytes of output left out \.\.\.\]", "[... output left out ...]", key)
+            failures.setdefault(key, []).append(trial)
+    if not failures:
+        return "PASS"
+    summary = [f"{sum(len(trials) for trials in failures.values())} of {len(results)} trials failed."]
+    for result, trials in failures.items():
+        strategies = sorted({mocked[trial][0] for trial in trials})
+        summary.append(f"\n{len(trials)} trial(s) with {', '.join(strategies)} inputs failed with:")
+        inputs = mocked[trials[0]][1]
+        if inputs:
+            summary.append("Inputs: " + ", ".join(f"line {lineno} = {value}" for lineno, value in inputs))
+        summary.append(result.strip())
+    return "\n".join(summary)
+
+
+def write_imports(imports, directory=""):
     """
-    This function modifies the code in a given file by replacing the file paths with updated ones.
-    It reads the code from the file and uses regular expressions to identify lines that contain file paths.
-    It comments out those lines and adds new lines with updated mock file paths.
-    It creates the mock files in the new mock paths
-    It returns the modified code as a string.
+    Writes a list of import statements to a file called 'imports.txt'.
 
-    :param file_path: The path to the file containing the code to be modified.
-    :type file_path: str
-    :return: The modified code with updated file paths.
-    :rtype: str
+    :param imports: The import statements.
+    :type imports: list
+    :param directory: The directory to write the file to.
+    :type directory: str
     """
-    
-    # Open the file in read mode
-    with open(file_path, 'r') as f: # tester
-        code = f.read()
-    
-    # Use regular expressions to find lines containing file paths
-    file_lines = re.findall(r'^(.*?(?:\w+\s+)?open\(["\'])(/[\w./-]+)(["\'].*\))$', code, flags=re.MULTILINE)
-    file_lines += re.findall(r'^(.*?=\s*["\'])(/[\w./-]+)(["\'].*)$', code, flags=re.MULTILINE)
-    
-    # Iterate over each line containing a file path
-    for line in file_lines:
-        old_line = "".join(line)
-        # Check if line is a comment or contains specific strings
-        if old_line.startswith('#') or '/home/user/sig/' in old_line or '[SENSIBLE VALUE]' in old_line:
-            continue
-        # Comment out the original line
-        commented_line = f'#%@ {old_line}'
-        code = code.replace(old_line, commented_line)
-        file_path = line[1]
-        new_file_path = "/home/user/sig/" + os.path.basename(file_path)
-        # Check if original file exists
-        if os.path.exists(file_path):
-            shutil.move(file_path, new_file_path)
-        else:
-            # Check if new path is a file or directory
-            if "." in new_file_path:
-                # Create a mock file with a placeholder value
-                with open(new_file_path, 'w') as f:
-                    f.write("[SENSIBLE VALUE]")
-            else:
-                os.mkdir(new_file_path)
-        # Add a new line with updated mock file path
-        new_line = f'\n{line[0]+new_file_path+line[2]}'
-        index = code.index(commented_line) + len(commented_line)
-        code = code[:index] + new_line + code[index:]
-    
-    return code
+    with open(os.path.join(directory, 'imports.txt'), 'w') as file:
+        file.write(', '.join(imports))
 
 
-def check_imports(file_path: str) -> None:
+def stream_output(name: str, data: bytes) -> None:
     """
-    This function reads a Python file and extracts the import statements. It checks if the imported
-    packages are already installed or if they are built-in libraries. If either of these conditions
-    is true, the import statement is not included in the list. The resulting list of imports is then
-    written to a file called 'imports.txt'. The function takes in a file path as an argument and
-    returns None.
+    Passes a piece of a script's output on to the same stream of this process as it arrives.
 
-    :param file_path: The path to the Python file to check.
-    :type file_path: str
-    :return: None
+    :param name: "stdout" or "stderr".
+    :type name: str
+    :param data: The output.
+    :type data: bytes
     """
-    
-    # Open the file in read mode
-    with open(file_path, 'r') as file:
-        lines = file.readlines()
-        imports = []
-        # Iterate over each line in the file
-        for line in lines:
-            # Check if line is an import statement
-            if line.startswith('import') or line.startswith('from'):
-                package = line.split()[1]
-                # Check if package name contains a dot
-                if '.' in package:
-                    package = package.split('.')[0]
-                # Check if package is already installed or is a built-in library
-                if not pkgutil.find_loader(package) and package not in sys.builtin_module_names:
-                    imports.append(line.strip())
-    
-    # Write the list of imports to a file
-    with open('imports.txt', 'w') as file:
-        file.write(', '.join(imports))
+    stream = sys.stdout if name == "stdout" else sys.stderr
+    stream.buffer.write(data)
+    stream.flush()
 
 
 def main():
@@ -397,36 +287,45 @@ def main():
         description="Debug a python script by replacing user input calls with randomly generated values."
     )
     parser.add_argument("--input", type=str, required=True, help="Path to the python script to debug")
-    args = parser.parse_args()
-    
     parser.add_argument("--context", type=str, required=False, default=False, help="Path to the context to help AI debug")
-    args = parser.parse_args()
-    
     parser.add_argument("--AIONLY", type=bool, required=False, default=False,  help="Set to True to skip internal debugging")
+    parser.add_argument("--trials", type=int, required=False, default=1, help="Number of input variations to run at the same time")
+    parser.add_argument("--forkserver", action="store_true", help="Fork the trials from a process with the script's modules already imported, when --trials is above 1")
+    parser.add_argument("--stream", action="store_true", help="Print the script's output while it runs")
+    parser.add_argument("--no-cache", action="store_true", help="Run the script even if the same code has been run before")
+    # Parse once all the arguments are known, or the later ones are rejected
     args = parser.parse_args()
     
-    # Get the list of inports from the input file and create a list
-    check_imports(args.input)
-    thecode = replace_file_paths(args.input)
+    with open(args.input, 'r') as f:
+        code = f.read()
     # Get the directory of the input file    
     input_dir = os.path.dirname(args.input)
 
-    new_script_path = os.path.join(input_dir, 'new_script.py')
-    with open(new_script_path, 'w') as f:
-        f.write(thecode)	
-
-    # Replace user input calls in the code with randomly generated values
-    new_code = replace_input(new_script_path)
-
-    # Write the modified code to a new file
-    new_script_path = os.path.join(input_dir, 'new_script.py')
-    with open(new_script_path, 'w') as f:
-        f.write(new_code)
-    
-    update_more_files(new_script_path)
-    
-    # Run the modified script and store its result
-    result = pydebug(new_script_path)
+    def run_script(script_path, code):
+        # Start the fork server on the first run that is not answered from the cache. It lives
+        # as long as this process, so it only pays for its start and preload over several trials
+        global fork_server
+        if args.forkserver and args.trials > 1 and fork_server is None:
+            modules = rewrite(code, passes=(find_imports,), script_dir=input_dir or ".").modules
+            fork_server = ForkServer(preloadable(modules, input_dir or "."))
+            fork_server.start()
+        if args.trials > 1:
+            return fuzz(code, script_path, args.trials)
+        return pydebug(script_path, stream_output if args.stream else None)
+
+    # Parse the script once to list the missing imports, replace user input calls with generated
+    # values, make required arguments optional and redirect file paths. The rewrite of unchanged
+    # functions and the result of code that was run before are taken from the cache
+    cache_dir = None if args.no_cache else os.path.join(input_dir, CACHE_DIRNAME)
+    # The trials of fuzz each get a sandbox of their own
+    loop = DebugLoop(input_dir, run_script, settings=f"trials={args.trials}", cache_dir=cache_dir,
+                     prepare=args.trials == 1)
+    try:
+        result, rewriter = loop.check(code)
+    finally:
+        if fork_server is not None:
+            fork_server.stop()
+    write_imports(rewriter.imports, input_dir)
 
     # Write the script output or error message to a file
     output_path = os.path.join(input_dir, "codetest.txt")
@@ -0,0 +1,171 @@
+"""
+This module runs one iteration of the debug loop: rewrite the script and run it. The AI fixes
+the script between iterations and codedebugger is started again for each one. The AI often hands
+back code it has already tried, and usually changes only a few functions between iterations, so
+each iteration avoids repeating work an earlier one has done:
+
+- The results of the rewrite passes are cached per top-level function and class by the hash
+  of their source, so only the ones that changed are rewritten.
+- Mocked inputs are seeded by their call site, so the same code is always rewritten to the same
+  script, and the result of running a script is cached by the hash of the rewritten script,
+  the run settings and the environment. Each run has its own sandbox directory, which the key
+  leaves out. Timeouts and failures of the debugger itself are not cached, since running the
+  same script again may give another result.
+
+Both caches are kept in a directory next to the script, so they also work across runs of
+codedebugger. Each iteration's timings are kept in DebugLoop.iterations and appended as a JSON
+line to timings.jsonl in the cache directory.
+"""
+
+import hashlib
+import json
+import os
+import sys
+import time
+
+from rewrite import SANDBOX_TOKEN, make_sandbox_dir, prepare_files, remove_sandbox_dir, rewrite, value_generator
+
+# The name of the cache directory, created next to the script
+CACHE_DIRNAME = ".pyai-cache"
+
+# The seed of the mocked input values
+SEED = 0
+
+# Largest number of cached run results
+MAX_CACHED_RESULTS = 256
+
+# Largest number of cached function rewrites
+MAX_CACHED_FUNCTIONS = 2048
+
+
+class DebugLoop:
+    """
+    Rewrites and runs a script for each iteration of the debug loop, reusing earlier work where
+    the code has not changed.
+
+    :param workdir: The directory the rewritten script is written to.
+    :type workdir: str
+    :param run: Called with the path of the rewritten script and the original code, returns the
+        result, "PASS" if the script passed.
+    :type run: callable
+    :param settings: The run settings that change the result, such as the number of trials.
+    :type settings: str
+    :param cache_dir: The cache directory, or None to keep the caches in memory only.
+    :type cache_dir: str
+    :param prepare: Whether to create the files the script expects in the sandbox directory
+        before running it, False when run makes sandboxes of its own, as fuzz does.
+    :type prepare: bool
+    """
+
+    def __init__(self, workdir, run, settings="", cache_dir=None, prepare=True):
+        self.workdir = workdir
+        self.prepare = prepare
+        self.run = run
+        self.settings = settings
+        self.cache_dir = cache_dir
+        self.script_path = os.path.join(workdir, "new_script.py")
+        self.iterations = []
+        self.functions = {}
+        self.results = {}
+        if cache_dir:
+            os.makedirs(os.path.join(cache_dir, "results"), exist_ok=True)
+            try:
+                with open(os.path.join(cache_dir, "functions.json")) as f:
+                    self.functions = json.load(f)
+            except (OSError, ValueError):
+                pass
+
+    def _key(self, script, rewriter):
+        # The run result depends on the script, the interpreter, the run settings and the files it reads
+        files = []
+        for original in sorted(rewriter.files):
+            try:
+                stat = os.stat(original)
+                files.append([original, stat.st_size, stat.st_mtime_ns])
+            except OSError:
+                files.append([original, None, None])
+        script = script.replace(rewriter.sandbox_dir, SANDBOX_TOKEN)
+        payload = json.dumps([script, sys.executable, sys.version, self.settings, files])
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _cached_result(self, key):
+        if key in self.results:
+            return self.results[key]
+        if not self.cache_dir:
+            return None
+        try:
+            with open(os.path.join(self.cache_dir, "results", key + ".json")) as f:
+                return json.load(f)["result"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _store_result(self, key, result):
+        # A failure of the debugger itself says nothing about the script, and whether a run times
+        # out depends on how busy the machine is; either can also be one trial of several
+        if any(line == "TIMEOUT" or line.startswith("DEBUGGING ERROR") for line in result.splitlines()):
+            return
+        self.results[key] = result
+        if not self.cache_dir:
+            return
+        results_dir = os.path.join(self.cache_dir, "results")
+        with open(os.path.join(results_dir, key + ".json"), "w") as f:
+            json.dump({"result": result}, f)
+        # Forget the oldest results once there are too many
+        entries = sorted(os.scandir(results_dir), key=lambda entry: entry.stat().st_mtime)
+        for entry in entries[:max(0, len(entries) - MAX_CACHED_RESULTS)]:
+            os.remove(entry.path)
+
+    def _save(self, iteration):
+        if not self.cache_dir:
+            return
+        # Keep the most recently added function rewrites
+        for digest in list(self.functions)[:max(0, len(self.functions) - MAX_CACHED_FUNCTIONS)]:
+            del self.functions[digest]
+        with open(os.path.join(self.cache_dir, "functions.json"), "w") as f:
+            json.dump(self.functions, f)
+        with open(os.path.join(self.cache_dir, "timings.jsonl"), "a") as f:
+            f.write(json.dumps(iteration) + "\n")
+
+    def check(self, code):
+        """
+        Rewrites a version of the script and runs it, or takes the result of an identical
+        earlier run from the cache.
+
+        :param code: The code of the script.
+        :type code: str
+        :return: The result and the Rewriter of the script.
+        :rtype: tuple
+        """
+        start = time.perf_counter()
+        sandbox_dir = make_sandbox_dir()
+        try:
+            rewriter = rewrite(code, sandbox_dir, values=value_generator("random", SEED), cache=self.functions,
+                               script_dir=self.workdir or ".")
+            script = rewriter.render()
+            with open(self.script_path, "w") as f:
+                f.write(script)
+            key = self._key(script, rewriter)
+            rewritten = time.perf_counter()
+            result = self._cached_result(key)
+            cached = result is not None
+            if not cached:
+                if self.prepare:
+                    prepare_files(rewriter)
+                result = self.run(self.script_path, code)
+                self._store_result(key, result)
+        finally:
+            remove_sandbox_dir(sandbox_dir)
+        finished = time.perf_counter()
+        iteration = {
+            "iteration": len(self.iterations) + 1,
+            "key": key,
+            "cached": cached,
+            "functions_reused": rewriter.reused,
+            "functions_rewritten": len(rewriter.fresh),
+            "rewrite_time": rewritten - start,
+            "run_time": finished - rewritten,
+            "passed": result == "PASS",
+        }
+        self.iterations.append(iteration)
+        self._save(iteration)
+        return result, rewriter
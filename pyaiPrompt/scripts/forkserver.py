@@ -0,0 +1,307 @@
+"""
+This module runs Python scripts by forking them from a server process that has already imported
+the modules they use, instead of starting a new interpreter for every run. The debug loop runs
+the same script, with small changes, over and over, so most of the cost of a run is interpreter
+startup and imports of heavy packages, which the server pays once.
+
+The server is started with the names of the modules to preload. Only modules that resolve
+outside the script's own directory are preloaded, so a module the AI changes is always imported
+fresh. A client connects to the server's Unix socket for each run and sends the script, its
+arguments, working directory, environment and limits, along with its own stdin, stdout and
+stderr pipe ends. The server forks a child that moves to its own session, applies the same
+limits as sandbox.run, takes the pipes as its standard streams and runs the script as
+__main__. The server reaps the child when its pidfd becomes readable and sends back the
+exit status, peak memory and CPU time, so ForkServer.run returns the same SandboxResult as
+sandbox.run.
+
+The peak memory of a forked child includes the pages of the preloaded modules it shares with
+the server.
+
+A server lives as long as the process that starts it. Its start and preload cost more than a
+single Popen run, so codedebugger only starts one to fork the trials of a fuzz run.
+
+Usage as the server:
+    python forkserver.py --socket PATH [--preload MODULE ...]
+"""
+
+import argparse
+import atexit
+import importlib
+import importlib.util
+import json
+import os
+import runpy
+import selectors
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import traceback
+
+import sandbox
+
+# Largest request a client may send in bytes
+MAX_REQUEST = 1024 * 1024
+
+
+def preloadable(modules, script_dir):
+    """
+    Returns the modules that can be imported and do not live in the script's directory.
+
+    :param modules: The names of the modules the script imports.
+    :type modules: list
+    :param script_dir: The directory of the script.
+    :type script_dir: str
+    :rtype: list
+    """
+    script_dir = os.path.realpath(script_dir)
+    names = []
+    for name in modules:
+        try:
+            # Look up the top-level package only, since finding a submodule imports its parents
+            spec = importlib.util.find_spec(name.split('.')[0])
+        except (ImportError, ValueError):
+            continue
+        if spec is None:
+            continue
+        origin = spec.origin if spec.has_location else None
+        if origin and os.path.realpath(origin).startswith(script_dir + os.sep):
+            continue
+        names.append(name)
+    return names
+
+
+def _script_traceback(e, script):
+    # Print an exception like the interpreter would, without the frames of the fork server
+    tb = e.__traceback__
+    while tb is not None and tb.tb_frame.f_code.co_filename != script:
+        tb = tb.tb_next
+    traceback.print_exception(type(e), e, tb)
+
+
+def _run_child(request, fds):
+    # The body of a forked child: become a fresh process for the script, run it and exit
+    stdin, stdout, stderr = fds
+    code = 1
+    try:
+        os.dup2(stdin, 0)
+        os.dup2(stdout, 1)
+        os.dup2(stderr, 2)
+        os.closerange(3, os.sysconf("SC_OPEN_MAX"))
+        sandbox.limit_child(request["memory_mb"], request["cpu_seconds"], request["file_mb"],
+                            request["max_procs"], request["cgroup"])()
+        script = os.path.abspath(os.path.join(request["cwd"] or os.getcwd(), request["script"]))
+        if request["cwd"]:
+            os.chdir(request["cwd"])
+        if request["env"] is not None:
+            os.environ.clear()
+            os.environ.update(request["env"])
+        sys.argv = [script] + request["argv"]
+        sys.path[0] = os.path.dirname(script)
+        try:
+            runpy.run_path(script, run_name="__main__")
+            code = 0
+        except SystemExit as e:
+            if e.code is None:
+                code = 0
+            elif isinstance(e.code, int):
+                code = e.code
+            else:
+                print(e.code, file=sys.stderr)
+        except BaseException as e:
+            _script_traceback(e, script)
+        # Finish the way the interpreter would: wait for threads and run exit handlers
+        for thread in threading.enumerate():
+            if thread is not threading.main_thread() and not thread.daemon:
+                thread.join()
+        atexit._run_exitfuncs()
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(code)
+
+
+def serve(socket_path, preload):
+    """
+    Preloads modules and then forks a child for every run request on the socket until killed.
+
+    :param socket_path: The path of the Unix socket to listen on.
+    :type socket_path: str
+    :param preload: The modules to import before forking.
+    :type preload: list
+    """
+    for name in preload:
+        try:
+            importlib.import_module(name)
+        except Exception as e:
+            print(f"could not preload {name}: {e}", file=sys.stderr)
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(socket_path)
+    listener.listen()
+    selector = selectors.DefaultSelector()
+    selector.register(listener, selectors.EVENT_READ, "accept")
+    print("ready", flush=True)
+    while True:
+        for key, events in selector.select():
+            if key.data == "accept":
+                conn, address = listener.accept()
+                selector.register(conn, selectors.EVENT_READ, "request")
+            elif key.data == "request":
+                conn = key.fileobj
+                selector.unregister(conn)
+                message, fds, flags, address = socket.recv_fds(conn, MAX_REQUEST, 3)
+                if not message or len(fds) != 3:
+                    for fd in fds:
+                        os.close(fd)
+                    conn.close()
+                    continue
+                sys.stdout.flush()
+                sys.stderr.flush()
+                pid = os.fork()
+                if pid == 0:
+                    _run_child(json.loads(message), fds)
+                for fd in fds:
+                    os.close(fd)
+                conn.sendall(struct.pack("i", pid))
+                selector.register(os.pidfd_open(pid), selectors.EVENT_READ, (pid, conn))
+            else:
+                # A child has exited, so reap it and send its status to the client
+                pid, conn = key.data
+                selector.unregister(key.fd)
+                os.close(key.fd)
+                pid, status, usage = os.wait4(pid, 0)
+                reply = {
+                    "returncode": os.waitstatus_to_exitcode(status),
+                    "peak_rss_mb": usage.ru_maxrss / 1024,
+                    "cpu_time": usage.ru_utime + usage.ru_stime,
+                }
+                try:
+                    conn.sendall(json.dumps(reply).encode())
+                except OSError:
+                    pass
+                conn.close()
+
+
+class ForkServer:
+    """
+    The client side of a fork server. The server process is started by start() and runs
+    scripts for any number of threads at once.
+
+    :param preload: The modules to import in the server before forking.
+    :type preload: list
+    """
+
+    def __init__(self, preload=()):
+        self.preload = list(preload)
+        self._process = None
+        self._dir = None
+        self.socket_path = None
+
+    def start(self):
+        """Starts the server process and waits until it has preloaded its modules."""
+        self._dir = tempfile.mkdtemp(prefix="pyai-forkserver-")
+        self.socket_path = os.path.join(self._dir, "socket")
+        self._process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--socket", self.socket_path,
+             "--preload", *self.preload],
+            stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, text=True)
+        if self._process.stdout.readline().strip() != "ready":
+            self.stop()
+            raise RuntimeError("the fork server failed to start")
+
+    def stop(self):
+        """Stops the server process."""
+        if self._process is not None:
+            self._process.kill()
+            self._process.wait()
+            self._process.stdout.close()
+            self._process = None
+        if self._dir is not None:
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+            os.rmdir(self._dir)
+            self._dir = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def run(self, args, timeout, memory_mb=sandbox.MEMORY_LIMIT_MB, cpu_seconds=sandbox.CPU_LIMIT,
+            file_mb=sandbox.FILE_LIMIT_MB, max_procs=sandbox.PROCESS_LIMIT, cwd=None, env=None, on_output=None):
+        """
+        Runs a Python script in a child forked from the server. It takes the same arguments as
+        sandbox.run, where args is the interpreter followed by the script and its arguments,
+        and returns the same SandboxResult.
+
+        :param args: The interpreter, the script and its arguments.
+        :type args: list
+        :param timeout: The longest time the child may run in seconds.
+        :type timeout: float
+        :return: The outcome of the run.
+        :rtype: sandbox.SandboxResult
+        """
+        cgroup = sandbox.make_cgroup(memory_mb, max_procs)
+        request = {
+            "script": args[1],
+            "argv": list(args[2:]),
+            "cwd": os.path.abspath(cwd) if cwd else os.getcwd(),
+            "env": dict(os.environ) if env is None else dict(env),
+            "memory_mb": memory_mb,
+            "cpu_seconds": cpu_seconds,
+            "file_mb": file_mb,
+            "max_procs": max_procs,
+            "cgroup": cgroup,
+        }
+        start = time.monotonic()
+        stdout_r, stdout_w = os.pipe()
+        stderr_r, stderr_w = os.pipe()
+        stdin = os.open(os.devnull, os.O_RDONLY)
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            conn.connect(self.socket_path)
+            socket.send_fds(conn, [json.dumps(request).encode()], [stdin, stdout_w, stderr_w])
+            # Only the child may hold the write ends, so the pipes close when it exits
+            for fd in (stdin, stdout_w, stderr_w):
+                os.close(fd)
+            stdin = stdout_w = stderr_w = None
+            pid = struct.unpack("i", conn.recv(4, socket.MSG_WAITALL))[0]
+            # The server sends the exit status once the child has exited
+            stdout, stderr, timed_out = sandbox.collect_output(pid, stdout_r, stderr_r, conn.fileno(), timeout,
+                                                               on_output)
+            reply = b""
+            while True:
+                data = conn.recv(4096)
+                if not data:
+                    break
+                reply += data
+            reply = json.loads(reply)
+            return sandbox.make_result(reply["returncode"], stdout, stderr, timed_out, reply["peak_rss_mb"],
+                                       reply["cpu_time"], time.monotonic() - start, cpu_seconds, cgroup)
+        finally:
+            conn.close()
+            for fd in (stdin, stdout_w, stderr_w, stdout_r, stderr_r):
+                if fd is not None:
+                    os.close(fd)
+            if cgroup:
+                sandbox.remove_cgroup(cgroup)
+
+
+def main():
+    """Parses the command line arguments and serves run requests until killed."""
+    parser = argparse.ArgumentParser(description="Fork Python scripts from a process with preloaded modules.")
+    parser.add_argument("--socket", type=str, required=True, help="Path of the Unix socket to listen on")
+    parser.add_argument("--preload", nargs="*", default=[], help="Modules to import before forking")
+    args = parser.parse_args()
+    serve(args.socket, args.preload)
+
+
+if __name__ == "__main__":
+    main()
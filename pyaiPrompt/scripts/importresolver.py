@@ -0,0 +1,271 @@
+"""
+This module works out which of the modules a script imports are built in, installed, next to
+the script or missing, without asking the import system about each import on every run.
+
+A ModuleIndex lists the top-level modules in every directory of the search path once and keeps
+them in memory. Each directory is listed again only when its modification time changes, which
+happens when a package is installed into it or removed from it. The index is shared by every
+call in a process, so a process that classifies the imports of many scripts scans the search
+path once. Names that are not in the index are checked with importlib before they are reported
+missing, since modules can also come from import hooks, such as those of editable installs.
+
+The imports of a script are read from its AST by parse_imports, covering "import a, b",
+"from a.b import c" and imports inside functions or blocks, and classify tells each of them
+apart, checking every top-level module once. Relative imports always refer to the script's
+own package.
+"""
+
+import ast
+import collections
+import importlib.machinery
+import importlib.util
+import os
+import re
+import sys
+
+# What an import resolves to
+BUILTIN = "builtin"
+INSTALLED = "installed"
+LOCAL = "local"
+MISSING = "missing"
+
+# An import statement of a script that does not parse
+IMPORT_LINE = re.compile(r"^\s*(?:from\s+(\.*[\w.]*)\s+import\b|import\s+(.+))")
+
+# The suffixes of files that can be imported as modules
+MODULE_SUFFIXES = tuple(importlib.machinery.all_suffixes())
+
+Import = collections.namedtuple("Import", "lineno module statement status")
+Import.__doc__ = """
+One module imported by a script.
+
+:ivar lineno: The line of the import statement.
+:ivar module: The full name of the module, with a leading dot for each level of a relative import.
+:ivar statement: The source of the import statement.
+:ivar status: BUILTIN, INSTALLED, LOCAL or MISSING.
+"""
+
+
+def _list_modules(directory):
+    # The names of the top-level modules and packages in a directory
+    names = set()
+    try:
+        entries = os.scandir(directory)
+    except OSError:
+        return names
+    with entries:
+        for entry in entries:
+            name = entry.name
+            if entry.is_dir():
+                # Namespace packages have no __init__.py, so any directory with a valid name counts
+                if name.isidentifier():
+                    names.add(name)
+            elif name.endswith(MODULE_SUFFIXES):
+                name = name.split(".", 1)[0]
+                if name.isidentifier():
+                    names.add(name)
+    return names
+
+
+def _mtime(directory):
+    try:
+        return os.stat(directory).st_mtime_ns
+    except OSError:
+        return None
+
+
+class ModuleIndex:
+    """
+    The top-level modules that can be imported from each directory of a search path, kept up to
+    date by the modification times of the directories.
+
+    :param paths: The directories to search, or None for sys.path.
+    :type paths: list
+    """
+
+    def __init__(self, paths=None):
+        self._paths = paths
+        # The modification time and module names of each directory listed so far
+        self._listings = {}
+
+    @property
+    def paths(self):
+        """list: The directories that are searched, in order."""
+        return [os.path.abspath(path or os.curdir) for path in (sys.path if self._paths is None else self._paths)]
+
+    def refresh(self):
+        """
+        Lists the directories that are new or changed since they were last listed.
+
+        :return: The number of directories listed.
+        :rtype: int
+        """
+        listed = 0
+        for path in self.paths:
+            mtime = _mtime(path)
+            cached = self._listings.get(path)
+            if cached is None or cached[0] != mtime:
+                self._listings[path] = (mtime, _list_modules(path) if mtime is not None else set())
+                listed += 1
+        return listed
+
+    def listing(self, directory):
+        """
+        Returns the top-level modules in a directory that need not be on the search path,
+        listing it again only if it has changed.
+
+        :param directory: The directory.
+        :type directory: str
+        :rtype: set
+        """
+        directory = os.path.abspath(directory)
+        mtime = _mtime(directory)
+        cached = self._listings.get(directory)
+        if cached is None or cached[0] != mtime:
+            cached = self._listings[directory] = (mtime, _list_modules(directory) if mtime is not None else set())
+        return cached[1]
+
+    def locate(self, name):
+        """
+        Returns where a top-level module comes from. The index must be refreshed first.
+
+        :param name: The name of the top-level module.
+        :type name: str
+        :return: BUILTIN, the directory that holds the module, or None if it is not indexed.
+        :rtype: str
+        """
+        if name in sys.builtin_module_names:
+            return BUILTIN
+        for path in self.paths:
+            listing = self._listings.get(path)
+            if listing and name in listing[1]:
+                return path
+        return None
+
+
+# The index shared by every call that does not bring its own
+_index = ModuleIndex()
+
+
+def shared_index():
+    """
+    Returns the index shared by every call that does not bring its own, refreshed.
+
+    :rtype: ModuleIndex
+    """
+    _index.refresh()
+    return _index
+
+
+def status(name, index):
+    """
+    Returns whether a top-level module is built in, installed or missing.
+
+    :param name: The name of the top-level module.
+    :type name: str
+    :param index: A refreshed index.
+    :type index: ModuleIndex
+    :return: BUILTIN, INSTALLED or MISSING.
+    :rtype: str
+    """
+    where = index.locate(name)
+    if where == BUILTIN:
+        return BUILTIN
+    if where is not None:
+        return INSTALLED
+    # Import hooks can provide modules that are in no directory
+    try:
+        return INSTALLED if importlib.util.find_spec(name) else MISSING
+    except (ImportError, ValueError):
+        return MISSING
+
+
+def parse_imports(source):
+    """
+    Returns the modules a script imports, read from its AST. A script that does not parse is
+    read line by line instead.
+
+    :param source: The source of the script.
+    :type source: str
+    :return: A (line number, module, statement) tuple for each imported module, where the
+        module of a relative import starts with a dot for each level.
+    :rtype: list
+    """
+    imports = []
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError):
+        for lineno, line in enumerate(source.splitlines(), 1):
+            match = IMPORT_LINE.match(line)
+            if not match:
+                continue
+            if match.group(1) is not None:
+                modules = [match.group(1)]
+            else:
+                names = match.group(2).split("#")[0].strip("()\\ ")
+                modules = [name.split()[0] for name in names.split(",") if name.split()]
+            imports += [(lineno, module, line.strip()) for module in modules if module]
+        return imports
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            statement = ast.get_source_segment(source, node)
+            imports += [(node.lineno, module, statement) for module in imported_modules(node)]
+    return sorted(imports)
+
+
+def imported_modules(node):
+    """
+    Returns the modules an import statement imports.
+
+    :param node: The import statement.
+    :type node: ast.Import or ast.ImportFrom
+    :return: The full name of each module, with a leading dot for each level of a relative import.
+    :rtype: list
+    """
+    if isinstance(node, ast.Import):
+        return [alias.name for alias in node.names]
+    return ["." * node.level + (node.module or "")]
+
+
+def classify(imports, script_dir=None, index=None):
+    """
+    Resolves the imports of a script, as read by parse_imports or a pass of rewrite.
+
+    :param imports: A (line number, module, statement) tuple for each imported module, as
+        returned by parse_imports.
+    :type imports: list
+    :param script_dir: The directory of the script, whose modules are local, or None.
+    :type script_dir: str
+    :param index: The index to resolve with, or None for the shared one.
+    :type index: ModuleIndex
+    :return: An Import for each imported module, in the given order.
+    :rtype: list
+    """
+    if index is None:
+        index = shared_index()
+    else:
+        index.refresh()
+    local = index.listing(script_dir) if script_dir else set()
+    statuses = {}
+    results = []
+    for lineno, module, statement in imports:
+        top = module.split(".")[0]
+        if module.startswith(".") or top in local:
+            found = LOCAL
+        else:
+            if top not in statuses:
+                statuses[top] = status(top, index)
+            found = statuses[top]
+        results.append(Import(lineno, module, statement, found))
+    return results
+
+
+def missing_imports(imports):
+    """
+    Returns the statements that import a missing module, each once.
+
+    :param imports: The resolved imports of a script.
+    :type imports: list
+    :rtype: list
+    """
+    return list(dict.fromkeys(item.statement for item in imports if item.status == MISSING))
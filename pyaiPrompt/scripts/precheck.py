@@ -0,0 +1,141 @@
+"""
+This module finds errors in a script that show without running it, so that codedebugger can
+report them without starting a process. Most broken versions of a script the AI hands back do
+not even compile, and compiling in-process takes a fraction of the time a new interpreter needs
+to start.
+
+The script is compiled, which finds syntax, indentation and tab errors. A script that compiles
+is then checked for names that are used by a statement at the top level of the module and are
+bound nowhere: not in the module, by any function or class, by a builtin or by a star import.
+The check stays away from anything it cannot be sure of, such as code in functions, branches
+and try blocks, and scripts that use exec, eval, globals or other ways of binding names it
+cannot see. It stops after the first top-level statement that calls anything but a builtin,
+such as main(), since that call may end the script, raise or never return.
+
+Errors are reported the way the interpreter would print them, so the AI sees the same shape
+either way.
+"""
+
+import ast
+import builtins
+import traceback
+
+# Names every module has besides the builtins
+MODULE_NAMES = {"__name__", "__file__", "__doc__", "__spec__", "__loader__", "__package__",
+                "__builtins__", "__annotations__", "__cached__", "__path__"}
+
+# Calls that can bind names the check cannot see
+DYNAMIC_CALLS = {"exec", "eval", "globals", "locals", "vars", "__import__", "setattr"}
+
+# Definitions at the top level, whose bodies do not run when they are defined
+DEFINITIONS = (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)
+
+# Statements at the top level that may leave the module early, run their body only conditionally
+# or catch errors, after which the check cannot tell what runs
+GUARDED = (ast.If, ast.For, ast.AsyncFor, ast.While, ast.Try, ast.With, ast.AsyncWith, ast.Match,
+           ast.Raise) + ((ast.TryStar,) if hasattr(ast, "TryStar") else ())
+
+# Builtins that end the script or stop in a debugger, unlike the others
+EXITS = {"exit", "quit", "breakpoint"}
+
+
+def _bound_names(tree):
+    # Every name the script binds anywhere, or None if it can bind names the check cannot see
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name):
+            if isinstance(node.ctx, (ast.Store, ast.Del)):
+                names.add(node.id)
+            elif node.id in DYNAMIC_CALLS:
+                return None
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            names.add(node.name)
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            for alias in node.names:
+                if alias.name == "*":
+                    return None
+                names.add(alias.asname or alias.name.split(".")[0])
+        elif isinstance(node, ast.arg):
+            names.add(node.arg)
+        elif isinstance(node, (ast.Global, ast.Nonlocal)):
+            names.update(node.names)
+        elif isinstance(node, ast.ExceptHandler) and node.name:
+            names.add(node.name)
+        elif isinstance(node, (ast.MatchAs, ast.MatchStar)) and node.name:
+            names.add(node.name)
+        elif isinstance(node, ast.MatchMapping) and node.rest:
+            names.add(node.rest)
+    return names
+
+
+def _top_level_loads(statement):
+    # The names a top-level statement reads when it runs, leaving out the bodies of lambdas and
+    # annotations, which are not evaluated under "from __future__ import annotations"
+    nodes = [statement]
+    while nodes:
+        node = nodes.pop()
+        if isinstance(node, ast.Lambda):
+            continue
+        if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load):
+            yield node
+        children = [child for child in ast.iter_child_nodes(node)
+                    if not (isinstance(node, ast.AnnAssign) and child is node.annotation)]
+        nodes.extend(reversed(children))
+
+
+def _may_leave(statement, bound):
+    # Whether a top-level statement calls anything but a builtin that returns, such as main()
+    # or sys.exit(), after which the check cannot tell whether later statements run
+    for node in ast.walk(statement):
+        if isinstance(node, ast.Call):
+            func = node.func
+            if not (isinstance(func, ast.Name) and func.id not in bound and func.id not in EXITS
+                    and hasattr(builtins, func.id)):
+                return True
+    return False
+
+
+def _format(exc_type, message, filename, lineno, line):
+    # A traceback as the interpreter prints it for an error at the top level of a script
+    return (f'Traceback (most recent call last):\n  File "{filename}", line {lineno}, in <module>\n'
+            f"    {line.strip()}\n{exc_type}: {message}\n")
+
+
+def check(source, filename):
+    """
+    Compiles a script and checks it for names that are used but never bound.
+
+    :param source: The source of the script.
+    :type source: str
+    :param filename: The name of the script in the error.
+    :type filename: str
+    :return: The error as the interpreter would print it, or None if none was found.
+    :rtype: str
+    """
+    try:
+        tree = compile(source, filename, "exec", ast.PyCF_ONLY_AST)
+        compile(tree, filename, "exec")
+    except (SyntaxError, ValueError) as e:
+        # ValueError is raised for source with null bytes
+        return "".join(traceback.format_exception_only(type(e), e))
+    except RecursionError:
+        # Too deeply nested to compile here, which the run will report
+        return None
+    bound = _bound_names(tree)
+    if bound is None:
+        return None
+    known = bound | MODULE_NAMES | set(dir(builtins))
+    lines = source.splitlines()
+    for statement in tree.body:
+        if isinstance(statement, DEFINITIONS):
+            continue
+        if isinstance(statement, GUARDED):
+            # Later statements may not run at all if this one leaves the module early
+            break
+        for node in _top_level_loads(statement):
+            if node.id not in known:
+                return _format("NameError", f"name '{node.id}' is not defined", filename,
+                               node.lineno, lines[node.lineno - 1])
+        if _may_leave(statement, bound):
+            break
+    return None
@@ -0,0 +1,569 @@
+"""
+This module rewrites a Python script so that it can be run by codedebugger without user
+interaction. The script is parsed once into an AST and a list of passes walks the tree, each
+recording edits to the source of the nodes it wants to change:
+
+- mock_inputs replaces input() calls with randomly generated values.
+- relax_arguments turns required=True arguments of an ArgumentParser into optional ones with
+  a default value.
+- redirect_paths points file paths opened or assigned by the script at the sandbox directory
+  and records the files that have to exist there.
+- find_imports resolves the imports with importresolver, telling the missing ones apart from
+  those that are built in, installed or next to the script.
+
+The edits are applied in a single pass over the lines. Every line that changed is kept as a
+comment starting with "#%@ " followed by its new version, which is the format codePassed
+reverts. Only statements that fit on one line are rewritten, so that each comment is followed
+by exactly one replacement line. If the script cannot be parsed it is left unchanged.
+
+Given a cache, rewrite remembers what the passes did to each top-level function and class by
+the hash of its source, and reuses it instead of running the passes over one that has not
+changed since an earlier rewrite.
+
+Each run gets its own sandbox directory from make_sandbox_dir, on a tmpfs when there is one.
+prepare_files copies the files the script refers to into it, leaving the originals alone, and
+links the directories it names but never opens that are too large to copy on every run.
+remove_sandbox_dir deletes the directory with everything the run wrote when it is done, so runs
+do not disturb each other or leave anything behind.
+"""
+
+import ast
+import collections
+import gc
+import hashlib
+import os
+import random
+import re
+import shutil
+import tempfile
+
+import importresolver
+
+# The directory that file paths in the script are redirected to when no other is given
+SANDBOX_DIR = "/home/user/sig/"
+
+# The directory sandbox directories are created in, a tmpfs by default
+SANDBOX_ROOT = os.environ.get("PYAI_SANDBOX_ROOT") or ("/dev/shm" if os.access("/dev/shm", os.W_OK) else None)
+
+# Stands for the sandbox directory in cached results, which do not depend on it
+SANDBOX_TOKEN = "\0sandbox\0"
+
+# The marker added to lines holding a made-up value
+SENSIBLE_VALUE = "[SENSIBLE VALUE]"
+
+# The prefix of a line commented out by a rewrite
+COMMENT_ID = "#%@ "
+
+# The types input() calls are mocked for when they are converted
+INPUT_TYPES = ("int", "float", "str", "bool")
+
+# An absolute path in a string literal
+ABSOLUTE_PATH = re.compile(r"/[\w./-]+")
+
+# Largest directory, in bytes, that prepare_files copies into the sandbox
+MAX_COPY_BYTES = 4 * 1024 * 1024
+
+# Largest number of files and directories in a directory that prepare_files copies
+MAX_COPY_ENTRIES = 256
+
+# The version of what the passes store in a cache, part of every key so older entries are not used
+CACHE_FORMAT = 2
+
+# The ways of choosing values for mocked inputs
+STRATEGIES = ("random", "boundary", "empty")
+
+# Values at the edges of each type, as source
+BOUNDARY_VALUES = {
+    'int': ["0", "-1", "1", "2147483647", "-2147483648", "10**18"],
+    'float': ["0.0", "-1.0", "1e-12", "1e308", "-1e308", "float('nan')"],
+    'str': ['" "', '"0"', '"-1"', '"' + "x" * 1000 + '"', '"\\u00e9\\u4e2d\\U0001f600"', '"a b,c;d"'],
+    'bool': ["True", "False"],
+}
+
+
+def generate_random_value(var_type, rng=random):
+    """Generate a random value based on the variable type."""
+    if var_type == 'int':
+        return rng.randint(0, 100)
+    elif var_type == 'float':
+        return round(rng.uniform(0, 100), 2)
+    elif var_type == 'str':
+        return f'"{"".join(rng.choices("abcdefghijklmnopqrstuvwxyz1234567890", k=5))}"'
+    elif var_type == 'bool':
+        return str(rng.choice([True, False]))
+
+
+def value_generator(strategy, seed=None):
+    """
+    Returns a function that gives the source of the value a mocked input of a type is replaced
+    with. "random" gives random values as generate_random_value does, "boundary" gives values
+    at the edges of the type, and "empty" gives what the conversion of an empty line gives,
+    including the error int("") raises.
+
+    With a seed, the value of each input depends only on the seed and the input's call site,
+    so the same script is always given the same values.
+
+    :param strategy: One of STRATEGIES.
+    :type strategy: str
+    :param seed: The seed of the random choices, or None for values that change every time.
+    :type seed: int
+    :return: A function of the type name and the call site that returns source.
+    :rtype: callable
+    """
+    shared = random.Random()
+
+    def rng(site):
+        return shared if seed is None else random.Random(f"{seed}\0{site}")
+    if strategy == "random":
+        return lambda var_type, site="": str(generate_random_value(var_type, rng(site)))
+    if strategy == "boundary":
+        return lambda var_type, site="": rng(site).choice(BOUNDARY_VALUES[var_type])
+    if strategy == "empty":
+        return lambda var_type, site="": '""' if var_type == 'str' else f'{var_type}("")'
+    raise ValueError(f"unknown strategy {strategy}")
+
+
+def _replace_strings(value, old, new):
+    # Replace old with new in every string of a cache entry
+    if isinstance(value, str):
+        return value.replace(old, new)
+    if isinstance(value, dict):
+        return {k: _replace_strings(v, old, new) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_replace_strings(v, old, new) for v in value]
+    return value
+
+
+def _walk(tree, nodes):
+    # Add every node of a tree to the list of its type, in the order of ast.walk. Contexts such
+    # as ast.Load are left out, since no pass looks for them and there is one in every name
+    todo = collections.deque([tree])
+    while todo:
+        node = todo.popleft()
+        nodes[type(node)].append(node)
+        for field in node._fields:
+            value = getattr(node, field, None)
+            if isinstance(value, list):
+                todo.extend(item for item in value if isinstance(item, ast.AST))
+            elif isinstance(value, ast.AST) and not isinstance(value, ast.expr_context):
+                todo.append(value)
+
+
+class Rewriter:
+    """
+    The source of a script and the edits recorded against it. Edits are replacements of a
+    column range on one line and are applied together by render().
+
+    :param source: The source of the script.
+    :type source: str
+    :param sandbox_dir: The directory that file paths are redirected to.
+    :type sandbox_dir: str
+    :param values: A function of a type name and a call site that returns the source of the
+        value a mocked input is replaced with, see value_generator. Defaults to random values.
+    :type values: callable
+    :param cache: What the passes did to earlier functions by the hash of their source, or None.
+    :type cache: dict
+    :param key: What else the cached results depend on, such as the names of the passes.
+    :type key: str
+    :param script_dir: The directory of the script, whose modules are local, or None.
+    :type script_dir: str
+    """
+
+    def __init__(self, source, sandbox_dir=SANDBOX_DIR, values=None, cache=None, key="", script_dir=None):
+        self.source = source
+        self.sandbox_dir = sandbox_dir
+        self.script_dir = script_dir
+        self.values = values or value_generator("random")
+        self.lines = source.splitlines(keepends=True)
+        self.edits = {}
+        self.comments = {}
+        # What the passes found, each as a list of tuples that start with the line number
+        self.mocked = []
+        self.redirects = []
+        self.imported = []
+        self.cache = cache
+        # The Import of every module in imported, from find_imports
+        self.resolved = []
+        # The number of functions whose results were taken from the cache
+        self.reused = 0
+        # The functions the passes ran over, as (first line, last line, cache key)
+        self.fresh = []
+        # The nodes of the tree by type, so each pass does not have to walk the whole tree
+        self.nodes = collections.defaultdict(list)
+        # The parser allocates a node for every token, which would set off the cyclic garbage
+        # collector over and over although none of them is garbage yet
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            self._index(cache, key)
+        finally:
+            if enabled:
+                gc.enable()
+
+    def _index(self, cache, key):
+        # Parse the source and sort the nodes of the functions the cache does not have by type
+        try:
+            self.tree = ast.parse(self.source)
+        except (SyntaxError, ValueError):
+            self.tree = None
+            return
+        for statement in self.tree.body:
+            if cache is not None and isinstance(statement, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                first = min([statement.lineno] + [decorator.lineno for decorator in statement.decorator_list])
+                text = "".join(self.lines[first - 1:statement.end_lineno])
+                digest = hashlib.sha256(f"{key}\0{text}".encode()).hexdigest()
+                if digest in cache:
+                    self._restore(first, cache[digest])
+                    self.reused += 1
+                    continue
+                self.fresh.append((first, statement.end_lineno, digest))
+            _walk(statement, self.nodes)
+
+    @property
+    def files(self):
+        """dict: The files the rewritten script expects in the sandbox, by their original path."""
+        return {original: new_path for lineno, original, new_path, opened in sorted(self.redirects)}
+
+    @property
+    def opened(self):
+        """set: The original paths that the script opens rather than only names."""
+        return {original for lineno, original, new_path, opened in self.redirects if opened}
+
+    @property
+    def imports(self):
+        """list: The import statements of modules that are not built in, installed or local."""
+        return importresolver.missing_imports(self.resolved)
+
+    @property
+    def modules(self):
+        """list: The name of every module the script imports, other than relative imports."""
+        return list(dict.fromkeys(item.module for item in self.resolved if not item.module.startswith(".")))
+
+    def _restore(self, first, entry):
+        # Replay the cached results of a function that starts at line first
+        entry = _replace_strings(entry, SANDBOX_TOKEN, self.sandbox_dir)
+        for offset, start, end, text in entry["edits"]:
+            self.edits.setdefault(first + offset, []).append((start, end, text))
+        for offset, comment in entry["comments"]:
+            self.comments[first + offset] = comment
+        self.mocked += [(first + offset, value) for offset, value in entry["mocked"]]
+        self.redirects += [(first + offset, *rest) for offset, *rest in entry["redirects"]]
+        self.imported += [(first + offset, *rest) for offset, *rest in entry["imported"]]
+
+    def store(self):
+        """Adds the results of the passes for every function they ran over to the cache."""
+        if self.cache is None:
+            return
+        for first, last, digest in self.fresh:
+            def inside(items):
+                return [[lineno - first, *rest] for lineno, *rest in items if first <= lineno <= last]
+            self.cache[digest] = _replace_strings({
+                "edits": inside((lineno, *edit) for lineno, edits in self.edits.items() for edit in edits),
+                "comments": inside(self.comments.items()),
+                "mocked": inside(self.mocked),
+                "redirects": inside(self.redirects),
+                "imported": inside(self.imported),
+            }, self.sandbox_dir, SANDBOX_TOKEN)
+
+    def line(self, lineno):
+        """
+        Returns the original text of a line without its line ending.
+
+        :param lineno: The 1-based line number.
+        :type lineno: int
+        :rtype: str
+        """
+        return self.lines[lineno - 1].rstrip("\r\n")
+
+    def segment(self, node):
+        """
+        Returns the source of a node that fits on one line.
+
+        :param node: The node.
+        :type node: ast.AST
+        :rtype: str
+        """
+        line = self.line(node.lineno).encode()
+        return line[node.col_offset:node.end_col_offset].decode()
+
+    def editable(self, node):
+        """
+        Returns whether a node can be rewritten: it must fit on one line that is not a line
+        written by an earlier run of the debugger.
+
+        :param node: The node.
+        :type node: ast.AST
+        :rtype: bool
+        """
+        if node.lineno != node.end_lineno:
+            return False
+        line = self.line(node.lineno)
+        return self.sandbox_dir not in line and SENSIBLE_VALUE not in line and COMMENT_ID not in line
+
+    def replace(self, node, text):
+        """
+        Records that the source of a node is to be replaced with text.
+
+        :param node: A node that fits on one line.
+        :type node: ast.AST
+        :param text: The new source.
+        :type text: str
+        """
+        self.edits.setdefault(node.lineno, []).append((node.col_offset, node.end_col_offset, text))
+
+    def insert_after(self, node, text):
+        """
+        Records that text is to be inserted right after the source of a node.
+
+        :param node: A node that fits on one line.
+        :type node: ast.AST
+        :param text: The text to insert.
+        :type text: str
+        """
+        self.edits.setdefault(node.lineno, []).append((node.end_col_offset, node.end_col_offset, text))
+
+    def annotate(self, lineno, comment):
+        """
+        Records a comment to add at the end of a line, unless the line already has one.
+
+        :param lineno: The 1-based line number.
+        :type lineno: int
+        :param comment: The comment without the leading "#".
+        :type comment: str
+        """
+        if "#" not in self.line(lineno):
+            self.comments[lineno] = comment
+
+    def render(self):
+        """
+        Applies the recorded edits and returns the rewritten source.
+
+        :return: The rewritten source.
+        :rtype: str
+        """
+        if not self.edits:
+            return self.source
+        output = []
+        for lineno, original in enumerate(self.lines, 1):
+            edits = self.edits.get(lineno)
+            if not edits:
+                output.append(original)
+                continue
+            text = self.line(lineno)
+            ending = original[len(text):] or "\n"
+            new = text.encode()
+            # Apply the edits from right to left so the earlier columns stay valid
+            for start, end, replacement in sorted(edits, key=lambda edit: (edit[0], edit[1]), reverse=True):
+                new = new[:start] + replacement.encode() + new[end:]
+            new = new.decode()
+            if lineno in self.comments:
+                new += f" #{self.comments[lineno]}"
+            output.append(f"{COMMENT_ID}{text}{ending}{new}{ending}")
+        return "".join(output)
+
+
+def _is_input_call(node):
+    return (isinstance(node, ast.Call) and isinstance(node.func, ast.Name)
+            and node.func.id == "input")
+
+
+def mock_inputs(rewriter):
+    """
+    Replaces input() calls with generated values, random ones unless the Rewriter was given
+    another generator. A call wrapped in int(), float(), str() or bool() is replaced together
+    with the conversion by a value of that type, and a bare call by a string.
+
+    :param rewriter: The script being rewritten.
+    :type rewriter: Rewriter
+    """
+    converted = set()
+    # The calls are in breadth-first order, so a conversion is seen before the input() it wraps
+    for node in rewriter.nodes[ast.Call]:
+        if not rewriter.editable(node):
+            continue
+        site = f"{rewriter.line(node.lineno)}\0{node.col_offset}"
+        if (isinstance(node.func, ast.Name) and node.func.id in INPUT_TYPES
+                and len(node.args) == 1 and _is_input_call(node.args[0])):
+            value = rewriter.values(node.func.id, site)
+            converted.add(id(node.args[0]))
+        elif _is_input_call(node) and id(node) not in converted:
+            value = rewriter.values("str", site)
+        else:
+            continue
+        rewriter.replace(node, value)
+        rewriter.mocked.append((node.lineno, value))
+        rewriter.annotate(node.lineno, SENSIBLE_VALUE)
+
+
+def relax_arguments(rewriter):
+    """
+    Makes required arguments of an ArgumentParser optional and gives them a default value
+    when they do not have one.
+
+    :param rewriter: The script being rewritten.
+    :type rewriter: Rewriter
+    """
+    for node in rewriter.nodes[ast.Call]:
+        if not (isinstance(node.func, ast.Attribute) and node.func.attr == "add_argument"
+                and rewriter.editable(node)):
+            continue
+        keywords = {keyword.arg: keyword for keyword in node.keywords}
+        required = keywords.get("required")
+        if required is None or not (isinstance(required.value, ast.Constant) and required.value.value is True):
+            continue
+        rewriter.replace(required.value, "False")
+        if "default" not in keywords:
+            last = max(node.args + [keyword.value for keyword in node.keywords],
+                       key=lambda arg: (arg.end_lineno, arg.end_col_offset))
+            rewriter.insert_after(last, f', default="{SENSIBLE_VALUE}"')
+
+
+def _redirect(rewriter, node, filename, opened):
+    # Point a path at the sandbox and remember which file has to exist there
+    new_path = os.path.join(rewriter.sandbox_dir, os.path.basename(filename))
+    rewriter.replace(node, repr(new_path))
+    rewriter.redirects.append((node.lineno, filename, new_path, opened))
+
+
+def redirect_paths(rewriter):
+    """
+    Points the files the script opens, and the absolute paths it assigns to variables, at
+    the sandbox directory.
+
+    :param rewriter: The script being rewritten.
+    :type rewriter: Rewriter
+    """
+    for node in rewriter.nodes[ast.Call] + rewriter.nodes[ast.Assign]:
+        if (isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == "open"
+                and node.args and rewriter.editable(node)):
+            path = node.args[0]
+            # A path with a mode is opened for sure, a lone absolute path probably is
+            with_mode = len(node.args) > 1 or bool(node.keywords)
+            if isinstance(path, ast.Constant) and isinstance(path.value, str):
+                if with_mode or ABSOLUTE_PATH.fullmatch(path.value):
+                    _redirect(rewriter, path, path.value, True)
+            elif with_mode and isinstance(path, (ast.Name, ast.Attribute)):
+                # The name of the variable holding the path stands for the file name
+                _redirect(rewriter, path, rewriter.segment(path), True)
+        elif (isinstance(node, ast.Assign) and isinstance(node.value, ast.Constant)
+                and isinstance(node.value.value, str) and ABSOLUTE_PATH.fullmatch(node.value.value)
+                and rewriter.editable(node)):
+            _redirect(rewriter, node.value, node.value.value, False)
+
+
+def make_sandbox_dir():
+    """
+    Creates an empty sandbox directory for one run.
+
+    :return: The path of the directory, ending with a separator.
+    :rtype: str
+    """
+    return tempfile.mkdtemp(prefix="pyai-sandbox-", dir=SANDBOX_ROOT) + os.sep
+
+
+def remove_sandbox_dir(sandbox_dir):
+    """
+    Removes a sandbox directory and everything a run left in it.
+
+    :param sandbox_dir: The path of the directory.
+    :type sandbox_dir: str
+    """
+    shutil.rmtree(sandbox_dir, ignore_errors=True)
+
+
+def _small(directory):
+    # Whether a directory is within MAX_COPY_BYTES and MAX_COPY_ENTRIES, stopping the walk as
+    # soon as it is not
+    size = 0
+    entries = 0
+    for root, dirs, names in os.walk(directory):
+        entries += len(dirs) + len(names)
+        size += sum(os.lstat(os.path.join(root, name)).st_size for name in names)
+        if size > MAX_COPY_BYTES or entries > MAX_COPY_ENTRIES:
+            return False
+    return True
+
+
+def prepare_files(rewriter):
+    """
+    Creates the files that the rewritten script expects in the sandbox directory. A file or
+    directory that exists at its original path is copied there, so the script can change the
+    copy without touching the original. A directory larger than MAX_COPY_BYTES or
+    MAX_COPY_ENTRIES that the script never opens, such as a system directory, is linked instead
+    of copied into every run. Files are always copied, since the script may open a path it
+    names for writing through a variable. Otherwise a file holding a placeholder value is
+    created, or a directory for an assigned path without an extension.
+
+    :param rewriter: The rewritten script.
+    :type rewriter: Rewriter
+    """
+    for original, new_path in rewriter.files.items():
+        if os.path.lexists(new_path):
+            # Two paths with the same name share a copy
+            continue
+        if os.path.isdir(original):
+            if original not in rewriter.opened and not _small(original):
+                os.symlink(os.path.abspath(original), new_path.rstrip(os.sep))
+            else:
+                shutil.copytree(original, new_path, symlinks=True)
+        elif os.path.exists(original):
+            shutil.copy2(original, new_path)
+        elif original in rewriter.opened or "." in os.path.basename(new_path):
+            with open(new_path, 'w') as f:
+                f.write(SENSIBLE_VALUE)
+        else:
+            os.makedirs(new_path, exist_ok=True)
+
+
+def find_imports(rewriter):
+    """
+    Collects the modules the script imports and resolves them with importresolver. The imports
+    of functions taken from the cache are resolved again too, since whether a module is
+    installed can change between runs.
+
+    :param rewriter: The script being rewritten.
+    :type rewriter: Rewriter
+    """
+    if rewriter.tree is None:
+        # Fall back to the import lines for a script that does not parse
+        rewriter.imported = importresolver.parse_imports(rewriter.source)
+    for node in rewriter.nodes[ast.Import] + rewriter.nodes[ast.ImportFrom]:
+        if node.lineno == node.end_lineno:
+            statement = rewriter.segment(node)
+        else:
+            statement = ast.get_source_segment(rewriter.source, node)
+        rewriter.imported += [(node.lineno, module, statement) for module in importresolver.imported_modules(node)]
+    rewriter.resolved = importresolver.classify(sorted(rewriter.imported), rewriter.script_dir)
+
+
+# The passes run by rewrite, in order
+PASSES = (find_imports, mock_inputs, relax_arguments, redirect_paths)
+
+
+def rewrite(source, sandbox_dir=SANDBOX_DIR, passes=PASSES, values=None, cache=None, script_dir=None):
+    """
+    Parses a script once and runs the passes over it.
+
+    :param source: The source of the script.
+    :type source: str
+    :param sandbox_dir: The directory that file paths are redirected to.
+    :type sandbox_dir: str
+    :param passes: The passes to run, each called with the Rewriter.
+    :type passes: tuple
+    :param values: The generator of values for mocked inputs, see value_generator.
+    :type values: callable
+    :param cache: A dict to reuse and store the results of the passes per function in, or None.
+    :type cache: dict
+    :param script_dir: The directory of the script, whose modules are local, or None.
+    :type script_dir: str
+    :return: The Rewriter, whose render() returns the new source and whose files and imports
+        hold what the passes found.
+    :rtype: Rewriter
+    """
+    key = f"{CACHE_FORMAT}:" + ",".join(rewrite_pass.__name__ for rewrite_pass in passes)
+    rewriter = Rewriter(source, sandbox_dir, values, cache, key, script_dir)
+    for rewrite_pass in passes:
+        if rewriter.tree is not None or rewrite_pass is find_imports:
+            rewrite_pass(rewriter)
+    rewriter.store()
+    return rewriter
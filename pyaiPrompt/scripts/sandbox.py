@@ -0,0 +1,463 @@
+"""
+This module runs a command in a sandbox whose limits are enforced by the kernel rather than by
+watching the process from another thread. The child is started in its own session with
+rlimits on its address space, CPU time, file size and number of processes, and it is killed
+together with everything it started when it runs out of time.
+The limits are set from the parent with prlimit rather than in a preexec_fn, which is not safe
+when the parent has threads, as it does when trials run at once. Until they are set, the child
+waits in a small shell that reads a line from its stdin and only then execs the command. When a
+delegated cgroup v2 directory is given (for example through the PYAI_CGROUP environment
+variable), the child is also placed in its own cgroup, which caps the memory and number of
+processes of the whole process tree.
+
+The parent waits on a pidfd and the child's output pipes with a selector, so nothing polls
+while the child runs. The child is reaped with os.wait4, which reports its peak resident
+memory and the CPU time it used.
+
+Only the start and the end of each output stream are kept, in an OutputBuffer, so a child that
+prints in a tight loop cannot fill the parent's memory, and the result that is sent on to the
+AI stays small. The part in between is replaced by a line saying how many bytes were left out.
+Each piece of output can also be passed to a callback as it arrives, to show progress while the
+child runs.
+"""
+import collections
+import os
+import resource
+import selectors
+import signal
+import subprocess
+import time
+import uuid
+
+# Default limit on the address space of the child in MB
+MEMORY_LIMIT_MB = 1024
+
+# Default limit on the CPU time of the child in seconds
+CPU_LIMIT = 10
+
+# Default limit on the size of a file the child writes in MB
+FILE_LIMIT_MB = 64
+
+# Default number of processes the child may start besides the ones the user already has
+PROCESS_LIMIT = 32
+
+# A delegated cgroup v2 directory to create a cgroup for each run in, or None
+CGROUP_ROOT = os.environ.get("PYAI_CGROUP")
+
+# Waits for the parent to set the limits, then runs the command with no stdin
+GATE = ("/bin/sh", "-c", 'read -r _ || exit 125; exec "$@" </dev/null', "pyai-sandbox")
+
+# Bytes read from a pipe at a time
+READ_SIZE = 65536
+
+# Seconds to keep reading output after the child has exited or been killed
+DRAIN_TIMEOUT = 1
+
+# Bytes kept from the start of each output stream
+HEAD_BYTES = 8 * 1024
+
+# Bytes kept from the end of each output stream, where tracebacks are
+TAIL_BYTES = 56 * 1024
+
+
+class SandboxResult:
+    """
+    The outcome of a sandboxed run.
+
+    :ivar returncode: The exit code, or the negative number of the signal that killed the child.
+    :ivar stdout: What was kept of what the child wrote to stdout.
+    :ivar stderr: What was kept of what the child wrote to stderr.
+    :ivar limit: The limit the child ran into: "timeout", "cpu", "memory" or "file size", or None.
+    :ivar peak_rss_mb: The peak resident memory of the child in MB.
+    :ivar cpu_time: The user and system CPU time of the child in seconds.
+    :ivar wall_time: How long the child ran in seconds.
+    """
+
+    def __init__(self, returncode, stdout, stderr, limit, peak_rss_mb, cpu_time, wall_time):
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+        self.limit = limit
+        self.peak_rss_mb = peak_rss_mb
+        self.cpu_time = cpu_time
+        self.wall_time = wall_time
+
+    @property
+    def timed_out(self):
+        """bool: Whether the child was killed for running longer than the timeout."""
+        return self.limit == "timeout"
+
+
+class OutputBuffer:
+    """
+    Keeps the first and the last bytes written to it and counts the ones in between.
+
+    :param head: The number of bytes to keep from the start.
+    :type head: int
+    :param tail: The number of bytes to keep from the end.
+    :type tail: int
+    """
+
+    def __init__(self, head=HEAD_BYTES, tail=TAIL_BYTES):
+        self.head_limit = head
+        self.tail_limit = tail
+        self.head = bytearray()
+        self.tail = collections.deque()
+        self.tail_size = 0
+        self.total = 0
+
+    def write(self, data):
+        """
+        Adds output to the buffer, dropping the oldest output past the head that no longer fits.
+
+        :param data: The output.
+        :type data: bytes
+        """
+        self.total += len(data)
+        room = self.head_limit - len(self.head)
+        if room > 0:
+            self.head += data[:room]
+            data = data[room:]
+        if not data or not self.tail_limit:
+            return
+        self.tail.append(data)
+        self.tail_size += len(data)
+        # Drop whole pieces while the rest still fills the tail
+        while self.tail_size - len(self.tail[0]) >= self.tail_limit:
+            self.tail_size -= len(self.tail.popleft())
+
+    @property
+    def elided(self):
+        """int: The number of bytes left out between the head and the tail."""
+        return self.total - len(self.head) - min(self.tail_size, self.tail_limit)
+
+    def getvalue(self):
+        """
+        Returns the kept output, with a line in place of what was left out.
+
+        :rtype: bytes
+        """
+        tail = b"".join(self.tail)[-self.tail_limit:] if self.tail_limit else b""
+        if not self.elided:
+            return bytes(self.head) + tail
+        return bytes(self.head) + f"\n[... {self.elided} bytes of output left out ...]\n".encode() + tail
+
+
+def _user_processes():
+    # RLIMIT_NPROC counts every process of the user, so the limit has to leave room for them
+    uid = os.getuid()
+    count = 0
+    for pid in os.listdir("/proc"):
+        if pid.isdigit():
+            try:
+                if os.stat(f"/proc/{pid}").st_uid == uid:
+                    count += 1
+            except OSError:
+                pass
+    return count
+
+
+def make_cgroup(memory_mb, max_procs):
+    """
+    Creates a cgroup for one run that caps the memory and number of processes of everything
+    in it.
+
+    :param memory_mb: The memory limit in MB.
+    :type memory_mb: float
+    :param max_procs: The process limit.
+    :type max_procs: int
+    :return: The path of the cgroup, or None if there is no usable cgroup v2 directory.
+    :rtype: str
+    """
+    if not CGROUP_ROOT:
+        return None
+    path = os.path.join(CGROUP_ROOT, "pyai-" + uuid.uuid4().hex)
+    try:
+        os.mkdir(path)
+        with open(os.path.join(path, "memory.max"), "w") as f:
+            f.write(str(int(memory_mb * 1024 * 1024)))
+        with open(os.path.join(path, "pids.max"), "w") as f:
+            f.write(str(max_procs))
+        return path
+    except OSError:
+        remove_cgroup(path)
+        return None
+
+
+def remove_cgroup(path):
+    """
+    Kills anything still in a cgroup and removes it.
+
+    :param path: The path of the cgroup.
+    :type path: str
+    """
+    try:
+        with open(os.path.join(path, "cgroup.kill"), "w") as f:
+            f.write("1")
+    except OSError:
+        pass
+    for i in range(100):
+        try:
+            os.rmdir(path)
+            return
+        except FileNotFoundError:
+            return
+        except OSError:
+            time.sleep(0.01)
+
+
+def _oom_killed(path):
+    # Whether the kernel killed a process of the cgroup for using too much memory
+    try:
+        with open(os.path.join(path, "memory.events")) as f:
+            events = dict(line.split() for line in f)
+        return int(events.get("oom_kill", 0)) > 0
+    except (OSError, ValueError):
+        return False
+
+
+def _rlimits(memory_mb, cpu_seconds, file_mb, max_procs):
+    # The rlimits of a child, as (resource, (soft, hard)) pairs
+    memory = int(memory_mb * 1024 * 1024)
+    size = int(file_mb * 1024 * 1024)
+    nproc = _user_processes() + max_procs
+    return [
+        (resource.RLIMIT_AS, (memory, memory)),
+        # The soft limit sends SIGXCPU, the hard limit one second later SIGKILL
+        (resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds + 1)),
+        (resource.RLIMIT_FSIZE, (size, size)),
+        (resource.RLIMIT_NPROC, (nproc, nproc)),
+        (resource.RLIMIT_CORE, (0, 0)),
+    ]
+
+
+def limit_child(memory_mb, cpu_seconds, file_mb, max_procs, cgroup):
+    """
+    Returns a function that, called in a new child, moves it to its own session and cgroup
+    and applies the rlimits. It must only be called in a child forked by a process without
+    other threads, such as the fork server; run sets the limits from the parent instead.
+
+    :param memory_mb: The limit on the address space in MB.
+    :type memory_mb: float
+    :param cpu_seconds: The limit on the CPU time in seconds.
+    :type cpu_seconds: int
+    :param file_mb: The limit on the size of a written file in MB.
+    :type file_mb: float
+    :param max_procs: The number of processes the child may start.
+    :type max_procs: int
+    :param cgroup: The cgroup to join, or None.
+    :type cgroup: str
+    :rtype: callable
+    """
+    limits = _rlimits(memory_mb, cpu_seconds, file_mb, max_procs)
+
+    def apply():
+        os.setsid()
+        if cgroup:
+            with open(os.path.join(cgroup, "cgroup.procs"), "w") as f:
+                f.write("0")
+        for limit, values in limits:
+            resource.setrlimit(limit, values)
+    return apply
+
+
+def limit_process(pid, memory_mb, cpu_seconds, file_mb, max_procs, cgroup):
+    """
+    Moves a process that is waiting at the GATE to a cgroup and applies the rlimits to it
+    from the parent.
+
+    :param pid: The process.
+    :type pid: int
+    :param memory_mb: The limit on the address space in MB.
+    :type memory_mb: float
+    :param cpu_seconds: The limit on the CPU time in seconds.
+    :type cpu_seconds: int
+    :param file_mb: The limit on the size of a written file in MB.
+    :type file_mb: float
+    :param max_procs: The number of processes the child may start.
+    :type max_procs: int
+    :param cgroup: The cgroup to move it to, or None.
+    :type cgroup: str
+    """
+    if cgroup:
+        with open(os.path.join(cgroup, "cgroup.procs"), "w") as f:
+            f.write(str(pid))
+    for limit, values in _rlimits(memory_mb, cpu_seconds, file_mb, max_procs):
+        resource.prlimit(pid, limit, values)
+
+
+def _kill_group(pgid):
+    try:
+        os.killpg(pgid, signal.SIGKILL)
+    except OSError:
+        pass
+
+
+def collect_output(pgid, stdout, stderr, exit_fd, timeout, on_output=None):
+    """
+    Reads the output of a child until it exits and its pipes are closed, killing its process
+    group if it runs out of time or once it has exited. Only the start and the end of each
+    stream are kept.
+
+    :param pgid: The process group of the child.
+    :type pgid: int
+    :param stdout: The read end of the child's stdout pipe.
+    :type stdout: int
+    :param stderr: The read end of the child's stderr pipe.
+    :type stderr: int
+    :param exit_fd: A file descriptor that becomes readable when the child exits, or None.
+    :type exit_fd: int
+    :param timeout: The longest time the child may run in seconds.
+    :type timeout: float
+    :param on_output: Called with "stdout" or "stderr" and each piece of output as it arrives, or None.
+    :type on_output: callable
+    :return: What was kept of the child's stdout and stderr, and whether it ran out of time.
+    :rtype: tuple
+    """
+    output = {stdout: OutputBuffer(), stderr: OutputBuffer()}
+    names = {stdout: "stdout", stderr: "stderr"}
+    selector = selectors.DefaultSelector()
+    for pipe in output:
+        os.set_blocking(pipe, False)
+        selector.register(pipe, selectors.EVENT_READ)
+    if exit_fd is not None:
+        selector.register(exit_fd, selectors.EVENT_READ)
+    deadline = time.monotonic() + timeout
+    timed_out = False
+    exited = False
+    try:
+        while output.keys() & selector.get_map().keys():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                if exited or timed_out:
+                    # Something outside the session still holds the pipes, so stop waiting for it
+                    break
+                timed_out = True
+                _kill_group(pgid)
+                deadline = time.monotonic() + DRAIN_TIMEOUT
+                continue
+            for key, events in selector.select(remaining):
+                if key.fd == exit_fd:
+                    # The child has exited, so stop whatever it left behind and read what is left
+                    selector.unregister(exit_fd)
+                    exited = True
+                    _kill_group(pgid)
+                    deadline = min(deadline, time.monotonic() + DRAIN_TIMEOUT)
+                    continue
+                data = os.read(key.fd, READ_SIZE)
+                if data:
+                    output[key.fd].write(data)
+                    if on_output is not None:
+                        on_output(names[key.fd], data)
+                else:
+                    selector.unregister(key.fd)
+    finally:
+        selector.close()
+        # Stop anything the child left in its session
+        _kill_group(pgid)
+    return output[stdout].getvalue(), output[stderr].getvalue(), timed_out
+
+
+def make_result(returncode, stdout, stderr, timed_out, peak_rss_mb, cpu_time, wall_time,
+                cpu_seconds=CPU_LIMIT, cgroup=None):
+    """
+    Works out which limit, if any, stopped a child and builds the SandboxResult of its run.
+
+    :param returncode: The exit code, or the negative number of the signal that killed the child.
+    :type returncode: int
+    :param stdout: What the child wrote to stdout.
+    :type stdout: bytes
+    :param stderr: What the child wrote to stderr.
+    :type stderr: bytes
+    :param timed_out: Whether the child was killed for running out of time.
+    :type timed_out: bool
+    :param peak_rss_mb: The peak resident memory of the child in MB.
+    :type peak_rss_mb: float
+    :param cpu_time: The CPU time of the child in seconds.
+    :type cpu_time: float
+    :param wall_time: How long the child ran in seconds.
+    :type wall_time: float
+    :param cpu_seconds: The CPU time limit of the child.
+    :type cpu_seconds: int
+    :param cgroup: The cgroup of the child, or None.
+    :type cgroup: str
+    :rtype: SandboxResult
+    """
+    stdout = stdout.decode("utf-8", errors="replace")
+    stderr = stderr.decode("utf-8", errors="replace")
+    limit = "timeout" if timed_out else None
+    if limit is None:
+        if returncode == -signal.SIGXCPU or (returncode == -signal.SIGKILL and cpu_time >= cpu_seconds):
+            limit = "cpu"
+        elif returncode == -signal.SIGXFSZ or (returncode != 0 and "File too large" in stderr):
+            # Python ignores SIGXFSZ, so the write fails with EFBIG instead
+            limit = "file size"
+        elif (cgroup and _oom_killed(cgroup)) or (returncode != 0 and "MemoryError" in stderr):
+            limit = "memory"
+    return SandboxResult(returncode, stdout, stderr, limit, peak_rss_mb, cpu_time, wall_time)
+
+
+def run(args, timeout, memory_mb=MEMORY_LIMIT_MB, cpu_seconds=CPU_LIMIT, file_mb=FILE_LIMIT_MB,
+        max_procs=PROCESS_LIMIT, cwd=None, env=None, on_output=None):
+    """
+    Runs a command in the sandbox and waits for it to finish or run out of time.
+
+    :param args: The command and its arguments.
+    :type args: list
+    :param timeout: The longest time the child may run in seconds.
+    :type timeout: float
+    :param memory_mb: The limit on the address space of the child in MB.
+    :type memory_mb: float
+    :param cpu_seconds: The limit on the CPU time of the child in seconds.
+    :type cpu_seconds: int
+    :param file_mb: The limit on the size of a file the child writes in MB.
+    :type file_mb: float
+    :param max_procs: The number of processes the child may start.
+    :type max_procs: int
+    :param cwd: The working directory of the child.
+    :type cwd: str
+    :param env: The environment of the child.
+    :type env: dict
+    :param on_output: Called with "stdout" or "stderr" and each piece of output as it arrives, or None.
+    :type on_output: callable
+    :return: The outcome of the run.
+    :rtype: SandboxResult
+    """
+    cgroup = make_cgroup(memory_mb, max_procs)
+    start = time.monotonic()
+    process = subprocess.Popen(list(GATE) + list(args), stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE, cwd=cwd, env=env, start_new_session=True)
+    try:
+        limit_process(process.pid, memory_mb, cpu_seconds, file_mb, max_procs, cgroup)
+        # Let the command start now that its limits are in place
+        process.stdin.write(b"\n")
+    except BaseException:
+        _kill_group(process.pid)
+        process.communicate()
+        if cgroup:
+            remove_cgroup(cgroup)
+        raise
+    finally:
+        # Without the line, the gate reads end of file and exits without running the command
+        process.stdin.close()
+    # A pidfd becomes readable when the child exits, even if a grandchild still holds the pipes
+    pidfd = os.pidfd_open(process.pid) if hasattr(os, "pidfd_open") else None
+    try:
+        stdout, stderr, timed_out = collect_output(process.pid, process.stdout.fileno(),
+                                                   process.stderr.fileno(), pidfd, timeout, on_output)
+        pid, status, usage = os.wait4(process.pid, 0)
+    finally:
+        if pidfd is not None:
+            os.close(pidfd)
+        process.stdout.close()
+        process.stderr.close()
+    wall_time = time.monotonic() - start
+    # Tell Popen the child has been reaped
+    process.returncode = os.waitstatus_to_exitcode(status)
+    try:
+        # ru_maxrss is in KB on Linux
+        return make_result(process.returncode, stdout, stderr, timed_out, usage.ru_maxrss / 1024,
+                           usage.ru_utime + usage.ru_stime, wall_time, cpu_seconds, cgroup)
+    finally:
+        if cgroup:
+            remove_cgroup(cgroup)
@@ -6,64 +6,269 @@ The script is started automatically via bashrc when the VM boots up.
 
 The script uses the following files and directories:
 
-pyaiDir: The directory where the pyaiprompt script and its input and output files are stored.
+pyaiDir: The directory where the pyaiprompt script is stored.
 pyai: The path to the pyaiprompt script.
-codefile: The path to the file where the code input for the pyaiprompt script is written.
-contextfile: The path to the file where the context input for the pyaiprompt script is written.
-outputfile: The path to the file where the output of the pyaiprompt script is read.
+jobsDir: The directory that holds a temporary working directory for each job.
 
-The script exposes two functions via XMLRPC:
+Each job gets its own working directory with the files below, so jobs that run at the same
+time cannot overwrite each other's input or output. The pyaiprompt script is started in that
+directory and is told the paths through the PYAI_CODE_FILE, PYAI_CONTEXT_FILE and
+PYAI_OUTPUT_FILE environment variables. The directory is removed once the job has finished.
+
+code.txt: The code input for the pyaiprompt script.
+context.txt: The context input for the pyaiprompt script.
+output.txt: The output of the pyaiprompt script.
+
+The script exposes the following functions via XMLRPC:
 
 shutdown_vm(): Shuts down the VM using the os.system command.
-prompt_ai(code, context): Runs the pyaiprompt script with the given code and context inputs and returns the output as a string.
+prompt_ai(code, context): Starts the pyaiprompt script with the given code and context inputs in the
+    background and returns a job ID.
+status(job_id): Returns the status of a job: queued, running, streaming, done or failed.
+wait_output(job_id, offset, timeout): Waits until a job has output past offset or has finished and
+    returns the new output.
+getOutput(): Returns the output of the most recent job so far.
+
+At most --max-jobs jobs run at once and the rest wait in the queued state. While a job runs,
+its output file is watched for new text so that wait_output can return as soon as the AI
+writes something or the script exits. Every request is handled in its own thread and the
+status calls only hold a job's lock for as long as it takes to copy its output, so they
+never wait behind a running job.
+
+With --warm, jobs are handed to a pool of long-lived worker processes that keep the pyaiprompt
+engine loaded between jobs (see warmworker.py) instead of starting the script for every job.
 """
 
+import argparse
+import codecs
 import os
+import shutil
+import socketserver
 import subprocess
 import sys
-from xmlrpc.server import SimpleXMLRPCServer
+import tempfile
+import threading
+import time
+import uuid
+from xmlrpc.server import SimpleXMLRPCRequestHandler, SimpleXMLRPCServer
+
+from warmworker import MAX_JOBS_PER_WORKER, MAX_WORKER_RSS_MB, WorkerPool
 
-# Define the paths for the pyaiprompt script and its input and output files
+# Define the paths for the pyaiprompt script and the job directories
 pyaiDir = "/home/signal/pyaiprompt"
 pyai = pyaiDir + "/pyaiprompt.py" # Added a "+" operator to concatenate strings
-codefile = pyaiDir + "/code.txt"
-contextfile = pyaiDir + "/context.txt"
-outputfile = pyaiDir + "/output.txt"
+jobsDir = pyaiDir + "/jobs"
+
+# Default number of jobs that may run at the same time
+MAX_JOBS = 2
+
+# Seconds between checks of the output file while a job is running
+WATCH_INTERVAL = 0.05
+
+# Longest time a wait_output call may block in seconds
+MAX_WAIT = 30
+
+# Number of finished jobs to remember
+MAX_FINISHED_JOBS = 32
 
 print("Starting XMLRPC Server.")
 
+
+class PromptJob:
+    """One run of the pyaiprompt script and the output it has written so far."""
+
+    def __init__(self, code, context):
+        self.id = uuid.uuid4().hex
+        self.code = code
+        self.context = context
+        self.status = "queued"
+        self.error = ""
+        self.output = ""
+        self.cond = threading.Condition()
+
+    def set_status(self, status, error=""):
+        """Change the status of the job and wake any waiting callers."""
+        with self.cond:
+            self.status = status
+            self.error = error
+            self.cond.notify_all()
+
+    def add_output(self, text):
+        """Append text to the output of the job and wake any waiting callers."""
+        if not text:
+            return
+        with self.cond:
+            self.output += text
+            if self.status == "running":
+                self.status = "streaming"
+            self.cond.notify_all()
+
+    def finished(self):
+        """Return True once the job is done or has failed."""
+        return self.status in ("done", "failed")
+
+
+# Jobs by ID in the order they were created, and the slots that limit how many run at once
+jobs = {}
+jobs_lock = threading.Lock()
+run_slots = threading.BoundedSemaphore(MAX_JOBS)
+
+# The pool of warm workers, or None to start the pyaiprompt script for every job
+worker_pool = None
+
+
 def shutdown_vm():
     """Shuts down the VM using the os.system command."""
     os.system('shutdown now -h')
     return 'Shutting down VM'
 
+
+def watch_output(job, process, outputfile):
+    """Reads new text from a job's output file until the process exits."""
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    position = 0
+    while True:
+        exited = process.poll() is not None
+        # Only read when the file has grown
+        if os.path.exists(outputfile) and os.path.getsize(outputfile) > position:
+            with open(outputfile, "rb") as f:
+                f.seek(position)
+                data = f.read()
+            position += len(data)
+            job.add_output(decoder.decode(data))
+        if exited:
+            job.add_output(decoder.decode(b"", final=True))
+            return process.returncode
+        time.sleep(WATCH_INTERVAL)
+
+
+def run_job(job):
+    """Runs the pyaiprompt script for a job in its own working directory once a slot is free."""
+    with run_slots:
+        workdir = None
+        try:
+            job.set_status("running")
+            print(job.code + "\n")
+            print(job.context + "\n")
+            # Create a fresh working directory for the job's input and output files
+            os.makedirs(jobsDir, exist_ok=True)
+            workdir = tempfile.mkdtemp(prefix=job.id + "-", dir=jobsDir)
+            codefile = os.path.join(workdir, "code.txt")
+            contextfile = os.path.join(workdir, "context.txt")
+            outputfile = os.path.join(workdir, "output.txt")
+            # Write the code and context inputs to their respective files
+            with open (codefile, "w") as f:
+                f.write(job.code)
+            with open (contextfile, "w") as f:
+                f.write(job.context)
+            open(outputfile, "w").close()
+            # Tell the pyaiprompt script where its files are
+            env = dict(os.environ, PYAI_CODE_FILE=codefile, PYAI_CONTEXT_FILE=contextfile, PYAI_OUTPUT_FILE=outputfile)
+            if worker_pool is not None:
+                # Hand the job to a warm worker, which streams the output back as it arrives
+                returncode, error = worker_pool.run(job.code, job.context, workdir, job.add_output)
+            else:
+                # Start the pyaiprompt script and follow its output file until it exits
+                process = subprocess.Popen([sys.executable, pyai], cwd=workdir, env=env)
+                returncode, error = watch_output(job, process, outputfile), ""
+            print(job.output)
+            if returncode == 0:
+                job.set_status("done")
+            else:
+                job.set_status("failed", error or f"pyaiprompt exited with code {returncode}")
+        except Exception as e:
+            job.set_status("failed", str(e))
+        finally:
+            # The output is kept in memory, so the files are no longer needed
+            if workdir:
+                shutil.rmtree(workdir, ignore_errors=True)
+
+
 def prompt_ai(code, context):
-    """Runs the pyaiprompt script with the given code and context inputs and returns the output as a string."""
-    print(code + "
-") # Added a "+" operator to concatenate strings
-    print(context + "
-") # Added a "+" operator to concatenate strings
-    # Create the directory for the pyaiprompt script and its input and output files if it does not exist
-    if not os.path.exists(pyaiDir):
-        os.mkdir(pyaiDir) # Fixed a typo from os.makedir to os.mkdir
-    # Write the code and context inputs to their respective files
-    with open (codefile, "w") as f:
-        f.write(code)
-    with open (contextfile, "w") as f:
-        f.write(context)
-    # Run the pyaiprompt script using subprocess.run and wait for it to finish
-    process = subprocess.run([sys.executable, pyai]) # Fixed a syntax error from subprocess.Popen to subprocess.run
-    # Read the output from the output file and return it as a string
-    with open(outputfile, "r") as f:
-        output = f.read()
-    print(output)
-    return output
-
-# Create an XMLRPC server object with a specific IP address and port number
-server = SimpleXMLRPCServer(('192.168.56.101', 8000))
-# Register the shutdown_vm and prompt_ai functions as XMLRPC methods
-server.register_function(shutdown_vm, 'shutdown_vm')
-server.register_function(prompt_ai, 'prompt_ai')
-# Start serving requests until interrupted
-server.serve_forever()
-print("xmlrpc started!")
+    """Starts the pyaiprompt script with the given code and context inputs in the background and returns the job ID."""
+    job = PromptJob(code, context)
+    with jobs_lock:
+        jobs[job.id] = job
+        # Forget the oldest finished jobs
+        finished = [job_id for job_id, old in jobs.items() if old.finished()]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del jobs[job_id]
+    threading.Thread(target=run_job, args=(job,), daemon=True).start()
+    return job.id
+
+
+def get_job(job_id):
+    """Returns the job with the given ID or raises a KeyError that is sent back as a fault."""
+    with jobs_lock:
+        if job_id not in jobs:
+            raise KeyError(f"unknown job {job_id}")
+        return jobs[job_id]
+
+
+def status(job_id):
+    """Returns the status, output length and error message of a job."""
+    job = get_job(job_id)
+    with job.cond:
+        return {'status': job.status, 'length': len(job.output), 'error': job.error}
+
+
+def wait_output(job_id, offset, timeout):
+    """Waits up to timeout seconds until a job has output past offset or has finished,
+    then returns its status, the output after offset and the new offset."""
+    job = get_job(job_id)
+    with job.cond:
+        job.cond.wait_for(lambda: len(job.output) > offset or job.finished(), min(timeout, MAX_WAIT))
+        return {'status': job.status, 'output': job.output[offset:], 'offset': len(job.output), 'error': job.error}
+
+
+def getOutput():
+    """Returns the output of the most recent job so far."""
+    with jobs_lock:
+        if not jobs:
+            return ""
+        job = jobs[next(reversed(jobs))]
+    with job.cond:
+        return job.output
+
+
+class KeepAliveRequestHandler(SimpleXMLRPCRequestHandler):
+    """A request handler that keeps the HTTP connection open between calls."""
+    protocol_version = "HTTP/1.1"
+
+
+class ThreadedXMLRPCServer(socketserver.ThreadingMixIn, SimpleXMLRPCServer):
+    """An XMLRPC server that handles each request in its own thread, so a
+    waiting wait_output call does not block other calls."""
+    daemon_threads = True
+
+
+def main():
+    """Parses the command line arguments and serves XMLRPC requests until interrupted."""
+    global run_slots, worker_pool
+    parser = argparse.ArgumentParser(description="Serve pyaiprompt jobs over XMLRPC.")
+    parser.add_argument("--host", type=str, default="192.168.56.101", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=8000, help="Port to listen on")
+    parser.add_argument("--max-jobs", type=int, default=MAX_JOBS, help="Number of jobs that may run at the same time")
+    parser.add_argument("--warm", action="store_true", help="Keep the pyaiprompt engine loaded in worker processes")
+    parser.add_argument("--recycle-jobs", type=int, default=MAX_JOBS_PER_WORKER, help="Jobs a warm worker runs before it is replaced")
+    parser.add_argument("--recycle-mb", type=float, default=MAX_WORKER_RSS_MB, help="Memory in MB after which a warm worker is replaced")
+    args = parser.parse_args()
+    run_slots = threading.BoundedSemaphore(args.max_jobs)
+    if args.warm:
+        worker_pool = WorkerPool(pyai, args.max_jobs, max_jobs=args.recycle_jobs, max_rss_mb=args.recycle_mb)
+
+    # Create an XMLRPC server object with a specific IP address and port number
+    server = ThreadedXMLRPCServer((args.host, args.port), requestHandler=KeepAliveRequestHandler, allow_none=True)
+    # Register the XMLRPC methods
+    server.register_function(shutdown_vm, 'shutdown_vm')
+    server.register_function(prompt_ai, 'prompt_ai')
+    server.register_function(status, 'status')
+    server.register_function(wait_output, 'wait_output')
+    server.register_function(getOutput, 'getOutput')
+    print("xmlrpc started!")
+    # Start serving requests until interrupted
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+"""
+This module keeps the pyaiprompt engine loaded in long-lived worker processes so that a job
+does not pay for interpreter startup, imports and client setup every time it runs.
+
+A worker process loads the pyaiprompt script once as a module and then takes jobs over a pipe.
+If the module defines generate(code, context), the worker calls it and sends back each piece of
+text it yields (or the string it returns) in memory. Otherwise the worker falls back to running
+the script's main() (or the whole script) in the warm process with the job's PYAI_* file paths,
+and sends back whatever is written to the output file while it runs.
+
+A worker is replaced by a fresh one after a set number of jobs, when its memory use grows past
+a limit, or when it dies.
+"""
+
+import codecs
+import importlib.util
+import multiprocessing
+import os
+import queue
+import resource
+import runpy
+import sys
+import threading
+
+# Number of jobs a worker runs before it is replaced
+MAX_JOBS_PER_WORKER = 50
+
+# Memory use in MB after which a worker is replaced
+MAX_WORKER_RSS_MB = 512
+
+# Seconds between checks of the output file in the fallback mode
+TAIL_INTERVAL = 0.05
+
+# Seconds to wait for a worker to exit before it is killed
+STOP_TIMEOUT = 5
+
+
+def rss_mb():
+    """
+    Returns the resident memory of the current process in MB, or its peak if the current
+    value cannot be read.
+
+    :return: The memory use in MB.
+    :rtype: float
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def load_engine(engine_path):
+    """
+    Loads the pyaiprompt script as a module without running its __main__ block.
+
+    :param engine_path: The path to the pyaiprompt script.
+    :type engine_path: str
+    :return: The loaded module.
+    :rtype: module
+    """
+    sys.path.insert(0, os.path.dirname(engine_path))
+    spec = importlib.util.spec_from_file_location("pyaiprompt", engine_path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["pyaiprompt"] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def _tail(outputfile, conn, stop):
+    # Send new text from the output file over the pipe until stop is set, then send the rest
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    position = 0
+    while True:
+        stopping = stop.is_set()
+        if os.path.exists(outputfile) and os.path.getsize(outputfile) > position:
+            with open(outputfile, "rb") as f:
+                f.seek(position)
+                data = f.read()
+            position += len(data)
+            text = decoder.decode(data)
+            if text:
+                conn.send(("output", text))
+        if stopping:
+            return
+        stop.wait(TAIL_INTERVAL)
+
+
+def _exit_code(e):
+    # Turn a SystemExit into a process return code
+    if e.code is None:
+        return 0
+    return e.code if isinstance(e.code, int) else 1
+
+
+def _run_file_job(engine, engine_path, job, conn):
+    # Run the script's entry point in this process with the job's files and follow its output file
+    old_cwd, old_env = os.getcwd(), dict(os.environ)
+    os.environ.update(PYAI_CODE_FILE=job["codefile"], PYAI_CONTEXT_FILE=job["contextfile"],
+                      PYAI_OUTPUT_FILE=job["outputfile"])
+    os.chdir(job["workdir"])
+    stop = threading.Event()
+    tail = threading.Thread(target=_tail, args=(job["outputfile"], conn, stop), daemon=True)
+    tail.start()
+    try:
+        if callable(getattr(engine, "main", None)):
+            engine.main()
+        else:
+            runpy.run_path(engine_path, run_name="__main__")
+        return 0
+    except SystemExit as e:
+        return _exit_code(e)
+    finally:
+        stop.set()
+        tail.join()
+        os.chdir(old_cwd)
+        os.environ.clear()
+        os.environ.update(old_env)
+
+
+def serve(conn, engine_path):
+    """
+    The body of a worker process. It loads the engine once, then runs the jobs it receives over
+    the pipe until it receives None. For each job it sends ("output", text) messages followed by
+    ("done", returncode, error, rss_mb).
+
+    :param conn: The worker's end of the pipe.
+    :type conn: multiprocessing.connection.Connection
+    :param engine_path: The path to the pyaiprompt script.
+    :type engine_path: str
+    """
+    engine = load_engine(engine_path)
+    conn.send(("ready", os.getpid()))
+    while True:
+        job = conn.recv()
+        if job is None:
+            return
+        returncode, error = 0, ""
+        try:
+            if callable(getattr(engine, "generate", None)):
+                result = engine.generate(job["code"], job["context"])
+                for text in [result] if isinstance(result, str) else result:
+                    conn.send(("output", text))
+            else:
+                returncode = _run_file_job(engine, engine_path, job, conn)
+        except SystemExit as e:
+            returncode = _exit_code(e)
+        except Exception as e:
+            returncode, error = 1, f"{type(e).__name__}: {e}"
+        conn.send(("done", returncode, error, rss_mb()))
+
+
+class WarmWorker:
+    """
+    The parent side of one worker process. The process is started on first use and replaced
+    after max_jobs jobs, once it uses more than max_rss_mb, or if it dies.
+
+    :param engine_path: The path to the pyaiprompt script.
+    :type engine_path: str
+    :param max_jobs: The number of jobs to run before replacing the process.
+    :type max_jobs: int
+    :param max_rss_mb: The memory use in MB after which the process is replaced.
+    :type max_rss_mb: float
+    """
+
+    def __init__(self, engine_path, max_jobs=MAX_JOBS_PER_WORKER, max_rss_mb=MAX_WORKER_RSS_MB):
+        self.engine_path = engine_path
+        self.max_jobs = max_jobs
+        self.max_rss_mb = max_rss_mb
+        self.jobs = 0
+        self.recycled = 0
+        self._process = None
+        self._conn = None
+        # Spawn rather than fork, since the XMLRPC server that owns the worker is threaded
+        self._context = multiprocessing.get_context("spawn")
+
+    def start(self):
+        """Starts the worker process and waits until the engine is loaded."""
+        parent_conn, child_conn = self._context.Pipe()
+        self._process = self._context.Process(target=serve, args=(child_conn, self.engine_path), daemon=True)
+        self._process.start()
+        child_conn.close()
+        self._conn = parent_conn
+        self.jobs = 0
+        try:
+            self._conn.recv()
+        except EOFError:
+            self.stop()
+            raise RuntimeError(f"the engine {self.engine_path} failed to load")
+
+    @property
+    def running(self):
+        """bool: Whether the worker process is up."""
+        return self._process is not None and self._process.is_alive()
+
+    def stop(self):
+        """Asks the worker process to exit and kills it if it does not."""
+        if self._process is None:
+            return
+        try:
+            self._conn.send(None)
+        except OSError:
+            pass
+        self._process.join(STOP_TIMEOUT)
+        if self._process.is_alive():
+            self._process.kill()
+            self._process.join()
+        self._conn.close()
+        self._process = None
+
+    def run(self, code, context, workdir, on_output):
+        """
+        Runs a job in the worker process, calling on_output with each piece of output as it
+        arrives.
+
+        :param code: The code input.
+        :type code: str
+        :param context: The context input.
+        :type context: str
+        :param workdir: The job's working directory, which holds code.txt, context.txt and output.txt.
+        :type workdir: str
+        :param on_output: Called with each new piece of output.
+        :type on_output: callable
+        :return: The return code and an error message.
+        :rtype: tuple
+        """
+        if not self.running:
+            self.stop()
+            self.start()
+        job = {
+            "code": code,
+            "context": context,
+            "workdir": workdir,
+            "codefile": os.path.join(workdir, "code.txt"),
+            "contextfile": os.path.join(workdir, "context.txt"),
+            "outputfile": os.path.join(workdir, "output.txt"),
+        }
+        try:
+            self._conn.send(job)
+            while True:
+                message = self._conn.recv()
+                if message[0] == "output":
+                    on_output(message[1])
+                elif message[0] == "done":
+                    break
+        except (EOFError, OSError):
+            self.stop()
+            return 1, "the warm worker exited during the job"
+        returncode, error, rss = message[1:]
+        self.jobs += 1
+        # Replace the worker once it has run enough jobs or grown too big
+        if self.jobs >= self.max_jobs or rss > self.max_rss_mb:
+            self.stop()
+            self.recycled += 1
+        return returncode, error
+
+
+class WorkerPool:
+    """
+    A fixed set of warm workers that jobs are handed to as they become free. A worker that was
+    stopped after its job is restarted in the background before it takes the next one, so jobs
+    do not wait for the engine to load.
+
+    :param engine_path: The path to the pyaiprompt script.
+    :type engine_path: str
+    :param size: The number of workers.
+    :type size: int
+    """
+
+    def __init__(self, engine_path, size, **kwargs):
+        self._idle = queue.Queue()
+        for i in range(size):
+            worker = WarmWorker(engine_path, **kwargs)
+            worker.start()
+            self._idle.put(worker)
+
+    def run(self, code, context, workdir, on_output):
+        """Runs a job on the next free worker. See WarmWorker.run."""
+        worker = self._idle.get()
+        try:
+            return worker.run(code, context, workdir, on_output)
+        finally:
+            if worker.running:
+                self._idle.put(worker)
+            else:
+                threading.Thread(target=self._restart, args=(worker,), daemon=True).start()
+
+    def _restart(self, worker):
+        # Load the engine in a fresh process, then make the worker available again
+        try:
+            worker.stop()
+            worker.start()
+        finally:
+            self._idle.put(worker)
+
+    def stop(self):
+        """Stops every idle worker."""
+        while True:
+            try:
+                self._idle.get_nowait().stop()
+            except queue.Empty:
+                return
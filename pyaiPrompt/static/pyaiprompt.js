@@ -454,48 +454,145 @@ function pyaiPrompt(pyaiType) {
     let code = editor1.getSelection();
     if (code === '') {
         code = editor1.getValue();
-        code = code.replace(/\+/g, "@PLUS@#@SIGN@");
-        code = code.replace(/\&/g, "@AMPER@#@SIGN@");
     }
     let context = contextBox.value;
     editor2.setValue('Generating...');
     editor2.setOption('readOnly', true);
 
-    // Send a POST request to the /save_files route
-    let xhr = new XMLHttpRequest();
-    xhr.open('POST', '/save_files');
-    xhr.setRequestHeader('Content-Type', 'application/x-www-form-urlencoded');
-    xhr.send(encodeURI('code=' + code + '&context=' + context + '&pyaiType=' + pyaiType));
-
-	// Poll the /get_line route for new data at regular intervals
-	// Use a variable to store the start time of polling
-	let startTime = Date.now();
-	let intervalId = setInterval(function() {
-	    // Use another variable to store the current time
-	    let currentTime = Date.now();
-	    // Check if 8 seconds have passed since the start time
-	    if (currentTime - startTime >= 8000) {
-		let xhr2 = new XMLHttpRequest();
-		xhr2.open('GET', '/get_line');
-		xhr2.onload = function() {
-		    if (xhr2.status === 200) {
-		        let vmoutput = xhr2.responseText;
-		        // Check if vmoutput is "END" or has length 1 or less after 60 seconds
-		        if (vmoutput === "END" || (currentTime - startTime >= 60000 && vmoutput.length <= 1)) {
-		            // Stop polling if we receive the "END" message or timeout
-		            clearInterval(intervalId);
-		        } else {
-		            // Update the value of editor2 with the vmoutput and re-enable it
-		            editor2.setOption('readOnly', false);
-		            editor2.setValue(vmoutput);
-		            // Set the cursor position at the end of editor2 using setCursor method
-		            editor2.setCursor(editor2.lineCount(), 0);
-		        }
-		    }
-		};
-		xhr2.send();
-	    }
-	}, 100);
+    // The message to show if the request fails, set once the server has answered
+    let failure = 'Sorry, the server could not be reached. Please try again.';
+
+    // Send the prompt to the /api/prompt route as JSON, which needs no escaping
+    let body = JSON.stringify({code: code, context: context, pyaiType: pyaiType});
+    encodeBody(body).then(function(request) {
+        return fetch('/api/prompt', {method: 'POST', headers: request.headers, body: request.body});
+    }).then(function(response) {
+        // Start listening for the output once the server has accepted the request
+        if (response.status === 202) {
+            return response.json();
+        }
+        if (response.status === 503) {
+            failure = 'Sorry, the server is busy. Please try again shortly.';
+            throw new Error(response.status);
+        }
+        if (response.status >= 400 && response.status < 500) {
+            // Show why the server rejected the prompt, such as a body that is too large
+            return response.json().catch(function() {
+                return {};
+            }).then(function(reply) {
+                failure = 'Sorry, the prompt was rejected: ' + (reply.error || response.statusText);
+                throw new Error(response.status);
+            });
+        }
+        failure = 'Sorry, something went wrong on the server (' + response.status + '). Please try again.';
+        throw new Error(response.status);
+    }).then(function(job) {
+        // Let the user know when the prompt has to wait for other prompts first
+        if (job.position > 0) {
+            let wait = job.eta ? ', about ' + Math.round(job.eta) + 's' : '';
+            editor2.setValue('Generating... (position ' + job.position + ' in the queue' + wait + ')');
+        }
+        streamOutput(job.job_id);
+    }).catch(function() {
+        editor2.setValue(failure);
+        editor2.setOption('readOnly', false);
+    });
+}
+
+// Bodies longer than this many characters are compressed with gzip where the browser can
+const COMPRESS_THRESHOLD = 32 * 1024;
+
+// Resolves to the headers and body of a JSON request, gzipped if it is large
+function encodeBody(body) {
+    let headers = {'Content-Type': 'application/json'};
+    if (body.length < COMPRESS_THRESHOLD || !window.CompressionStream) {
+        return Promise.resolve({headers: headers, body: body});
+    }
+    let stream = new Blob([body]).stream().pipeThrough(new CompressionStream('gzip'));
+    return new Response(stream).arrayBuffer().then(function(compressed) {
+        headers['Content-Encoding'] = 'gzip';
+        return {headers: headers, body: compressed};
+    });
+}
+
+// Writes streamed code into editor2, appending to what is there instead of resetting the document
+function outputWriter() {
+    let started = false;
+    return function(text, replace) {
+        // Keep the "Generating..." message until there is something to show
+        if (!started && text === '') {
+            return;
+        }
+        if (!started) {
+            // Clear the "Generating..." message and re-enable editor2 on the first output
+            started = true;
+            editor2.setOption('readOnly', false);
+            editor2.setValue('');
+        }
+        if (replace) {
+            editor2.setValue(text);
+        } else {
+            // Append the new text at the end of the document
+            let end = {line: editor2.lastLine(), ch: editor2.getLine(editor2.lastLine()).length};
+            editor2.replaceRange(text, end);
+        }
+        editor2.setCursor(editor2.lineCount(), 0);
+    };
+}
+
+// Follow the job's /stream route and write each new piece of code into editor2 as it arrives
+function streamOutput(jobId) {
+    let write = outputWriter();
+    if (!window.EventSource) {
+        pollOutput(jobId, '0', write);
+        return;
+    }
+    let source = new EventSource('/stream/' + encodeURIComponent(jobId));
+    // The cursor of the last event, which the browser sends back as Last-Event-ID when it reconnects
+    let cursor = '0';
+
+    source.addEventListener('replace', function(e) {
+        cursor = e.lastEventId || cursor;
+        write(JSON.parse(e.data), true);
+    });
+
+    source.addEventListener('append', function(e) {
+        cursor = e.lastEventId || cursor;
+        write(JSON.parse(e.data), false);
+    });
+
+    source.addEventListener('done', function() {
+        // Stop listening, otherwise EventSource would reconnect
+        source.close();
+        editor2.setOption('readOnly', false);
+    });
+
+    source.addEventListener('error', function() {
+        // The browser resumes a dropped stream by itself; if it gave up, poll from the last cursor
+        if (source.readyState === EventSource.CLOSED) {
+            pollOutput(jobId, cursor, write);
+        }
+    });
+}
+
+// Poll the job's output from a cursor, fetching only the text that is new since the last poll
+function pollOutput(jobId, cursor, write) {
+    let url = '/get_line?job_id=' + encodeURIComponent(jobId) + '&offset=' + encodeURIComponent(cursor);
+    fetch(url).then(function(response) {
+        if (!response.ok) {
+            throw new Error(response.status);
+        }
+        return response.json();
+    }).then(function(reply) {
+        write(reply.text, reply.replace);
+        if (reply.done) {
+            editor2.setOption('readOnly', false);
+        } else {
+            setTimeout(function() { pollOutput(jobId, reply.offset, write); }, 200);
+        }
+    }).catch(function() {
+        editor2.setOption('readOnly', false);
+    });
 }
 
 let draggableWidth = parseFloat(draggable.style.width);
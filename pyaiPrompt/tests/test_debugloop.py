@@ -0,0 +1,71 @@
+"""
+Tests for the run cache of DebugLoop.
+
+Usage:
+    python -m pytest tests
+    python -m unittest discover tests
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts"))
+
+from debugloop import DebugLoop
+
+CODE = "print(open('/data/input.txt').read())\n"
+
+
+class DebugLoopTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.runs = []
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def make_loop(self, result, **kwargs):
+        def run(script_path, code):
+            self.runs.append(os.listdir(self.sandbox_dir(script_path)))
+            return result
+        return DebugLoop(self.workdir, run, cache_dir=os.path.join(self.workdir, "cache"), **kwargs)
+
+    def sandbox_dir(self, script_path):
+        with open(script_path) as f:
+            script = f.read()
+        # The last line holds the path the rewrite pointed at the sandbox
+        return os.path.dirname(script.rstrip().split("\n")[-1].split("open('", 1)[1].split("'", 1)[0])
+
+    def test_same_code_is_run_once(self):
+        loop = self.make_loop("PASS")
+        self.assertEqual(loop.check(CODE)[0], "PASS")
+        self.assertEqual(loop.check(CODE)[0], "PASS")
+        self.assertEqual(len(self.runs), 1)
+        self.assertTrue(loop.iterations[1]["cached"])
+
+    def test_timeouts_are_not_cached(self):
+        for result in ("TIMEOUT", "1 of 3 trials failed.\n\n1 trial(s) with random inputs failed with:\nTIMEOUT"):
+            self.runs = []
+            loop = self.make_loop(result)
+            loop.check(CODE)
+            loop.check(CODE)
+            self.assertEqual(len(self.runs), 2, result)
+
+    def test_debugger_errors_are_not_cached(self):
+        loop = self.make_loop("DEBUGGING ERROR:\nboom")
+        loop.check(CODE)
+        loop.check(CODE)
+        self.assertEqual(len(self.runs), 2)
+
+    def test_files_are_only_prepared_when_asked(self):
+        self.make_loop("PASS").check(CODE)
+        self.make_loop("PASS", prepare=False).check(CODE + "\n")
+        self.assertEqual(self.runs, [["input.txt"], []])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,157 @@
+"""
+Tests for the CodeFenceExtractor class and extract_code.
+
+Usage:
+    python -m pytest tests
+    python -m unittest discover tests
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from extractor import CodeFenceExtractor, extract_code
+
+ANSWER = (
+    "Here is the updated code:\n"
+    "\n"
+    "```python\n"
+    "def add(a, b):\n"
+    "    return a + b\n"
+    "```\n"
+    "\n"
+    "[1]: https://www.example.com/\n"
+)
+
+CODE = "def add(a, b):\n    return a + b\n"
+
+
+def feed_in_pieces(text, size):
+    """Feed text to a new extractor size characters at a time and return all the code."""
+    extractor = CodeFenceExtractor()
+    code = "".join(extractor.feed(text[i:i + size]) for i in range(0, len(text), size))
+    return code + extractor.finish(), extractor
+
+
+class CodeFenceExtractorTest(unittest.TestCase):
+
+    def test_whole_answer(self):
+        code, extractor = feed_in_pieces(ANSWER, len(ANSWER))
+        self.assertEqual(code, CODE)
+        self.assertTrue(extractor.opened)
+        self.assertTrue(extractor.closed)
+
+    def test_any_split_gives_the_same_code(self):
+        for size in range(1, 12):
+            code, _ = feed_in_pieces(ANSWER, size)
+            self.assertEqual(code, CODE, f"pieces of {size}")
+
+    def test_fence_split_across_chunks(self):
+        extractor = CodeFenceExtractor()
+        code = extractor.feed("text\n`")
+        code += extractor.feed("``py")
+        self.assertFalse(extractor.opened)
+        code += extractor.feed("\nx = 1\n``")
+        self.assertTrue(extractor.opened)
+        self.assertFalse(extractor.closed)
+        code += extractor.feed("`\n")
+        self.assertTrue(extractor.closed)
+        self.assertEqual(code, "x = 1\n")
+
+    def test_language_tag_on_opening_fence(self):
+        for tag in ("python", "py", "Python3", ""):
+            code, _ = feed_in_pieces(f"```{tag}\nprint(1)\n```\n", 3)
+            self.assertEqual(code, "print(1)\n", tag)
+
+    def test_language_tag_on_its_own_line(self):
+        code, _ = feed_in_pieces("```\npython\nprint(1)\n```\n", 4)
+        self.assertEqual(code, "print(1)\n")
+
+    def test_text_and_footnotes_outside_the_fence(self):
+        answer = ("[1]: https://www.example.com/a\nSome prose first.\n```\nx = [1]\n```\n"
+                  "More prose with ``` in it.\n[2]: https://www.example.com/b\n")
+        code, _ = feed_in_pieces(answer, 5)
+        self.assertEqual(code, "x = [1]\n")
+
+    def test_footnote_inside_the_fence_is_dropped(self):
+        code, _ = feed_in_pieces("```\nx = 1\n[1]: https://www.example.com/\ny = 2\n```\n", 7)
+        self.assertEqual(code, "x = 1\ny = 2\n")
+
+    def test_partial_trailing_line_is_returned_early(self):
+        extractor = CodeFenceExtractor()
+        self.assertEqual(extractor.feed("```\nimport sys\nprint("), "import sys\nprint(")
+        self.assertEqual(extractor.feed("'hi')"), "'hi')")
+        self.assertEqual(extractor.feed("\n"), "\n")
+
+    def test_first_line_held_back_while_it_may_be_a_language_tag(self):
+        extractor = CodeFenceExtractor()
+        self.assertEqual(extractor.feed("```\npy"), "")
+        self.assertEqual(extractor.feed("thon\nx"), "x")
+
+    def test_partial_line_held_back_while_it_may_be_a_fence_or_footnote(self):
+        extractor = CodeFenceExtractor()
+        self.assertEqual(extractor.feed("```\nx = 1\ny = `"), "x = 1\ny = ")
+        self.assertEqual(extractor.feed("`"), "")
+        self.assertEqual(extractor.feed("\n[1"), "``\n")
+        self.assertEqual(extractor.feed("]: https://x\n"), "")
+
+    def test_several_fences_only_the_first_block(self):
+        answer = "```\nfirst = 1\n```\ntext\n```\nsecond = 2\n```\n"
+        code, extractor = feed_in_pieces(answer, 6)
+        self.assertEqual(code, "first = 1\n")
+        self.assertTrue(extractor.closed)
+        self.assertEqual(extractor.feed("```\nthird = 3\n"), "")
+
+    def test_closing_fence_after_code_on_the_same_line(self):
+        code, _ = feed_in_pieces("```\nx = 1```\n", 2)
+        self.assertEqual(code, "x = 1")
+
+    def test_finish_with_unclosed_fence(self):
+        extractor = CodeFenceExtractor()
+        code = extractor.feed("```python\nx = 1\ny = 2")
+        self.assertFalse(extractor.closed)
+        code += extractor.finish()
+        self.assertEqual(code, "x = 1\ny = 2")
+        self.assertEqual(extractor.finish(), "")
+
+    def test_finish_without_pending_text(self):
+        extractor = CodeFenceExtractor()
+        extractor.feed("```\nx = 1\n")
+        self.assertEqual(extractor.finish(), "")
+
+    def test_finish_before_any_fence(self):
+        extractor = CodeFenceExtractor()
+        self.assertEqual(extractor.feed("no code here"), "")
+        self.assertEqual(extractor.finish(), "")
+        self.assertFalse(extractor.opened)
+
+    def test_update_reads_only_the_new_suffix(self):
+        extractor = CodeFenceExtractor()
+        code = ""
+        for end in range(0, len(ANSWER) + 1, 9):
+            code += extractor.update(ANSWER[:end])
+        code += extractor.update(ANSWER) + extractor.finish()
+        self.assertEqual(code, CODE)
+        self.assertEqual(extractor.consumed, len(ANSWER))
+
+    def test_windows_line_endings(self):
+        code, _ = feed_in_pieces(ANSWER.replace("\n", "\r\n"), 4)
+        self.assertEqual(code, CODE)
+
+
+class ExtractCodeTest(unittest.TestCase):
+
+    def test_fenced(self):
+        self.assertEqual(extract_code(ANSWER), CODE.strip())
+
+    def test_without_fence_returns_the_output(self):
+        self.assertEqual(extract_code("  x = 1\n"), "x = 1")
+
+    def test_unclosed_fence(self):
+        self.assertEqual(extract_code("```py\nx = 1\n"), "x = 1")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+"""
+Tests for the errors precheck reports without running a script.
+
+Usage:
+    python -m pytest tests
+    python -m unittest discover tests
+"""
+
+import os
+import subprocess
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts"))
+
+from precheck import check
+
+
+class CheckTest(unittest.TestCase):
+
+    def test_syntax_error(self):
+        self.assertIn("SyntaxError", check("x = (\n", "script.py"))
+
+    def test_undefined_name_at_the_top_level(self):
+        error = check("import sys\nprint(undefined_name)\n", "script.py")
+        self.assertIn("NameError: name 'undefined_name' is not defined", error)
+        self.assertIn('File "script.py", line 2, in <module>', error)
+
+    def test_undefined_name_in_a_function_is_left_to_the_run(self):
+        self.assertIsNone(check("def f():\n    return undefined_name\n", "script.py"))
+
+    def test_stops_after_a_call_that_may_exit(self):
+        source = ("import sys\n\n\ndef main():\n    sys.exit(0)\n\n\nmain()\nprint(undefined_name)\n"
+                  "print('done')\n")
+        self.assertIsNone(check(source, "script.py"))
+        # The script really exits before the undefined name is read
+        result = subprocess.run([sys.executable, "-c", source], capture_output=True, text=True)
+        self.assertEqual(result.returncode, 0, result.stderr)
+
+    def test_stops_after_a_method_call(self):
+        self.assertIsNone(check("import os\nos._exit(0)\nprint(undefined_name)\n", "script.py"))
+
+    def test_stops_after_a_builtin_that_exits(self):
+        self.assertIsNone(check("quit()\nprint(undefined_name)\n", "script.py"))
+
+    def test_continues_after_a_builtin_call(self):
+        error = check("print(len('x'))\nprint(undefined_name)\n", "script.py")
+        self.assertIn("NameError", error)
+
+    def test_shadowed_builtin_is_not_trusted(self):
+        source = "def print(x):\n    raise SystemExit\n\n\nprint(1)\nprint(undefined_name)\n"
+        self.assertIsNone(check(source, "script.py"))
+
+    def test_the_calling_statement_itself_is_checked(self):
+        error = check("def main(x):\n    pass\n\n\nmain(undefined_name)\n", "script.py")
+        self.assertIn("NameError", error)
+
+
+if __name__ == "__main__":
+    unittest.main()
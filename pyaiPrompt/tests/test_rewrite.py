@@ -0,0 +1,82 @@
+"""
+Tests for the sandbox files that prepare_files creates for a rewritten script.
+
+Usage:
+    python -m pytest tests
+    python -m unittest discover tests
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts"))
+
+from rewrite import MAX_COPY_BYTES, MAX_COPY_ENTRIES, make_sandbox_dir, prepare_files, remove_sandbox_dir, rewrite
+
+ORIGINAL = b"original\n"
+
+
+class PrepareFilesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.sandbox_dir = make_sandbox_dir()
+
+    def tearDown(self):
+        remove_sandbox_dir(self.sandbox_dir)
+        shutil.rmtree(self.directory)
+
+    def make_file(self, name, size):
+        path = os.path.join(self.directory, name)
+        with open(path, "wb") as f:
+            f.write(ORIGINAL + b"x" * (size - len(ORIGINAL)))
+        return path
+
+    def run_script(self, source):
+        rewriter = rewrite(source, self.sandbox_dir)
+        prepare_files(rewriter)
+        result = subprocess.run([sys.executable, "-c", rewriter.render()], capture_output=True, text=True)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        return rewriter
+
+    def assertUnchanged(self, path, size):
+        self.assertEqual(os.path.getsize(path), size)
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(len(ORIGINAL)), ORIGINAL)
+
+    def test_large_file_opened_for_writing_is_copied(self):
+        size = MAX_COPY_BYTES + 1024 * 1024
+        path = self.make_file("big.txt", size)
+        self.run_script(f"f = open({path!r}, 'w')\nf.write('clobbered')\nf.close()\n")
+        self.assertUnchanged(path, size)
+        self.assertFalse(os.path.islink(os.path.join(self.sandbox_dir, "big.txt")))
+
+    def test_large_file_written_through_a_variable_is_copied(self):
+        size = MAX_COPY_BYTES + 1024 * 1024
+        path = self.make_file("big.txt", size)
+        self.run_script(f"PATH = {path!r}\nwith open(PATH, 'w') as f:\n    f.write('clobbered')\n")
+        self.assertUnchanged(path, size)
+
+    def test_large_directory_that_is_only_named_is_linked(self):
+        data = os.path.join(self.directory, "data")
+        os.mkdir(data)
+        for i in range(MAX_COPY_ENTRIES + 1):
+            open(os.path.join(data, f"{i}.txt"), "w").close()
+        self.run_script(f"import os\nDATA = {data!r}\nassert len(os.listdir(DATA)) > {MAX_COPY_ENTRIES}\n")
+        self.assertTrue(os.path.islink(os.path.join(self.sandbox_dir, "data")))
+
+    def test_small_directory_is_copied(self):
+        data = os.path.join(self.directory, "data")
+        os.mkdir(data)
+        with open(os.path.join(data, "a.txt"), "w") as f:
+            f.write("a")
+        self.run_script(f"import os\nDATA = {data!r}\nos.remove(os.path.join(DATA, 'a.txt'))\n")
+        self.assertTrue(os.path.exists(os.path.join(data, "a.txt")))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,248 @@
+"""
+This module decodes the body of a request to /api/prompt, which takes the same prompt as
+/save_files as one JSON object instead of a form, and of a request to /api/batch, which takes
+the files of a whole project as a JSON object or as a zip or tar archive. JSON carries the code
+exactly as it was in the editor, with no characters that need escaping by hand, and the
+browser compresses large bodies with gzip and says so in the Content-Encoding header.
+
+Bodies and archives are limited in size after they are decompressed, so that a small
+compressed body cannot make the server unpack gigabytes. Archives are read in memory and never
+extracted to disk.
+
+Dependencies:
+- io: for reading archives from memory
+- json: for the request format
+- posixpath: for checking the paths of archive members
+- tarfile: for tar archives
+- zipfile: for zip archives
+- zlib: for decompressing gzip bodies in bounded steps
+"""
+
+import io
+import json
+import posixpath
+import tarfile
+import zipfile
+import zlib
+
+
+# Largest body in bytes, after decompression, that is accepted
+MAX_BODY_BYTES = 16 * 1024 * 1024
+
+# Content encodings that are accepted, mapped to the zlib window bits that decode them
+ENCODINGS = {'': None, 'identity': None, 'gzip': 16 + zlib.MAX_WBITS, 'deflate': zlib.MAX_WBITS}
+
+# Types of pyai operation a prompt can ask for
+PROMPT_TYPES = ('code', 'debug')
+
+# Largest number of files in a batch
+MAX_BATCH_FILES = 1000
+
+# Suffixes of the archive members that are taken into a batch
+BATCH_SUFFIXES = ('.py',)
+
+# Media types of the archives a batch can be sent as
+ARCHIVE_TYPES = ('application/zip', 'application/x-tar', 'application/gzip', 'application/x-gzip',
+                 'application/octet-stream')
+
+
+class PayloadError(Exception):
+    """Raised when a request body is not a valid prompt or batch.
+
+    Attributes:
+        status (int): The HTTP status code to answer with
+    """
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def decompress(data, encoding='', limit=MAX_BODY_BYTES):
+    """Undo the content encoding of a request body.
+
+    Args:
+        data (bytes): The body as it was sent
+        encoding (str): The Content-Encoding header, or an empty string
+        limit (int): The largest decompressed size accepted
+
+    Returns:
+        bytes: The decompressed body
+
+    Raises:
+        PayloadError: If the encoding is not supported, the data is corrupt or the body is
+            larger than the limit
+    """
+    encoding = encoding.strip().lower()
+    if encoding not in ENCODINGS:
+        raise PayloadError(f"unsupported content encoding {encoding!r}", 415)
+    wbits = ENCODINGS[encoding]
+    if wbits is None:
+        body = data
+    else:
+        decompressor = zlib.decompressobj(wbits)
+        try:
+            # Ask for one byte more than the limit to tell a body that fits from one that does not
+            body = decompressor.decompress(data, limit + 1)
+        except zlib.error as e:
+            raise PayloadError(f"corrupt {encoding} body: {e}")
+        if not decompressor.eof and len(body) <= limit:
+            raise PayloadError(f"truncated {encoding} body")
+    if len(body) > limit:
+        raise PayloadError(f"the body is larger than {limit} bytes", 413)
+    return body
+
+
+def decode_prompt(data, encoding='', limit=MAX_BODY_BYTES):
+    """Decode the JSON body of a prompt.
+
+    Args:
+        data (bytes): The body as it was sent
+        encoding (str): The Content-Encoding header, or an empty string
+        limit (int): The largest decompressed size accepted
+
+    Returns:
+        dict: The code, context and pyaiType strings and the nocache flag
+
+    Raises:
+        PayloadError: If the body cannot be decoded or is missing a field
+    """
+    prompt = _decode_json(decompress(data, encoding, limit))
+    code = prompt.get('code')
+    if not isinstance(code, str):
+        raise PayloadError("code must be a string")
+    return dict(_prompt_options(prompt), code=code)
+
+
+def decode_batch(data, encoding='', content_type='application/json', params=None, limit=MAX_BODY_BYTES):
+    """Decode the body of a batch, a JSON object with the files by their paths, or an archive
+    with the options in the query string.
+
+    Args:
+        data (bytes): The body as it was sent
+        encoding (str): The Content-Encoding header, or an empty string
+        content_type (str): The media type of the body
+        params (dict): The query string, which holds the options of an archive
+        limit (int): The largest decompressed size accepted
+
+    Returns:
+        dict: The files, the context and pyaiType strings, the nocache flag and the parallelism,
+        or None for the server's default
+
+    Raises:
+        PayloadError: If the body cannot be decoded, is missing a field or holds too many files
+    """
+    body = decompress(data, encoding, limit)
+    if content_type == 'application/json':
+        batch = _decode_json(body)
+        files = batch.get('files')
+        if not isinstance(files, dict) or not all(isinstance(code, str) for code in files.values()):
+            raise PayloadError("files must be an object of sources by their paths")
+    elif content_type in ARCHIVE_TYPES:
+        batch = dict(params or {})
+        files = read_archive(body, limit)
+    else:
+        raise PayloadError(f"unsupported media type {content_type!r}", 415)
+    if not files:
+        raise PayloadError("the batch has no files")
+    if len(files) > MAX_BATCH_FILES:
+        raise PayloadError(f"the batch has more than {MAX_BATCH_FILES} files", 413)
+    parallelism = batch.get('parallelism')
+    if parallelism is not None:
+        try:
+            parallelism = int(parallelism)
+        except (TypeError, ValueError):
+            raise PayloadError("parallelism must be a number")
+    return dict(_prompt_options(batch), files=files, parallelism=parallelism)
+
+
+def read_archive(data, limit=MAX_BODY_BYTES, suffixes=BATCH_SUFFIXES):
+    """Read the source files of a zip or tar archive, which may be compressed, in memory.
+
+    Args:
+        data (bytes): The archive
+        limit (int): The largest total size of the files accepted
+        suffixes (tuple): The suffixes of the files to read
+
+    Returns:
+        dict: The source of each file by its path in the archive
+
+    Raises:
+        PayloadError: If the data is not an archive, a file is not UTF-8 or the files are
+            larger than the limit
+    """
+    files = {}
+    total = 0
+    try:
+        for path, size, read in _members(data):
+            path = _member_path(path)
+            if path is None or not path.endswith(suffixes):
+                continue
+            if len(files) >= MAX_BATCH_FILES:
+                raise PayloadError(f"the batch has more than {MAX_BATCH_FILES} files", 413)
+            total += size
+            if total > limit:
+                raise PayloadError(f"the files are larger than {limit} bytes", 413)
+            # Read one byte more than the member says, in case its header lies
+            source = read(size + 1)
+            if len(source) > size:
+                raise PayloadError(f"{path} is larger than its archive header says")
+            try:
+                files[path] = source.decode('utf-8')
+            except UnicodeDecodeError:
+                raise PayloadError(f"{path} is not UTF-8 text")
+    except (tarfile.TarError, zipfile.BadZipFile, EOFError, OSError, zlib.error) as e:
+        raise PayloadError(f"corrupt archive: {e}")
+    return files
+
+
+def _members(data):
+    # The path, size and a function that reads each regular file of an archive
+    if zipfile.is_zipfile(io.BytesIO(data)):
+        archive = zipfile.ZipFile(io.BytesIO(data))
+        for info in archive.infolist():
+            if not info.is_dir():
+                yield info.filename, info.file_size, lambda n, info=info: archive.open(info).read(n)
+        return
+    try:
+        archive = tarfile.open(fileobj=io.BytesIO(data), mode='r:*')
+    except tarfile.ReadError:
+        raise PayloadError("the body is not a zip or tar archive", 415)
+    for member in archive:
+        if member.isfile():
+            yield member.name, member.size, lambda n, member=member: archive.extractfile(member).read(n)
+
+
+def _member_path(path):
+    # The path of an archive member relative to the archive's root, or None if it leaves the root
+    path = posixpath.normpath(path.replace('\\', '/'))
+    if path.startswith(('/', '../')) or path in ('.', '..'):
+        return None
+    return path
+
+
+def _decode_json(body):
+    # The JSON object of a body
+    try:
+        value = json.loads(body)
+    except ValueError as e:
+        # UnicodeDecodeError and JSONDecodeError are both ValueErrors
+        raise PayloadError(f"the body is not valid JSON: {e}")
+    if not isinstance(value, dict):
+        raise PayloadError("the body must be a JSON object")
+    return value
+
+
+def _prompt_options(values):
+    # The context, pyaiType and nocache flag of a prompt or batch
+    context = values.get('context', '')
+    pyaiType = values.get('pyaiType')
+    if not isinstance(context, str):
+        raise PayloadError("context must be a string")
+    if pyaiType not in PROMPT_TYPES:
+        raise PayloadError(f"pyaiType must be one of {', '.join(PROMPT_TYPES)}")
+    nocache = values.get('nocache')
+    # Options from a query string are strings, where an empty string or "0" means no
+    if isinstance(nocache, str):
+        nocache = nocache not in ('', '0', 'false')
+    return {'context': context, 'pyaiType': pyaiType, 'nocache': bool(nocache)}